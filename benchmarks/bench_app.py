@@ -0,0 +1,212 @@
+"""
+Benchmark the app's hot paths headless: refreshing feeds, building the menu and opening MRs.
+
+    python -m benchmarks.bench_app [--scenarios 1x10 10x500 50x1000] [--latency 0.02] [--repeat 3]
+    python -m benchmarks.bench_app --save    # store the results as the baseline
+    python -m benchmarks.bench_app --check   # fail if any result regressed from the baseline
+
+Scenarios are FEEDSxENTRIES: that many synthetic feeds of that many MRs each, served by a local HTTP server answering
+after `--latency` seconds. `rumps` is replaced by `headless`, so this runs anywhere. For every scenario it measures the
+wall time (best of `--repeat` runs) and the peak memory allocated (`tracemalloc`) of:
+
+- `refresh`: fetching, parsing and displaying every feed, starting from an empty app,
+- `build_menu`: displaying all those MRs in an empty menu,
+- `open_url`: clicking a MR (the mean of clicking every one of them).
+
+Baselines are stored in `baselines.json`, next to this file. They depend on the machine they were measured on: save
+your own before changing anything, then check against them.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from unittest.mock import patch
+
+from benchmarks import headless
+
+headless.install()
+
+from benchmarks.feeds import generate_feed  # noqa: E402
+from benchmarks.server import FeedServer  # noqa: E402
+from main import MergeRequestsMonitorApp  # noqa: E402
+
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_SCENARIOS = ["1x10", "1x5000", "10x500", "50x10", "50x1000"]
+# results are noisy: only slowdowns above these ratios, and above a millisecond, are regressions
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.2
+MIN_TIME_REGRESSION = 0.001
+# requests a second to the local server, enough for no feed to ever wait for a token
+BENCH_RATE_LIMIT = 1_000_000
+
+
+def parse_scenario(scenario):
+    feeds, entries = scenario.lower().split("x")
+    return int(feeds), int(entries)
+
+
+def generate_feeds(feeds, entries):
+    return {
+        f"/group/project-{i}/-/merge_requests.atom": generate_feed(entries, project=f"group/project-{i}")
+        for i in range(feeds)
+    }
+
+
+def new_app(feed_urls, parser):
+    """An app displaying nothing yet, without any state from previous runs."""
+    app = MergeRequestsMonitorApp()
+    # startup runs inline headless: the history it opened would be left open by every run, and carry the MRs over
+    if app.history is not None:
+        app.history.close()
+    app.history_retention, app.history = 0, None
+    app.feed_urls = feed_urls
+    app.engine.feed_parser = parser
+    # the local server takes any load: waiting for tokens would measure the rate limit rather than the app
+    app.engine.rate_limit = BENCH_RATE_LIMIT
+    app.engine.feeds = {}
+    app.merge_requests = []
+    app.build_menu()
+    return app
+
+
+def measure(setup, run, repeat):
+    """Return the best wall time of `run(setup())` out of `repeat` runs, and its peak memory."""
+    best = float("inf")
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - started)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def bench_scenario(scenario, parser, latency, repeat):
+    feeds, entries = parse_scenario(scenario)
+    with FeedServer(generate_feeds(feeds, entries), latency=latency) as server:
+        feed_urls = [server.url(path) for path in server.feeds]
+
+        def refreshed_app():
+            app = new_app(feed_urls, parser)
+            app.refresh(None).join()
+            return app
+
+        loaded = refreshed_app()
+        merge_requests = loaded.merge_requests
+        assert len(merge_requests) == feeds * entries, f"{scenario}: got {len(merge_requests)} MRs"
+
+        def app_with_merge_requests():
+            app = new_app(feed_urls, parser)
+            app.merge_requests = merge_requests
+            return app
+
+        def click_every_merge_request(app):
+            for item in items:
+                app.open_url(item)
+
+        results = {}
+        results["refresh"] = measure(lambda: new_app(feed_urls, parser), lambda app: app.refresh(None).join(), repeat)
+        results["build_menu"] = measure(app_with_merge_requests, lambda app: app.build_menu(), repeat)
+
+        # MRs of long menus are in project submenus, filled when they're opened
+        for key in loaded.menu_groups:
+            loaded.populate_group(key)
+        items = [
+            item
+            for parent in [loaded.menu_items, *(loaded.menu_items[key] for key in loaded.menu_groups)]
+            for item in parent.values()
+            if getattr(item, "link", None)
+        ]
+        with patch("main.webbrowser.open_new_tab", new=lambda url: True):
+            elapsed, peak = measure(lambda: loaded, click_every_merge_request, repeat)
+        results["open_url"] = (elapsed / len(items), peak)
+
+    return {operation: {"seconds": seconds, "peak_bytes": peak} for operation, (seconds, peak) in results.items()}
+
+
+def regressions(results, baseline, time_tolerance, memory_tolerance):
+    """Yield a description of every result worse than its baseline beyond the tolerances."""
+    for scenario, operations in results.items():
+        for operation, result in operations.items():
+            base = baseline.get(scenario, {}).get(operation)
+            if base is None:
+                continue
+
+            seconds, base_seconds = result["seconds"], base["seconds"]
+            if seconds > base_seconds * (1 + time_tolerance) and seconds - base_seconds > MIN_TIME_REGRESSION:
+                yield f"{scenario} {operation}: {format_seconds(seconds)}, baseline {format_seconds(base_seconds)}"
+
+            peak, base_peak = result["peak_bytes"], base["peak_bytes"]
+            if peak > base_peak * (1 + memory_tolerance):
+                yield f"{scenario} {operation}: {peak / 1024:,.0f}KB peak, baseline {base_peak / 1024:,.0f}KB"
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def format_seconds(seconds):
+    if seconds < 0.001:
+        return f"{seconds * 1_000_000:.1f}µs"
+    return f"{seconds * 1000:.1f}ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--parser", choices=["feedparser", "streaming"], default="streaming")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with an error when results regressed")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    settings = {"parser": args.parser, "latency": args.latency}
+    baselines = load_baselines()
+    baseline = baselines.get("results", {}) if baselines.get("settings") == settings else {}
+
+    print(f"{'scenario':>9} {'operation':>11} {'time':>12} {'peak memory':>12} {'vs baseline':>12}")
+    results = {}
+    for scenario in args.scenarios:
+        results[scenario] = bench_scenario(scenario, args.parser, args.latency, args.repeat)
+        for operation, result in results[scenario].items():
+            base = baseline.get(scenario, {}).get(operation)
+            change = f"{result['seconds'] / base['seconds'] - 1:>+11.0%}" if base else f"{'-':>11}"
+            print(
+                f"{scenario:>9} {operation:>11} {format_seconds(result['seconds']):>12} "
+                f"{result['peak_bytes'] / 1024:>10,.0f}KB {change}"
+            )
+
+    if args.save:
+        with open(BASELINES_FILE, "w") as f:
+            json.dump({"settings": settings, "results": {**baseline, **results}}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {BASELINES_FILE}")
+
+    if args.check:
+        if not baseline:
+            sys.exit(f"\nNo baseline for {settings}: save one with --save first")
+        failures = list(regressions(results, baseline, args.time_tolerance, args.memory_tolerance))
+        if failures:
+            sys.exit("\nRegressions:\n" + "\n".join(f"  {failure}" for failure in failures))
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare the streaming `atom` parser with `feedparser.parse` on synthetic feeds.
+
+    python -m benchmarks.bench_atom [--sizes 10 100 1000 10000] [--repeat 3]
+
+For every feed size it prints the throughput (entries parsed per second, best of `--repeat` runs) and the peak memory
+allocated while parsing, as measured by `tracemalloc`.
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+import feedparser
+
+from benchmarks.feeds import generate_feed
+from mergerequestsmonitor import atom
+
+PARSERS = {
+    "feedparser": lambda body: feedparser.parse(body),
+    "atom": lambda body: atom.parse(io.BytesIO(body)),
+}
+
+
+def measure(parse, body, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(body)
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'entries':>8} {'feed size':>10} {'parser':>11} {'entries/s':>12} {'peak memory':>12}")
+    for size in args.sizes:
+        body = generate_feed(size)
+        for name, parse in PARSERS.items():
+            elapsed, peak = measure(parse, body, args.repeat)
+            print(
+                f"{size:>8} {len(body) / 1024:>8.0f}KB {name:>11} {size / elapsed:>12,.0f} "
+                f"{peak / 1024 / 1024:>10.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark the app's cold start headless: what `main` imports, and how long until the app shows up and is ready.
+
+    python -m benchmarks.bench_startup [--merge-requests 500] [--repeat 5] [--top 10]
+    python -m benchmarks.bench_startup --check   # fail if a module which should be deferred is imported at startup
+
+Every run starts a fresh interpreter with `python -X importtime`, which imports `main` (with `headless` standing in for
+`rumps`), creates the app from a snapshot of `--merge-requests` MRs and runs what it deferred to the run loop. It
+measures, as the median of `--repeat` runs:
+
+- `import`: importing `main`,
+- `shown`: creating the app, after which the icon and the cached title are displayed,
+- `ready`: what the app does once the run loop started, until the cached MRs are in the menu.
+
+Then it lists the modules imported by `main` taking the longest to import, from the last run. `DEFERRED_MODULES` must
+only be imported by the first refresh: `--check` fails if any of them was imported during startup.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFERRED_MODULES = [
+    "concurrent.futures",
+    "cProfile",
+    "feedparser",
+    "http.client",
+    "http.server",
+    "ssl",
+    "tracemalloc",
+    "urllib.request",
+    "xml.etree.ElementTree",
+]
+
+STARTUP_SCRIPT = """
+import json, sys, time
+from benchmarks import headless
+headless.install()
+
+deferred = []
+sys.modules["PyObjCTools.AppHelper"].callAfter = lambda func, *args: deferred.append((func, args))
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+from mergerequestsmonitor import snapshot
+from mergerequestsmonitor.models import MergeRequest
+merge_requests = [
+    MergeRequest(title=f"MR {{i}}", link=f"https://gitlab.example.com/group/project/-/merge_requests/{{i}}")
+    for i in range({merge_requests})
+]
+with open(headless.application_support(main.APP_NAME) + "/" + main.SNAPSHOT_FILE, "w") as f:
+    snapshot.dump(merge_requests, time.time(), f)
+
+created = time.perf_counter()
+app = main.MergeRequestsMonitorApp()
+shown = time.perf_counter()
+for func, args in deferred:
+    func(*args)
+ready = time.perf_counter()
+
+print(json.dumps({{
+    "import": imported - started,
+    "shown": shown - created,
+    "ready": ready - shown,
+    "deferred_imported": [module for module in {deferred_modules!r} if module in sys.modules],
+}}))
+"""
+
+
+def run_startup(merge_requests):
+    """Start the app in a fresh interpreter and return its timings and its `-X importtime` report."""
+    script = STARTUP_SCRIPT.format(merge_requests=merge_requests, deferred_modules=DEFERRED_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def main_imports(report):
+    """Yield `(cumulative microseconds, module)` for every module imported directly by `main`, from an importtime
+    report: modules are listed after their own imports, indented by two spaces per level.
+    """
+    children = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            # the header line
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 0:
+            if name.strip() == "main":
+                yield from children
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative), name.strip()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--merge-requests", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--check", action="store_true", help="exit with an error when a deferred module is imported")
+    args = parser.parse_args(argv)
+
+    runs = [run_startup(args.merge_requests) for _ in range(args.repeat)]
+    timings = [timing for timing, _ in runs]
+    for step in ("import", "shown", "ready"):
+        print(f"{step:>8}: {statistics.median(timing[step] for timing in timings) * 1000:>8.1f}ms")
+
+    print("\nSlowest imports of main (cumulative, last run):")
+    for cumulative, module in sorted(main_imports(runs[-1][1]), reverse=True)[: args.top]:
+        print(f"{cumulative / 1000:>8.1f}ms  {module}")
+
+    imported = sorted({module for timing in timings for module in timing["deferred_imported"]})
+    if imported:
+        print(f"\nImported at startup instead of the first refresh: {', '.join(imported)}")
+    if args.check:
+        if imported:
+            sys.exit("\nStartup regressed")
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Synthetic Gitlab merge requests Atom feeds for benchmarks.
+
+Entries look like the ones Gitlab emits, summaries, labels and assignees included, since those are what make real feeds
+expensive to parse even though the app ignores them.
+"""
+
+import random
+
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape
+
+FEED_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:media="http://search.yahoo.com/mrss/">
+  <title>{project} merge requests</title>
+  <link href="https://gitlab.example.com/{project}/-/merge_requests.atom" rel="self" type="application/atom+xml"/>
+  <link href="https://gitlab.example.com/{project}/-/merge_requests" rel="alternate" type="text/html"/>
+  <id>https://gitlab.example.com/{project}/-/merge_requests</id>
+  <updated>{updated}</updated>
+{entries}</feed>
+"""
+
+ENTRY_TEMPLATE = """  <entry>
+    <id>https://gitlab.example.com/{project}/-/merge_requests/{iid}</id>
+    <link href="https://gitlab.example.com/{project}/-/merge_requests/{iid}"/>
+    <title>{title}</title>
+    <updated>{updated}</updated>
+    <media:thumbnail width="40" height="40" url="https://gitlab.example.com/uploads/-/system/user/avatar/{author_id}/avatar.png"/>
+    <author>
+      <name>{author}</name>
+      <email>{username}@example.com</email>
+    </author>
+    <summary type="html">{summary}</summary>
+    <content type="html">{summary}</content>
+    <labels>
+      <label>backend</label>
+      <label>needs review</label>
+    </labels>
+    <assignees>
+      <assignee>
+        <name>{author}</name>
+        <email>{username}@example.com</email>
+      </assignee>
+    </assignees>
+    <source_branch>feature-{iid}</source_branch>
+    <target_branch>main</target_branch>
+  </entry>
+"""
+
+WORDS = "fix add remove refactor bump improve cache parser menu feed timer config docs tests api".split()
+AUTHORS = ["Jane Doe", "John Smith", "Ana García", "Wei Zhang", "Olu Adebayo"]
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def format_timestamp(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_feed(entries, project="group/project", seed=0, updated_offset=0):
+    """Return the bytes of a feed of `entries` merge requests for `project`. The same arguments give the same feed.
+
+    `updated_offset` shifts every update timestamp by that many seconds, to simulate changes between two downloads.
+    """
+    rng = random.Random(f"{project}:{seed}")
+    items = []
+    for iid in range(entries, 0, -1):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8)))
+        title = f"Draft: {words}" if rng.random() < 0.2 else words.capitalize()
+        author = rng.choice(AUTHORS)
+        updated = EPOCH + timedelta(minutes=iid * 7, seconds=updated_offset)
+        items.append(
+            ENTRY_TEMPLATE.format(
+                project=project,
+                iid=iid,
+                title=escape(title),
+                updated=format_timestamp(updated),
+                author=author,
+                author_id=AUTHORS.index(author),
+                username=author.split()[0].lower(),
+                summary=escape(f"<p>{words} " * 20 + "</p>"),
+            )
+        )
+
+    return FEED_TEMPLATE.format(
+        project=project,
+        updated=format_timestamp(EPOCH + timedelta(minutes=entries * 7, seconds=updated_offset)),
+        entries="".join(items),
+    ).encode("utf-8")
@@ -0,0 +1,121 @@
+"""
+Just enough of `rumps`, `Foundation` and `PyObjCTools` to run the app without macOS or a display.
+
+Menus are plain ordered dicts and timers never fire, so benchmarks measure the app's own code rather than AppKit's.
+`install` must be called before `main` is imported.
+"""
+
+import os
+import sys
+import tempfile
+import types
+
+from collections import OrderedDict
+
+SUPPORT_DIR = tempfile.mkdtemp(prefix="mrm-bench-")
+
+
+class Menu(OrderedDict):
+    def add(self, item):
+        if item.title not in self:
+            self[item.title] = item
+
+
+class MenuItem(Menu):
+    def __init__(self, title, callback=None, key=None, icon=None, dimensions=None, template=None):
+        super().__init__()
+        self.title = title
+        self.callback = callback
+        self.key = key
+        self.state = 0
+
+    # menu items are dicts of their submenu items, but they're told apart by identity like real ones
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+
+class NSObject:
+    @classmethod
+    def alloc(cls):
+        return cls()
+
+    def init(self):
+        return self
+
+
+class SeparatorMenuItem:
+    title = None
+
+
+class App:
+    def __init__(self, name, title=None, icon=None, template=None, menu=None, quit_button="Quit"):
+        self.name = name
+        self.title = title
+        self.icon = icon
+        self.menu = Menu()
+
+    def open(self, *args):
+        return open(os.path.join(application_support(self.name), args[0]), *args[1:])
+
+    def run(self):
+        raise RuntimeError("headless apps can't run")
+
+
+class Timer:
+    def __init__(self, callback, interval):
+        self.callback = callback
+        self.interval = interval
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def application_support(name):
+    path = os.path.join(SUPPORT_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def clicked(*args, **kwargs):
+    return lambda func: func
+
+
+def _unavailable(*args, **kwargs):
+    raise RuntimeError("dialogs aren't available headless")
+
+
+def call_after(func, *args):
+    # there's no main thread run loop: run callbacks right away, in the calling thread
+    func(*args)
+
+
+def install():
+    """Register the stand-in modules, unless `main` was imported already."""
+    if "main" in sys.modules:
+        raise RuntimeError("headless.install() must be called before importing main")
+
+    rumps = types.ModuleType("rumps")
+    rumps.App = App
+    rumps.Menu = Menu
+    rumps.MenuItem = MenuItem
+    rumps.Timer = Timer
+    rumps.Window = _unavailable
+    rumps.alert = _unavailable
+    rumps.clicked = clicked
+    rumps.quit_application = lambda sender=None: None
+    rumps.rumps = types.SimpleNamespace(SeparatorMenuItem=SeparatorMenuItem, application_support=application_support)
+
+    foundation = types.ModuleType("Foundation")
+    foundation.NSObject = NSObject
+
+    objc_tools = types.ModuleType("PyObjCTools")
+    app_helper = types.ModuleType("PyObjCTools.AppHelper")
+    app_helper.callAfter = call_after
+    objc_tools.AppHelper = app_helper
+
+    sys.modules.update(
+        {"rumps": rumps, "Foundation": foundation, "PyObjCTools": objc_tools, "PyObjCTools.AppHelper": app_helper}
+    )
@@ -0,0 +1,69 @@
+"""
+A local HTTP server standing in for Gitlab while benchmarking.
+
+It serves prepared feeds after a configurable latency, and answers conditional requests with "304 Not Modified" like
+Gitlab does.
+"""
+
+import hashlib
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and bodies are sent separately: with Nagle's algorithm, bodies sent on kept alive connections would wait
+    # for the client's delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+
+        body = self.server.feeds.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServer(ThreadingHTTPServer):
+    """Serves `feeds`, a dict of paths to bodies, on a random local port once started."""
+
+    daemon_threads = True
+
+    def __init__(self, feeds=None, latency=0.0):
+        super().__init__(("127.0.0.1", 0), FeedHandler)
+        self.feeds = feeds if feeds is not None else {}
+        self.latency = latency
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_port}{path}"
@@ -1,20 +1,66 @@
 import configparser
-import html
+import os
+import threading
+import time
 import webbrowser
 
+from collections import Counter
 from datetime import datetime
 
-import feedparser
 import rumps
 
+from Foundation import NSObject
+from PyObjCTools import AppHelper
+
 from __about__ import __version__
+from mergerequestsmonitor import snapshot
+from mergerequestsmonitor.diagnostics import Diagnostics, RefreshTiming, feed_label, format_seconds
+from mergerequestsmonitor.engine import DEFAULT_FEED_PARSER, DEFAULT_FETCH_CONCURRENCY, Engine
+from mergerequestsmonitor.history import DAY, DEFAULT_RETENTION_DAYS, HISTORY_FILE, format_age
+from mergerequestsmonitor.ratelimit import DEFAULT_RATE, parse_rate
+from mergerequestsmonitor.rules import DEFAULT_SECTIONS, Classifier, RuleError
+from mergerequestsmonitor.scheduler import INTERVALS, Scheduler
 
 APP_NAME = "Merge Requests Monitor"
 VERSION = __version__
 DESCRIPTION = "A System Tray app that monitors your merge requests and let you access them quickly."
 ICON_PATH = "media/icon.png"
 DEFAULT_REFRESH_INTERVAL = "5m"
+# up to this many MRs are listed right in the menu, more are grouped by project in submenus
+DEFAULT_MENU_MAX_ITEMS = 30
 DEFAULT_FEED_URL = "https://gitlab.com/<username>/<repo>/-/merge_requests.atom?feed_token=<token>&state=opened"
+SNAPSHOT_FILE = "snapshot.json"
+# snapshots are written to this file first, then moved over the last one
+SNAPSHOT_TEMP_FILE = "snapshot.json.tmp"
+REFRESH_INTERVALS = list(INTERVALS)
+# how often the scheduler is asked whether any feed is due
+TICK_INTERVAL = 15
+USER_AGENT = f"MergeRequestsMonitor/{VERSION} +https://github.com/matagus/merge-requests-monitor"
+# set it to a folder to profile every refresh there, see `diagnostics.profile`
+PROFILE_ENV = "MERGE_REQUESTS_MONITOR_PROFILE"
+GROUP_KEY_PREFIX = "project:"
+OTHER_PROJECTS_KEY = f"{GROUP_KEY_PREFIX}*"
+# section titles are the user's: their keys mustn't clash with the app's own items, like "Preferences"
+SECTION_KEY_PREFIX = "section:"
+# how often the ages of the MRs displayed are brought up to date, when nothing else changed
+MARKERS_TTL = 60 * 60
+# keys of the rows warning about invalid rules, webhooks not received, history not kept, failing feeds and rate limits,
+# which always come first
+WARNING_KEYS = ("rules_error", "webhook_error", "history_error", "feed_errors", "throttled")
+
+
+class SubmenuDelegate(NSObject):
+    """Calls its `callback` right before the submenu it's the delegate of is displayed."""
+
+    def menuNeedsUpdate_(self, menu):
+        self.callback()
+
+
+class MenuDelegate(NSObject):
+    """Calls its `callback` once the menu it's the delegate of was closed."""
+
+    def menuDidClose_(self, menu):
+        self.callback()
 
 
 class MergeRequestsMonitorApp(rumps.App):
@@ -30,80 +76,530 @@ class MergeRequestsMonitorApp(rumps.App):
         # initialize default variables & loan config values
         self.last_updated = "Never"
         self.merge_requests = []
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_pending = False
+        # refreshes and webhooks save snapshots from different threads
+        self.snapshot_lock = threading.Lock()
+        # menu and title updates skipped because nothing they display changed
+        self.skipped = Counter(menu=0, title=0)
 
         config = self.get_or_create_config()
         self.refresh_interval_label = config["refresh_interval"]
+        # the rules as written in the config, kept as they are when saving it even if they're invalid
+        self.hide_rules = config.get("hide", fallback="")
+        self.section_rules = config.get("sections", fallback=DEFAULT_SECTIONS)
+        self.classifier, self.rules_error = self.compile_rules()
+        # the MRs classified last and their sections, see `get_sections`
+        self.sections_cache = (None, None)
+        # fetching feeds and merging their MRs happens in the engine, the app only displays what it returns
+        self.engine = Engine(
+            self.open,
+            Scheduler(max_interval=self.get_refresh_interval(self.refresh_interval_label)),
+            fetch_concurrency=config.getint("fetch_concurrency", fallback=DEFAULT_FETCH_CONCURRENCY),
+            feed_parser=config.get("feed_parser", fallback=DEFAULT_FEED_PARSER),
+            user_agent=USER_AGENT,
+            profile_dir=os.environ.get(PROFILE_ENV),
+            rules=self.classifier,
+            rate_limit=parse_rate(config.get("rate_limit")),
+        )
+        self.diagnostics = Diagnostics(log_path=config.get("diagnostics_log", fallback="") or None)
+        self.menu_max_items = config.getint("menu_max_items", fallback=DEFAULT_MENU_MAX_ITEMS)
+        # where to listen for Gitlab's webhooks, if anywhere, see `start_webhooks`
+        self.webhook_listen = config.get("webhook_listen", fallback="")
+        self.webhook_secret = config.get("webhook_secret", fallback="")
+        self.webhook_server = None
+        self.webhook_error = None
+        # how many days MRs no longer displayed are kept in the history, see `open_history`: 0 keeps none
+        self.history_retention = config.getint("history_retention", fallback=DEFAULT_RETENTION_DAYS)
+        self.history = None
+        self.history_error = None
+        # the text before and after the titles of the MRs displayed which are new or open for a while, by id, and
+        # when they were looked up (see `update_markers`)
+        self.markers = {}
+        self.markers_key = None
         try:
             self.feed_urls = config["feeds"].split(",")
         except KeyError:
             # support for older versions which only has a single feed
             self.feed_urls = [config["feed"]]
 
-        # make this app do what it must do!
+        # show the MRs we already know about while the first refresh runs
+        self.load_snapshot()
+
+        # only what the icon and its title need happens before the run loop starts, the rest right after it
+        self.build_static_menu()
+        self.title = f"{self.count_visible()}"
+        AppHelper.callAfter(self.finish_startup)
+
+    def finish_startup(self):
+        """Display the MRs of the last snapshot and start refreshing, once the app is already showing up."""
+        self.open_history()
+        self.update_markers()
         self.build_menu()
         self.update_title()
         self.start_timer()
+        self.start_webhooks()
 
-    def update_title(self):
-        self.title = f"{len(self.merge_requests)}"
+    def open_history(self):
+        """Open the history of the MRs displayed (see `history`), unless `history_retention` is 0, and forget about
+        their "new" markers once the menu was looked at.
+        """
+        if not self.history_retention:
+            return
 
-    def build_menu(self):
-        self.menu.clear()
+        import sqlite3
 
-        self.menu.add(rumps.MenuItem(f"Last updated: {self.last_updated}"))
+        from mergerequestsmonitor.history import HistoryStore
 
-        refresh_menu = rumps.MenuItem(
-            f"Refresh Interval: {self.refresh_interval_label}",
-            callback=self.set_refresh_interval,
-        )
-        for freq in ["60s", "5m", "10m", "30m", "1h", "3h", "6h"]:
-            refresh_menu.add(rumps.MenuItem(freq, callback=self.set_refresh_interval))
+        try:
+            self.history = HistoryStore(
+                os.path.join(rumps.rumps.application_support(self.name), HISTORY_FILE),
+                retention=self.history_retention * DAY,
+            )
+        except sqlite3.Error as e:
+            self.history_error = e
+            return
+
+        # rumps doesn't expose the NSMenu of the app either: there's none headless
+        menu = getattr(self.menu, "_menu", None)
+        if menu is not None:
+            self.menu_delegate = MenuDelegate.alloc().init()
+            self.menu_delegate.callback = self.menu_closed
+            menu.setDelegate_(self.menu_delegate)
+
+    def record_history(self, merge_requests, changes=None):
+        """Record the MRs displayed in the history, if it's kept. Failing to doesn't fail refreshes: the history just
+        stops being kept.
+        """
+        import sqlite3
+
+        history = self.history
+        if history is None:
+            return
+        try:
+            history.record(merge_requests, changes)
+        except sqlite3.Error as e:
+            # refreshes record it from their thread, while the menu reads it on the main one
+            AppHelper.callAfter(self.disable_history, history, e)
+
+    def disable_history(self, history, error):
+        """Stop keeping the `history` which failed with `error`, unless it was replaced meanwhile. Must run on the main
+        thread.
+        """
+        if self.history is history:
+            self.history, self.history_error = None, error
+
+    def update_markers(self):
+        """Look up in the history which MRs displayed are new, and those open for a day or more, returning whether
+        their markers changed. MRs whose feeds don't tell when they were opened are marked with how long they've been
+        seen instead. Markers are ready to display, so menus don't format them over and over again.
+        """
+        now = time.time()
+        markers = {}
+        if self.history is not None:
+            # ages are in days: their text is the same for many MRs
+            ages = {}
+            for id, (since, opened, new) in self.history.markers(mr.id for mr in self.merge_requests).items():
+                days = int((now - since) // DAY)
+                age = ""
+                if days > 0:
+                    age = ages.get((days, opened))
+                    if age is None:
+                        age = ages[days, opened] = f" · {'' if opened else 'seen '}{format_age(days * DAY)}"
+                if new or age:
+                    markers[id] = ("🆕 " if new else "", age)
+            self.markers_key = (self.history.synced, int(now // MARKERS_TTL))
+
+        changed = markers != self.markers
+        self.markers = markers
+        return changed
+
+    def markers_expired(self):
+        """Whether the markers must be looked up again although the MRs didn't change: they were looked up before the
+        history caught up with the MRs, or long enough ago for their ages to be off.
+        """
+        if self.history is None:
+            return False
+        return self.markers_key != (self.history.synced, int(time.time() // MARKERS_TTL))
+
+    def menu_closed(self):
+        """The MRs displayed were looked at: they're no longer new."""
+        if self.history is None or not any(new for new, _ in self.markers.values()):
+            return
+        self.history.looked_at()
+        self.update_markers()
+        self.build_menu()
 
-        self.menu.add(refresh_menu)
-        self.menu.add(rumps.rumps.SeparatorMenuItem())
+    def start_webhooks(self):
+        """Listen for Gitlab's webhooks on `webhook_listen` in a background thread, when it's set (see `webhooks`)."""
+        if not self.webhook_listen:
+            return
 
-        if len(self.merge_requests) == 0:
-            self.menu.add(rumps.MenuItem("No pending MRs"))
-        else:
-            draft_merge_requests = [mr for mr in self.merge_requests if "Draft: " in mr.title]
-            merge_requests = [mr for mr in self.merge_requests if "Draft: " not in mr.title]
+        from mergerequestsmonitor.webhooks import WebhookServer, parse_address
 
-            if len(merge_requests) > 0:
-                # This acts as section title
-                self.menu.add(rumps.MenuItem("Merge Requests"))
+        try:
+            self.webhook_server = WebhookServer(
+                parse_address(self.webhook_listen),
+                # rumps isn't thread safe: events are applied on the main thread
+                on_event=lambda event: AppHelper.callAfter(self.apply_event, event),
+                secret=self.webhook_secret or None,
+            )
+        except (OSError, ValueError) as e:
+            # the address is invalid or taken: polling alone keeps the menu up to date
+            self.webhook_error = e
+            self.build_menu()
+            return
+        threading.Thread(target=self.webhook_server.serve_forever, daemon=True).start()
+
+    def apply_event(self, event):
+        """Update the menu with what a webhook `event` told about an MR. Must run on the main thread."""
+        merge_requests, changes = self.engine.apply_event(event, previous=self.merge_requests)
+        if not changes:
+            return
+        self.merge_requests = merge_requests
+        self.record_history(merge_requests, changes)
+        self.update_markers()
+        self.build_menu(changes)
+        self.update_title()
+        self.save_snapshot(merge_requests, time.time())
 
-                for merge_request in merge_requests:
-                    title = html.unescape(merge_request.title)
-                    self.menu.add(rumps.MenuItem(title, callback=self.open_url))
+    def compile_rules(self):
+        """Compile the `hide` and `sections` rules of the config (see `rules`). Invalid rules are replaced with the
+        default ones, and their error is returned too, to be displayed.
+        """
+        try:
+            return Classifier.from_config(self.hide_rules, self.section_rules), None
+        except RuleError as e:
+            return Classifier.from_config(), e
+
+    def get_sections(self):
+        """Return `(title, merge_requests)` for every section of the menu, leaving out the MRs hidden. `merge_requests`
+        are only classified once: every refresh which changed them replaces the list.
+        """
+        classified, sections = self.sections_cache
+        if classified is not self.merge_requests:
+            sections = self.classifier.classify(self.merge_requests)
+            self.sections_cache = (self.merge_requests, sections)
+        return sections
+
+    def count_visible(self):
+        return sum(len(merge_requests) for _, merge_requests in self.get_sections())
 
-            if len(merge_requests) > 0 and len(draft_merge_requests) > 0:
-                self.menu.add(rumps.rumps.SeparatorMenuItem())
+    def update_title(self):
+        title = f"{self.count_visible()}"
+        if self.engine.get_failing_feeds():
+            title += " ⚠️"
 
-            if len(draft_merge_requests) > 0:
-                # This acts as section title
-                self.menu.add(rumps.MenuItem("Draft Merge Requests"))
+        if title == self.title:
+            self.skipped["title"] += 1
+            return
+        self.title = title
 
-                for merge_request in draft_merge_requests:
-                    title = html.unescape(merge_request.title)
-                    self.menu.add(rumps.MenuItem(title, callback=self.open_url))
+    def build_static_menu(self):
+        """Create the menu items which are always there. This happens only once, `build_menu` fills the rest."""
+        self.last_updated_item = rumps.MenuItem(f"Last updated: {self.last_updated}")
 
-        self.menu.add(rumps.rumps.SeparatorMenuItem())
-        self.menu.add(rumps.MenuItem("Preferences", callback=self.set_preferences))
-        self.menu.add(rumps.MenuItem("About", callback=self.about))
-        self.menu.add(rumps.MenuItem("Quit", key="q", callback=self.quit_application))
+        self.refresh_interval_menu = rumps.MenuItem(
+            f"Refresh Interval: {self.refresh_interval_label}",
+            callback=self.set_refresh_interval,
+        )
+        for freq in REFRESH_INTERVALS:
+            item = rumps.MenuItem(freq, callback=self.set_refresh_interval)
+            item.state = int(freq == self.refresh_interval_label)
+            self.refresh_interval_menu.add(item)
+
+        self.diagnostics_menu = rumps.MenuItem("Diagnostics")
+        self.diagnostics_menu["diagnostics_empty"] = rumps.MenuItem("No refresh yet")
+
+        self.menu.add(self.last_updated_item)
+        self.menu.add(self.refresh_interval_menu)
+        self.menu.add(self.diagnostics_menu)
+        self.menu["separator_header"] = rumps.rumps.SeparatorMenuItem()
+
+        self.footer_items = [
+            ("separator_footer", rumps.rumps.SeparatorMenuItem()),
+            ("Preferences", rumps.MenuItem("Preferences", callback=self.set_preferences)),
+            ("About", rumps.MenuItem("About", callback=self.about)),
+            ("Quit", rumps.MenuItem("Quit", key="q", callback=self.quit_application)),
+        ]
+        for key, item in self.footer_items:
+            self.menu[key] = item
+
+        # (key, title, link) of the rows currently displayed between the header and the footer, and their menu items
+        self.menu_rows = []
+        self.menu_items = {}
+        # the rows of every project's submenu, and those of the submenus actually filled (see `populate_group`)
+        self.menu_groups = {}
+        self.populated_groups = {}
+        self.submenu_delegates = {}
+
+    def get_project_groups(self):
+        """Group the MRs displayed by project, for menus too long to list them all: return `(key, title, rows)` for
+        every project's submenu, sorted by project, each with its own sections.
+
+        There are at most `menu_max_items` groups: the projects which don't fit share an "Other projects" submenu.
+        """
+        projects = {}
+        for section, merge_requests in self.get_sections():
+            for mr in merge_requests:
+                projects.setdefault(mr.project or "(no project)", {}).setdefault(section, []).append(mr)
+        counts = {
+            name: sum(len(merge_requests) for merge_requests in sections.values())
+            for name, sections in projects.items()
+        }
+
+        names = sorted(projects)
+        if len(names) > self.menu_max_items:
+            shown, others = names[: max(self.menu_max_items - 1, 0)], names[max(self.menu_max_items - 1, 0) :]
+        else:
+            shown, others = names, []
+
+        groups = [
+            (f"{GROUP_KEY_PREFIX}{name}", f"{name} ({counts[name]})", self.get_section_rows(projects[name].items()))
+            for name in shown
+        ]
+        if others:
+            rows = []
+            for name in others:
+                rows.append((f"{GROUP_KEY_PREFIX}{name}", name, None))
+                for merge_requests in projects[name].values():
+                    rows.extend(self.get_rows(merge_requests))
+            count = sum(counts[name] for name in others)
+            groups.append((OTHER_PROJECTS_KEY, f"Other projects ({count})", rows))
+        return groups
+
+    def get_menu_rows(self, groups=()):
+        """Return the (key, title, link) rows that should be displayed for `merge_requests`, or for their project
+        `groups` (see `get_project_groups`) when given: those become submenus.
+
+        Only MRs have a link, and separators have no title either.
+        """
+        rows = self.get_warning_rows()
+
+        if self.count_visible() == 0:
+            rows.append(("No pending MRs", "No pending MRs", None))
+            return rows
+
+        if groups:
+            rows.extend((key, title, None) for key, title, _ in groups)
+            return rows
+
+        rows.extend(self.get_section_rows(self.get_sections()))
+        return rows
+
+    def get_section_rows(self, sections):
+        """Return the rows listing the MRs of `sections`, `(title, merge_requests)` pairs, leaving out empty ones."""
+        rows = []
+        for title, merge_requests in sections:
+            if not merge_requests:
+                continue
+            if rows:
+                rows.append((f"separator_{SECTION_KEY_PREFIX}{title}", None, None))
+            # This acts as section title
+            rows.append((f"{SECTION_KEY_PREFIX}{title}", title, None))
+            rows.extend(self.get_rows(merge_requests))
+
+        return rows
+
+    def get_rows(self, merge_requests):
+        """Return the rows of `merge_requests`, with their markers (see `update_markers`) around their titles."""
+        markers = self.markers
+        if not markers:
+            return [(mr.id, mr.title, mr.link) for mr in merge_requests]
+
+        rows = []
+        for mr in merge_requests:
+            marker = markers.get(mr.id)
+            if marker is None:
+                rows.append((mr.id, mr.title, mr.link))
+            else:
+                rows.append((mr.id, f"{marker[0]}{mr.title}{marker[1]}", mr.link))
+        return rows
+
+    def get_warning_rows(self):
+        """Return the rows telling about invalid rules, webhooks which can't be received, failing feeds and hosts
+        which asked to back off, which always come first.
+        """
+        rows = []
+        if self.rules_error is not None:
+            rows.append(("rules_error", f"⚠️ Invalid rules, using the default ones: {self.rules_error}", None))
+
+        if self.webhook_error is not None:
+            rows.append(("webhook_error", f"⚠️ Not listening for webhooks: {self.webhook_error}", None))
+
+        if self.history_error is not None:
+            rows.append(("history_error", f"⚠️ History not kept: {self.history_error}", None))
+
+        failing_feeds = self.engine.get_failing_feeds()
+        if failing_feeds:
+            rows.append(("feed_errors", f"⚠️ Failing feeds: {len(failing_feeds)}, showing their last known MRs", None))
+
+        throttled_hosts = self.engine.get_throttled_hosts()
+        if throttled_hosts:
+            hosts = ", ".join(
+                f"{host} until {datetime.fromtimestamp(until).strftime('%H:%M')}"
+                for host, until in sorted(throttled_hosts.items())
+            )
+            rows.append(("throttled", f"⏳ Rate limited by {hosts}, showing the last known MRs", None))
+        return rows
+
+    def new_menu_item(self, title, link):
+        if title is None:
+            return rumps.rumps.SeparatorMenuItem()
+        if link is None:
+            # section titles and placeholders do nothing when clicked
+            return rumps.MenuItem(title)
+        return rumps.MenuItem(title, callback=self.open_url)
+
+    def get_menu_item(self, key, title, link):
+        item = self.menu_items.get(key)
+        if item is None:
+            item = self.new_menu_item(title, link)
+            if key in self.menu_groups:
+                self.new_submenu(key, item)
+            self.menu_items[key] = item
+        elif title is not None and item.title != title:
+            item.title = title
+
+        if link is not None:
+            # keep the link on the item itself so that clicks don't need to look for the MR
+            item.link = link
+
+        return item
+
+    def new_submenu(self, key, item):
+        """Make `item` the submenu of group `key`, to be filled by `populate_group` right before it opens."""
+        item[f"{key}:loading"] = rumps.MenuItem("Loading…")
+        # rumps doesn't expose the NSMenu of submenus: there's none headless, where groups are filled when asked to
+        menu = getattr(item, "_menu", None)
+        if menu is not None:
+            delegate = SubmenuDelegate.alloc().init()
+            delegate.callback = lambda: self.populate_group(key)
+            menu.setDelegate_(delegate)
+            # menus don't retain their delegate
+            self.submenu_delegates[key] = delegate
+
+    def populate_group(self, key):
+        """Fill the submenu of group `key` with its MRs, unless it shows them already."""
+        rows = self.menu_groups.get(key)
+        item = self.menu_items.get(key)
+        if rows is None or item is None or self.populated_groups.get(key) == rows:
+            return
+
+        for child in list(item.keys()):
+            del item[child]
+        for child, title, link in rows:
+            item[child] = self.new_menu_item(title, link)
+            if link is not None:
+                item[child].link = link
+        self.populated_groups[key] = rows
+
+    def build_menu(self, changes=None):
+        """Update the menu to display `merge_requests`, touching only the rows that changed since the last call.
+
+        Rows are keyed by MR id, so existing menu items are reused and just retitled when needed. Rows after the first
+        difference with the current menu are re-inserted (rumps can only append) and nothing is done at all when the
+        rows didn't change. When the `changes` of a refresh (see `snapshot.merge`) are given and there are none, rows
+        aren't even built unless the failing feeds changed.
+        """
+        last_updated = f"Last updated: {self.last_updated}"
+        if self.last_updated_item.title != last_updated:
+            self.last_updated_item.title = last_updated
+
+        if changes is not None and not changes:
+            shown_warning_rows = [row for row in self.menu_rows[: len(WARNING_KEYS)] if row[0] in WARNING_KEYS]
+            if self.get_warning_rows() == shown_warning_rows:
+                self.skipped["menu"] += 1
+                return
 
-    def start_timer(self):
-        freq_interval = self.get_refresh_interval(self.refresh_interval_label)
+        if self.count_visible() > self.menu_max_items:
+            groups = self.get_project_groups()
+        else:
+            groups = []
+        # submenus are only filled again once they're opened, and only when their MRs changed
+        self.menu_groups = {key: rows for key, _, rows in groups}
+        self.populated_groups = {
+            key: rows for key, rows in self.populated_groups.items() if self.menu_groups.get(key) == rows
+        }
+
+        rows = self.get_menu_rows(groups)
+        if rows == self.menu_rows:
+            self.skipped["menu"] += 1
+            return
+
+        unchanged = 0
+        for (key, _, _), (shown_key, _, _) in zip(rows, self.menu_rows):
+            if key != shown_key:
+                break
+            unchanged += 1
+
+        for key, *_ in self.menu_rows[unchanged:] + self.footer_items:
+            if key in self.menu:
+                del self.menu[key]
+
+        for key, title, link in rows:
+            item = self.get_menu_item(key, title, link)
+            if key not in self.menu:
+                self.menu[key] = item
+
+        for key, item in self.footer_items:
+            self.menu[key] = item
+
+        self.menu_rows = rows
+        current_keys = {key for key, _, _ in rows}
+        self.menu_items = {key: item for key, item in self.menu_items.items() if key in current_keys}
+        self.submenu_delegates = {key: item for key, item in self.submenu_delegates.items() if key in current_keys}
+
+    def update_diagnostics_menu(self):
+        """Show the timings of the last refresh, and of each feed it fetched, in the "Diagnostics" submenu."""
+        latest = self.diagnostics.latest
+        if latest is None:
+            return
+
+        rows = [
+            f"Last refresh: {latest.summary()}",
+            f"Mean of the last {len(self.diagnostics)}: {format_seconds(self.diagnostics.mean_seconds() or 0)}",
+            f"Downloaded: {self.engine.fetch_stats['downloaded']}, "
+            f"not modified: {self.engine.fetch_stats['not_modified']}, "
+            f"throttled: {self.engine.fetch_stats['throttled']}",
+            f"Skipped: {self.engine.skipped['unchanged']} unchanged feeds, {self.engine.skipped['merge']} merges, "
+            f"{self.skipped['menu']} menu updates, {self.skipped['title']} title updates",
+        ]
+        rows.extend(f"{feed_label(feed.url)}: {feed.summary()}" for feed in latest.feeds)
+
+        for key in list(self.diagnostics_menu.keys()):
+            del self.diagnostics_menu[key]
+        for i, title in enumerate(rows):
+            self.diagnostics_menu[f"diagnostics_{i}"] = rumps.MenuItem(title)
 
-        self.timer = rumps.Timer(self.refresh, freq_interval)
+    def start_timer(self):
+        """Tick every `TICK_INTERVAL` seconds: the scheduler decides when each feed is actually fetched again."""
+        self.timer = rumps.Timer(self.tick, TICK_INTERVAL)
         self.timer.start()
 
+    def tick(self, sender):
+        """Refresh the feeds which are due, if any, returning the refresh thread (see `refresh`) or `None`."""
+        if self.engine.has_due_feeds(self.feed_urls):
+            return self.refresh(sender, due_only=True)
+        return None
+
     def save_config(self):
         with self.open("config.ini", "w") as f:
             config = configparser.ConfigParser()
             config["Gitlab"] = {
                 "feeds": ",".join(self.feed_urls),
                 "refresh_interval": self.refresh_interval_label,
+                "fetch_concurrency": str(self.engine.fetch_concurrency),
+                "rate_limit": str(self.engine.rate_limit),
+                "feed_parser": self.engine.feed_parser,
+                "diagnostics_log": self.diagnostics.log_path or "",
+                "menu_max_items": str(self.menu_max_items),
+                "hide": self.hide_rules,
+                "sections": self.section_rules,
+                "webhook_listen": self.webhook_listen,
+                "webhook_secret": self.webhook_secret,
+                "history_retention": str(self.history_retention),
             }
             config.write(f)
 
@@ -123,41 +619,124 @@ class MergeRequestsMonitorApp(rumps.App):
                 config["Gitlab"] = {
                     "feeds": f"{DEFAULT_FEED_URL}\n",
                     "refresh_interval": DEFAULT_REFRESH_INTERVAL,
+                    "fetch_concurrency": str(DEFAULT_FETCH_CONCURRENCY),
+                    "rate_limit": str(DEFAULT_RATE),
+                    "feed_parser": DEFAULT_FEED_PARSER,
+                    "menu_max_items": str(DEFAULT_MENU_MAX_ITEMS),
+                    "hide": "",
+                    "sections": DEFAULT_SECTIONS,
+                    "webhook_listen": "",
+                    "webhook_secret": "",
+                    "history_retention": str(DEFAULT_RETENTION_DAYS),
                 }
                 config.write(f)
 
             return _get_config()
 
-    def get_refresh_interval(self, label):
-        return {
-            "60s": 60,
-            "5m": 60 * 5,
-            "10m": 60 * 10,
-            "30m": 60 * 30,
-            "1h": 60 * 60,
-            "3h": 60 * 60 * 3,
-            "6h": 60 * 60 * 12,
-        }[label]
-
-    def refresh(self, sender):
-        self.merge_requests = []
-        for feed_url in self.feed_urls:
-            document = feedparser.parse(feed_url)
-            if document.bozo:
-                self.title = "⚠️"
-                return
-            else:
-                self.merge_requests.extend(document.entries)
+    def load_snapshot(self):
+        """Load the MRs of the last successful refresh, labelled as cached until the next refresh succeeds."""
+        try:
+            with self.open(SNAPSHOT_FILE) as f:
+                merge_requests, fetched_at = snapshot.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        self.merge_requests = merge_requests
+        self.last_updated = f"{datetime.fromtimestamp(fetched_at).strftime('%H:%M')} (cached)"
+
+    def save_snapshot(self, merge_requests, fetched_at):
+        """Replace the last snapshot in one go, so that it's never half written, whichever thread saves it."""
+        folder = rumps.rumps.application_support(self.name)
+        path, temp_path = os.path.join(folder, SNAPSHOT_FILE), os.path.join(folder, SNAPSHOT_TEMP_FILE)
+        with self.snapshot_lock:
+            with open(temp_path, "w") as f:
+                snapshot.dump(merge_requests, fetched_at, f)
+            os.replace(temp_path, path)
 
-        self.last_updated = datetime.now().strftime("%H:%M")
-        self.build_menu()
-        self.update_title()
+    def get_refresh_interval(self, label):
+        return INTERVALS[label]
+
+    def refresh(self, sender, due_only=False):
+        """Start refreshing all the feeds, or only those which are due, in a background thread and return it.
+
+        Only one refresh runs at a time: if there's one in progress this just asks for another round once it's done,
+        so saved preferences get coalesced instead of stacking up, and returns `None`. Scheduled refreshes
+        (`due_only`) don't ask for another round, the next tick takes care of them.
+        """
+        with self.refresh_lock:
+            if self.refresh_thread is not None:
+                self.refresh_pending = self.refresh_pending or not due_only
+                return None
+
+            self.refresh_thread = threading.Thread(
+                target=self.refresh_worker,
+                args=(list(self.feed_urls), due_only),
+                daemon=True,
+            )
+            thread = self.refresh_thread
+
+        thread.start()
+        return thread
+
+    def refresh_worker(self, feed_urls, due_only=False):
+        from mergerequestsmonitor.session import Cancelled
+
+        merge_requests, changes = None, None
+        timing = RefreshTiming()
+        previous = self.merge_requests
+        try:
+            merge_requests, changes = self.engine.fetch_merge_requests(feed_urls, due_only, timing, previous=previous)
+            self.save_snapshot(merge_requests, time.time())
+            # a webhook changed the MRs meanwhile: the `changes` don't tell about everything the history saw
+            self.record_history(merge_requests, changes if previous is self.merge_requests else None)
+        except Cancelled:
+            # the preferences changed or the app is quitting: there's nothing to display nor to record
+            timing = None
+        finally:
+            if timing is not None:
+                timing.finished()
+            # rumps isn't thread safe: hand the new snapshot over to the main thread
+            AppHelper.callAfter(self.apply_refresh, merge_requests, changes, timing, previous)
+
+    def apply_refresh(self, merge_requests, changes=None, timing=None, previous=None):
+        """Swap in the snapshot built by `refresh_worker`, and record its `timing`. Must run on the main thread.
+
+        Cancelled refreshes have neither a snapshot nor a `timing`: they just make way for the next one.
+        """
+        if merge_requests is not None:
+            if previous is not None and previous is not self.merge_requests:
+                # a webhook changed the menu meanwhile: the `changes` are since what it displayed before that
+                changes = None
+            self.merge_requests = merge_requests
+            self.last_updated = datetime.now().strftime("%H:%M")
+            if (changes is None or changes or self.markers_expired()) and self.update_markers():
+                # MRs became new, got older, or the history caught up with MRs it didn't know yet
+                changes = None
+            started = time.perf_counter()
+            self.build_menu(changes)
+            if timing is not None:
+                timing.build_menu_seconds = time.perf_counter() - started
+            self.update_title()
+        elif timing is not None:
+            # the refresh failed
+            self.title = "⚠️"
+
+        if timing is not None:
+            self.diagnostics.record(timing)
+            self.update_diagnostics_menu()
+
+        with self.refresh_lock:
+            self.refresh_thread = None
+            refresh_again, self.refresh_pending = self.refresh_pending, False
+
+        if refresh_again:
+            self.refresh(None)
 
     @rumps.clicked("Preferences")
     def set_preferences(self, sender):
         response = rumps.Window(
             title="Set Preferences",
-            message="Enter your Gitlab's merge requests feed URLs (comma-separated):",
+            message="Enter your Gitlab's merge requests feed URLs or GitHub's pull requests pages (comma-separated):",
             default_text=",".join(self.feed_urls),
             ok="Save",
             cancel="Cancel",
@@ -166,29 +745,38 @@ class MergeRequestsMonitorApp(rumps.App):
         if response.clicked:
             self.feed_urls = [url.strip() for url in response.text.split(",")]
             self.save_config()
+            # a refresh in progress is fetching the previous feeds: the one queued instead starts right away
+            self.engine.cancel()
             self.refresh(None)
 
     @rumps.clicked("Quit")
     def quit_application(self, sender=None):
-        self.timer.stop()
+        # there's no timer yet when quitting before the run loop started
+        timer = getattr(self, "timer", None)
+        if timer is not None:
+            timer.stop()
+        if self.webhook_server is not None:
+            self.webhook_server.shutdown()
+            self.webhook_server.server_close()
+        self.engine.cancel()
+        self.engine.close()
+        if self.history is not None:
+            self.history.close()
         rumps.quit_application(sender)
 
     def open_url(self, sender):
-        for merge_req in self.merge_requests:
-            if html.unescape(merge_req.title) == sender.title:
-                webbrowser.open_new_tab(merge_req.link)
+        webbrowser.open_new_tab(sender.link)
 
     def set_refresh_interval(self, sender):
+        for item in self.refresh_interval_menu.values():
+            item.state = 0
         sender.state = 1  # set the selected item as checked
-        refresh_interval_menu = self.menu.values()[0]
 
         self.refresh_interval = self.get_refresh_interval(sender.title)
-        self.timer.stop()
-        self.timer.interval = self.refresh_interval
-        self.timer.start()
+        self.engine.scheduler.set_max_interval(self.refresh_interval, self.engine.feeds.values())
 
         self.refresh_interval_label = sender.title
-        refresh_interval_menu.title = f"Refresh Interval: {self.refresh_interval_label}"
+        self.refresh_interval_menu.title = f"Refresh Interval: {self.refresh_interval_label}"
         self.save_config()
 
     @rumps.clicked("About")
@@ -0,0 +1,127 @@
+"""
+A small streaming parser for Gitlab's merge requests Atom feeds.
+
+`feedparser` handles any feed out there, but it's slow and memory hungry for what this app needs: it sniffs encodings,
+sanitizes HTML and keeps every element of every entry. This parser reads the document incrementally and only keeps the
+few fields the app uses, dropping each entry's XML as soon as it's done with it.
+
+Documents which aren't Atom feeds, or aren't well-formed XML, raise `UnsupportedFeed` so callers can fall back on
+`feedparser`.
+"""
+
+import io
+
+from xml.etree.ElementTree import ParseError, iterparse
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+FEED_TAG = f"{ATOM}feed"
+ENTRY_TAG = f"{ATOM}entry"
+
+
+class UnsupportedFeed(Exception):
+    pass
+
+
+class AtomEntry:
+    """The fields of a feed entry used by the app. Like feedparser's entries, they can be read with `get` too."""
+
+    __slots__ = ("id", "title", "link", "updated", "author", "published")
+
+    def __init__(self, id=None, title="", link=None, updated=None, author=None, published=None):
+        self.id = id
+        self.title = title
+        self.link = link
+        self.updated = updated
+        self.author = author
+        self.published = published
+
+    def __repr__(self):
+        return f"<AtomEntry: {self.title!r} ({self.link})>"
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+
+class AtomDocument:
+    """Mimics the few attributes of a `feedparser` result which the app looks at."""
+
+    def __init__(
+        self, entries=None, status=None, etag=None, modified=None, bozo=False, bozo_exception=None, fingerprint=None
+    ):
+        self.entries = entries if entries is not None else []
+        self.status = status
+        self.etag = etag
+        self.modified = modified
+        self.bozo = bozo
+        self.bozo_exception = bozo_exception
+        # of the downloaded body (see `feeds.fingerprint`): `entries` are left empty when it's the one already known
+        self.fingerprint = fingerprint
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+
+class MergeRequestsDocument(AtomDocument):
+    """A document coming with ready-made `merge_requests` instead of feed entries, from sources telling more about
+    MRs than feeds do.
+    """
+
+    def __init__(self, merge_requests=None, **kwargs):
+        super().__init__(**kwargs)
+        self.merge_requests = merge_requests if merge_requests is not None else []
+
+
+def _text(element, tag):
+    child = element.find(tag)
+    if child is None or child.text is None:
+        return None
+    return child.text.strip()
+
+
+def _link(element):
+    for link in element.iterfind(f"{ATOM}link"):
+        if link.get("rel", "alternate") == "alternate":
+            return link.get("href")
+    return None
+
+
+def _entry(element):
+    author = element.find(f"{ATOM}author")
+    return AtomEntry(
+        id=_text(element, f"{ATOM}id"),
+        title=_text(element, f"{ATOM}title") or "",
+        link=_link(element),
+        updated=_text(element, f"{ATOM}updated"),
+        author=_text(author, f"{ATOM}name") if author is not None else None,
+        published=_text(element, f"{ATOM}published"),
+    )
+
+
+def iter_entries(source):
+    """Yield an `AtomEntry` for every entry in `source`, a binary file-like object or `bytes`, as they're parsed."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    root = None
+    try:
+        for event, element in iterparse(source, events=("start", "end")):
+            if root is None:
+                if element.tag != FEED_TAG:
+                    raise UnsupportedFeed(f"not an Atom feed: <{element.tag}>")
+                root = element
+
+            elif event == "end" and element.tag == ENTRY_TAG:
+                yield _entry(element)
+                # entries are done with, free them right away
+                root.clear()
+
+    except ParseError as e:
+        raise UnsupportedFeed(str(e)) from e
+
+    if root is None:
+        raise UnsupportedFeed("empty document")
+
+
+def parse(source):
+    """Parse a whole feed from `source` (see `iter_entries`) and return an `AtomDocument`."""
+    return AtomDocument(entries=list(iter_entries(source)))
@@ -0,0 +1,120 @@
+"""
+Polls the feeds without any UI and serves their MRs over HTTP, for Linux servers and anything that can't run the app.
+
+    python -m mergerequestsmonitor.daemon [--state-dir DIR] [--config FILE] [--host 127.0.0.1] [--port 8765]
+
+It reads the same `config.ini` as the app (`feeds`, `refresh_interval`, `fetch_concurrency`, `rate_limit`,
+`feed_parser` and `hide` in its `[Gitlab]` section), keeps the state of its feeds in `--state-dir` and schedules them
+exactly like the app does. The snapshot is served at `http://<host>:<port>/merge_requests.json`, see `server` for the
+protocol. Adding that URL to the app's feeds makes it fetch the daemon instead of Gitlab.
+"""
+
+import argparse
+import configparser
+import os
+import signal
+import threading
+import time
+
+from mergerequestsmonitor import server
+from mergerequestsmonitor.engine import DEFAULT_FEED_PARSER, DEFAULT_FETCH_CONCURRENCY, Engine
+from mergerequestsmonitor.ratelimit import parse_rate
+from mergerequestsmonitor.rules import Classifier
+from mergerequestsmonitor.scheduler import INTERVALS, Scheduler
+from mergerequestsmonitor.session import Cancelled
+
+DEFAULT_STATE_DIR = "~/.merge-requests-monitor"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_REFRESH_INTERVAL = "5m"
+# how often the scheduler is asked whether any feed is due, like the app does
+TICK_INTERVAL = 15
+
+
+def read_config(path):
+    """Return the `[Gitlab]` section of the config file at `path`."""
+    config = configparser.ConfigParser()
+    with open(path) as f:
+        config.read_file(f)
+    return config["Gitlab"]
+
+
+class Daemon:
+    """Refreshes `feed_urls` with `engine` whenever they're due and publishes the result in `store`."""
+
+    def __init__(self, engine, feed_urls, store, tick_interval=TICK_INTERVAL):
+        self.engine = engine
+        self.feed_urls = feed_urls
+        self.store = store
+        self.tick_interval = tick_interval
+        self.merge_requests = []
+        self.stopped = threading.Event()
+
+    def poll(self, due_only=True):
+        """Fetch the feeds, or only those which are due, and publish the MRs. Returns what changed."""
+        self.merge_requests, changes = self.engine.fetch_merge_requests(
+            self.feed_urls, due_only, previous=self.merge_requests
+        )
+        self.store.update(self.merge_requests, time.time())
+        return changes
+
+    def run(self):
+        """Poll every feed, then the ones which are due every `tick_interval` seconds, until `stop` is called."""
+        try:
+            self.poll(due_only=False)
+            while not self.stopped.wait(self.tick_interval):
+                if self.engine.has_due_feeds(self.feed_urls):
+                    self.poll()
+        except Cancelled:
+            pass
+
+    def stop(self, *args):
+        """Stop running, interrupting the poll in progress if any."""
+        self.stopped.set()
+        self.engine.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR, help="where the state of every feed is kept")
+    parser.add_argument("--config", help="the config file, config.ini in the state dir by default")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    state_dir = os.path.expanduser(args.state_dir)
+    os.makedirs(state_dir, exist_ok=True)
+    config = read_config(args.config or os.path.join(state_dir, "config.ini"))
+
+    def open_file(name, mode="r"):
+        return open(os.path.join(state_dir, name), mode)
+
+    engine = Engine(
+        open_file,
+        Scheduler(max_interval=INTERVALS[config.get("refresh_interval", fallback=DEFAULT_REFRESH_INTERVAL)]),
+        fetch_concurrency=config.getint("fetch_concurrency", fallback=DEFAULT_FETCH_CONCURRENCY),
+        feed_parser=config.get("feed_parser", fallback=DEFAULT_FEED_PARSER),
+        rate_limit=parse_rate(config.get("rate_limit")),
+        # only what Gitlab can leave out is: the app hides the rest itself
+        rules=Classifier.from_config(hide=config.get("hide", fallback="")),
+    )
+    feed_urls = [url.strip() for url in config["feeds"].split(",") if url.strip()]
+    store = server.SnapshotStore()
+    daemon = Daemon(engine, feed_urls, store)
+
+    http_server = server.SnapshotServer((args.host, args.port), store)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    print(f"Serving http://{args.host}:{http_server.server_port}{server.SNAPSHOT_PATH}", flush=True)
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.shutdown()
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
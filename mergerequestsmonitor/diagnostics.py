@@ -0,0 +1,211 @@
+"""
+Timings of the last refreshes, to tell which feed is slow, how big it is and where the time goes.
+
+Every refresh records a `RefreshTiming`: how long it took, how long the menu took to update, how many connections it
+opened and bytes it received, and a `FeedTiming` for every feed fetched (HTTP status, bytes once decompressed, time
+spent downloading and parsing, MRs found). `Diagnostics` keeps the last ones in memory and can append them to a JSON
+lines log file too.
+
+`profile` runs a block of code under `cProfile` and `tracemalloc` and dumps what they found.
+"""
+
+import json
+import os
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+from mergerequestsmonitor.models import project_from_link
+
+HISTORY_SIZE = 50
+PROFILE_TOP_ALLOCATIONS = 25
+
+
+def redact(url):
+    """`url` without its query string, where feed and API tokens are."""
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(query="", fragment=""))
+
+
+def feed_label(url):
+    """A short name for the feed at `url`: its project when it's a project's feed."""
+    return project_from_link(url) or urlsplit(url).path.strip("/") or url
+
+
+def format_bytes(size):
+    if size < 1024:
+        return f"{size}B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f}KB"
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def format_seconds(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.2f}s"
+
+
+class FeedTiming:
+    """What fetching a feed took. `parse_seconds` and `bytes` are `None` when they couldn't be measured apart."""
+
+    __slots__ = ("url", "status", "bytes", "fetch_seconds", "parse_seconds", "entries", "error")
+
+    def __init__(self, url, status=None, bytes=None, fetch_seconds=None, parse_seconds=None, entries=None, error=None):
+        self.url = redact(url)
+        self.status = status
+        self.bytes = bytes
+        self.fetch_seconds = fetch_seconds
+        self.parse_seconds = parse_seconds
+        self.entries = entries
+        self.error = error
+
+    def __repr__(self):
+        return f"<FeedTiming: {self.url} {self.summary()}>"
+
+    def add_bytes(self, size):
+        self.bytes = (self.bytes or 0) + size
+
+    def add_parse_seconds(self, seconds):
+        self.parse_seconds = (self.parse_seconds or 0) + seconds
+
+    def summary(self):
+        if self.error is not None:
+            return f"failed after {format_seconds(self.fetch_seconds or 0)}: {self.error}"
+
+        parts = [str(self.status or "-")]
+        if self.bytes is not None:
+            parts.append(format_bytes(self.bytes))
+        timing = format_seconds(self.fetch_seconds or 0)
+        if self.parse_seconds is not None:
+            timing += f" + {format_seconds(self.parse_seconds)} parsing"
+        parts.append(timing)
+        if self.entries is not None:
+            parts.append(f"{self.entries} MRs")
+        return ", ".join(parts)
+
+    def asdict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class RefreshTiming:
+    """What a refresh took, from the first download to the menu update. `connections_opened` and `bytes_received`
+    count the handshakes and the bytes which went over the wire, compressed.
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at if started_at is not None else time.time()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.build_menu_seconds = None
+        self.connections_opened = None
+        self.bytes_received = None
+        self.feeds = []
+
+    def __repr__(self):
+        return f"<RefreshTiming: {self.summary()}>"
+
+    def finished(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def summary(self):
+        summary = f"{len(self.feeds)} feeds in {format_seconds(self.seconds or 0)}"
+        if self.connections_opened is not None:
+            summary += f", {self.connections_opened} connections opened"
+        if self.bytes_received is not None:
+            summary += f", {format_bytes(self.bytes_received)} received"
+        if self.build_menu_seconds is not None:
+            summary += f", menu in {format_seconds(self.build_menu_seconds)}"
+        return summary
+
+    def asdict(self):
+        return {
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "build_menu_seconds": self.build_menu_seconds,
+            "connections_opened": self.connections_opened,
+            "bytes_received": self.bytes_received,
+            "feeds": [feed.asdict() for feed in self.feeds],
+        }
+
+
+class Diagnostics:
+    """The timings of the last `size` refreshes, optionally logged as JSON lines to `log_path`."""
+
+    def __init__(self, size=HISTORY_SIZE, log_path=None):
+        self.history = deque(maxlen=size)
+        self.log_path = log_path
+
+    def __iter__(self):
+        return iter(self.history)
+
+    def __len__(self):
+        return len(self.history)
+
+    @property
+    def latest(self):
+        return self.history[-1] if self.history else None
+
+    def record(self, timing):
+        self.history.append(timing)
+        if self.log_path:
+            try:
+                with open(os.path.expanduser(self.log_path), "a") as f:
+                    f.write(json.dumps(timing.asdict(), separators=(",", ":")) + "\n")
+            except OSError:
+                # a log that can't be written shouldn't break refreshes: stop logging
+                self.log_path = None
+
+    def mean_seconds(self):
+        seconds = [timing.seconds for timing in self.history if timing.seconds is not None]
+        return sum(seconds) / len(seconds) if seconds else None
+
+
+class MeteredReader:
+    """Wraps a binary file-like object, counting the bytes read from it and the time spent reading them."""
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self.f.read(size)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        return data
+
+
+@contextmanager
+def profile(directory, name):
+    """Profile the block with `cProfile` and `tracemalloc`, then write `<name>.prof` and `<name>.memory.txt` in
+    `directory`: the first one can be read with `pstats` or snakeviz, the second one lists the top allocations.
+    """
+    import cProfile
+    import tracemalloc
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+        profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.memory.txt", "w") as f:
+            f.write(f"peak: {format_bytes(peak)}\n\n")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
@@ -0,0 +1,366 @@
+"""
+Everything a refresh does, without any UI: fetching feeds, parsing them and merging their MRs into a snapshot.
+
+The tray app runs an `Engine` in a background thread and displays what it returns. `daemon` runs one on its own and
+serves its snapshots to other apps over HTTP, and those can use it as one of their feeds (see `server`).
+
+Parsers and network modules (`feedparser`, `urllib.request`, `http.client`...) take longer to import than the rest of
+the app together, so they're only imported by the first refresh, and the state of the feeds is only read from disk when
+it's first needed. Creating an `Engine` is therefore cheap enough to happen before the app shows up.
+
+Every download goes through the engine's `session.Session`, so none of them can take longer or be larger than it
+allows, and `cancel` stops a refresh in progress. Its connections are shared by every feed of a host and kept alive
+from a refresh to the next, and responses are compressed: refreshes record how many connections they had to open and
+how many bytes they received. Feeds whose host asks to back off (see `ratelimit`) are postponed rather than failing.
+When given `rules`, a `rules.Classifier`, the engine asks Gitlab to leave out the MRs they would hide rather than
+downloading them (see `Classifier.push_down`).
+
+Feeds are fetched by the `providers.Provider` of their URL: Gitlab's Atom feeds and REST API, daemons, and GitHub,
+whose repositories are fetched many at a time. All of them come back as the same `MergeRequest`s.
+
+Refreshes skip whatever work they can: feeds downloaded again identical to their last version (see
+`feeds.fingerprint`) aren't turned into MRs again, and when no feed changed the snapshot isn't merged again either.
+`skipped` counts both, so idle refreshes can be checked to cost next to nothing.
+"""
+
+import json
+import threading
+import time
+
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+
+from mergerequestsmonitor import feeds as feed_states, snapshot
+from mergerequestsmonitor.diagnostics import FeedTiming, profile
+from mergerequestsmonitor.feeds import FeedState
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.ratelimit import DEFAULT_RATE, Throttled
+
+DEFAULT_FETCH_CONCURRENCY = 8
+DEFAULT_FEED_PARSER = "streaming"
+DEFAULT_USER_AGENT = "MergeRequestsMonitor +https://github.com/matagus/merge-requests-monitor"
+FEED_CACHE_FILE = "feed_cache.json"
+CACHEABLE_STATUSES = (200, 301, 302, 307, 308)
+# webhooks only add MRs no feed lists yet when they're just opened, and show them for this long at most
+NEW_MERGE_REQUEST_ACTIONS = ("open", "reopen")
+PUSHED_TTL = 60 * 60
+
+
+class Engine:
+    """Fetches feeds and merges their MRs, keeping the state of every feed in `FEED_CACHE_FILE`.
+
+    `open_file` opens the files the engine keeps its state in, by name, like `open` does. `profile_dir`, when set, is
+    where every refresh is profiled (see `diagnostics.profile`).
+    """
+
+    def __init__(
+        self,
+        open_file,
+        scheduler,
+        fetch_concurrency=DEFAULT_FETCH_CONCURRENCY,
+        feed_parser=DEFAULT_FEED_PARSER,
+        user_agent=DEFAULT_USER_AGENT,
+        profile_dir=None,
+        rules=None,
+        rate_limit=DEFAULT_RATE,
+    ):
+        self.open_file = open_file
+        self.scheduler = scheduler
+        self.fetch_concurrency = fetch_concurrency
+        self.feed_parser = feed_parser
+        self.user_agent = user_agent
+        self.profile_dir = profile_dir
+        self.rules = rules
+        self.rate_limit = rate_limit
+        self.fetch_stats = Counter(not_modified=0, downloaded=0)
+        # feeds not parsed and snapshots not merged because nothing changed
+        self.skipped = Counter(unchanged=0, merge=0)
+        # the fingerprint of the last snapshot merged, and its MRs
+        self._snapshot = (None, None)
+        self._feeds = None
+        self._session = None
+        # webhooks (see `apply_event`) and refreshes update the feeds from different threads
+        self.lock = threading.RLock()
+        # MRs only known from webhooks so far, by id, with when they were received
+        self.pushed = {}
+
+    @property
+    def feeds(self):
+        """The `FeedState` of every feed by URL, read from `FEED_CACHE_FILE` the first time they're needed."""
+        if self._feeds is None:
+            self._feeds = self.load_feeds()
+        return self._feeds
+
+    @feeds.setter
+    def feeds(self, feeds):
+        self._feeds = feeds
+
+    @property
+    def session(self):
+        """Keeps connections to Gitlab's API and to daemons alive between requests and refreshes."""
+        if self._session is None:
+            from mergerequestsmonitor.session import Session
+
+            self._session = Session(headers={"User-Agent": self.user_agent}, rate_limit=self.rate_limit)
+        return self._session
+
+    def cancel(self):
+        """Interrupt the refresh in progress, if any: `fetch_merge_requests` raises `session.Cancelled` right away."""
+        if self._session is not None:
+            self._session.cancel()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+    def get_throttled_hosts(self):
+        """The hosts which asked to back off, with when they take requests again, as Unix times."""
+        if self._session is None:
+            return {}
+        now = time.time()
+        return {host: now + delay for host, delay in self._session.throttled().items()}
+
+    def get_failing_feeds(self):
+        return [feed for feed in self.feeds.values() if feed.failing]
+
+    def has_due_feeds(self, feed_urls):
+        """Whether any of `feed_urls` should be fetched now, feeds never fetched included."""
+        if any(feed_url not in self.feeds for feed_url in feed_urls):
+            return True
+        return bool(self.scheduler.due(self.feeds.values()))
+
+    def load_feeds(self):
+        """Load the state saved for every feed: their validators and last known MRs."""
+        try:
+            with self.open_file(FEED_CACHE_FILE) as f:
+                data = json.load(f)
+            return {feed_url: FeedState.fromdict(feed_url, feed) for feed_url, feed in data.items()}
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return {}
+
+    def save_feeds(self):
+        with self.open_file(FEED_CACHE_FILE, "w") as f:
+            json.dump({feed_url: feed.asdict() for feed_url, feed in self.feeds.items()}, f)
+
+    def request_url(self, feed_url):
+        """The URL to request `feed_url` at: feeds are still known by the URL they were given as, but requests go to
+        the filtered one (see `Classifier.push_down`).
+        """
+        return self.rules.push_down(feed_url) if self.rules is not None else feed_url
+
+    def fetch_feeds(self, feed_urls):
+        """Download and parse all the feeds in parallel, using at most `fetch_concurrency` threads.
+
+        Feeds are fetched by their `providers.Provider`, and those which a provider can fetch together (see
+        `Provider.batch_key`) take a single thread, and request, between them.
+
+        Returns the documents and their `FeedTiming`s, in the same order as `feed_urls` so the menu order doesn't depend
+        on which feed answered first.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        from mergerequestsmonitor.providers import get_provider
+
+        timings = [FeedTiming(feed_url) for feed_url in feed_urls]
+        batches = {}
+        for i, feed_url in enumerate(feed_urls):
+            provider = get_provider(feed_url)
+            key = provider.batch_key(feed_url)
+            batches.setdefault((provider, i if key is None else key), []).append(i)
+
+        def timed_fetch_batch(provider, indexes):
+            feeds = [self.feeds.get(feed_urls[i]) or FeedState(feed_urls[i]) for i in indexes]
+            batch_timings = [timings[i] for i in indexes]
+            started = time.perf_counter()
+            documents = provider.fetch_batch(self, feeds, batch_timings)
+            # feeds fetched together share the time they took
+            fetch_seconds = (time.perf_counter() - started) / len(indexes)
+            for timing in batch_timings:
+                timing.fetch_seconds = fetch_seconds - (timing.parse_seconds or 0)
+            return documents
+
+        if self.profile_dir:
+            # cProfile only sees the thread it was enabled in
+            results = [timed_fetch_batch(provider, indexes) for (provider, _), indexes in batches.items()]
+        else:
+            max_workers = max(1, min(self.fetch_concurrency, len(batches)))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(timed_fetch_batch, provider, indexes) for (provider, _), indexes in batches.items()
+                ]
+                results = [future.result() for future in futures]
+
+        documents = [None] * len(feed_urls)
+        for indexes, batch_documents in zip(batches.values(), results):
+            for i, document in zip(indexes, batch_documents):
+                documents[i] = document
+        return documents, timings
+
+    def fetch_feed(self, feed_url, timing=None):
+        """Download and parse `feed_url` with its `providers.Provider`, making it a conditional request when it was
+        downloaded before. Bytes downloaded and parsing time are added to `timing` when they can be measured.
+        """
+        from mergerequestsmonitor.providers import get_provider
+
+        feed = self.feeds.get(feed_url) or FeedState(feed_url)
+        return get_provider(feed_url).fetch(self, feed, timing)
+
+    def fetch_merge_requests(self, feed_urls, due_only=False, timing=None, previous=()):
+        """Fetch the feeds in `feed_urls`, or only those which are due, and return the MRs of all of them along with
+        what changed since the `previous` snapshot (see `snapshot.merge`).
+
+        Every feed is updated on its own: feeds answering "304 Not Modified" keep their MRs without parsing anything,
+        and failing feeds keep serving their last known MRs while they wait for a retry (see `FeedState`). Feeds which
+        worked are then scheduled again depending on whether they changed (see `Scheduler`). The timings of every feed
+        fetched are added to `timing`, a `RefreshTiming`.
+
+        Raises `session.Cancelled`, without changing anything, when `cancel` is called in the meantime.
+        """
+        if self.profile_dir:
+            profiling = profile(self.profile_dir, f"refresh-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        else:
+            profiling = nullcontext()
+
+        with profiling:
+            return self._fetch_merge_requests(feed_urls, due_only, timing, previous)
+
+    def _fetch_merge_requests(self, feed_urls, due_only, timing, previous):
+        from mergerequestsmonitor import atom
+
+        # a refresh cancelled before this one doesn't concern it
+        self.session.resume()
+
+        with self.lock:
+            # forget about feeds that are no longer configured
+            self.feeds = {feed_url: self.feeds.get(feed_url) or FeedState(feed_url) for feed_url in feed_urls}
+
+        feeds = self.scheduler.due(self.feeds.values()) if due_only else list(self.feeds.values())
+        connections_opened, bytes_received = self.session.connections_opened, self.session.bytes_received
+        documents, feed_timings = self.fetch_feeds([feed.url for feed in feeds])
+        if timing is not None:
+            timing.connections_opened = self.session.connections_opened - connections_opened
+            timing.bytes_received = self.session.bytes_received - bytes_received
+        with self.lock:
+            now = self.scheduler.clock()
+            for feed, document, feed_timing in zip(feeds, documents, feed_timings):
+                status = document.get("status")
+                feed_timing.status = status if isinstance(status, int) else None
+                if status == 304 and feed.fetched_at is not None:
+                    self.fetch_stats["not_modified"] += 1
+                    feed.not_modified(now)
+                    self.scheduler.schedule(feed, changed=False)
+                elif isinstance(document.get("bozo_exception"), Throttled):
+                    # not the feed's fault: it keeps its MRs until its host takes requests again
+                    self.fetch_stats["throttled"] += 1
+                    feed.postponed(now + document.bozo_exception.delay)
+                elif document.bozo:
+                    feed.failed(document.get("bozo_exception") or "Invalid feed", now)
+                    feed_timing.error = feed.error
+                else:
+                    self.fetch_stats["downloaded"] += 1
+                    if document.get("status") in CACHEABLE_STATUSES:
+                        etag, modified = document.get("etag"), document.get("modified")
+                    else:
+                        etag, modified = None, None
+
+                    fingerprint = document.get("fingerprint")
+                    if not isinstance(fingerprint, str):
+                        # feedparser reads and parses in one go: at least the MRs needn't be built again
+                        fingerprint = feed_states.entries_fingerprint(document.entries)
+                    if feed.is_unchanged(fingerprint):
+                        self.skipped["unchanged"] += 1
+                        feed.unchanged(now, etag=etag, modified=modified)
+                        feed_timing.entries = len(feed.merge_requests)
+                        self.scheduler.schedule(feed, changed=False)
+                        continue
+
+                    if isinstance(document, atom.MergeRequestsDocument):
+                        merge_requests = document.merge_requests
+                    else:
+                        merge_requests = [MergeRequest.from_entry(entry) for entry in document.entries]
+                    changed = feed.succeeded(merge_requests, now, etag=etag, modified=modified, fingerprint=fingerprint)
+                    feed_timing.entries = len(merge_requests)
+                    self.scheduler.schedule(feed, changed=changed)
+
+            self.expire_pushed()
+            self.save_feeds()
+            if timing is not None:
+                timing.feeds.extend(feed_timings)
+            return self.merge_snapshot(previous)
+
+    def merge_snapshot(self, previous):
+        """Merge the MRs of every feed, and those only known from webhooks, into a snapshot and return it with what
+        changed since `previous`. Must be called with `lock` held.
+        """
+        # the MRs of every feed are known by their fingerprints: when none changed, neither did the snapshot
+        fingerprint = feed_states.fingerprint(
+            *(f"{feed.url} {feed.fingerprint}" for feed in self.feeds.values()),
+            *(f"{mr.id} {mr.updated}" for mr, _ in self.pushed.values()),
+        )
+        last_fingerprint, last_merge_requests = self._snapshot
+        if fingerprint == last_fingerprint and previous is last_merge_requests:
+            self.skipped["merge"] += 1
+            return previous, snapshot.Changes([], [], [])
+
+        # feeds overlap (a group's feed and one of its projects' feeds, assigned and authored MRs...)
+        merge_request_lists = [feed.merge_requests for feed in self.feeds.values()]
+        merge_request_lists.append([mr for mr, _ in self.pushed.values()])
+        merge_requests, changes = snapshot.merge(merge_request_lists, previous)
+        self._snapshot = (fingerprint, merge_requests)
+        return merge_requests, changes
+
+    def apply_event(self, event, previous=()):
+        """Apply a webhook's `event` (see `webhooks`) to the MRs of the feeds, and return them like
+        `fetch_merge_requests` does, with what changed since the `previous` snapshot.
+
+        The MR is updated, or removed once merged or closed, in every feed listing it, and those feeds are downloaded
+        in full next time they're due. MRs no feed lists yet are only added when they were just opened, in a project
+        a feed covers, and the `rules` don't hide them: they're kept apart until a feed covering them was fetched
+        again, or lists them, and for `PUSHED_TTL` at most. Polling has the last word.
+        """
+        with self.lock:
+            now = self.scheduler.clock()
+            mr = event.merge_request
+            found = [feed.apply(event) for feed in self.feeds.values()]
+            if event.closed or (mr.id in self.pushed and self.hides(event, now)):
+                self.pushed.pop(mr.id, None)
+            elif not any(found):
+                if mr.id in self.pushed:
+                    known, received_at = self.pushed[mr.id]
+                    self.pushed[mr.id] = (event.merged_with(known), received_at)
+                elif (
+                    event.action in NEW_MERGE_REQUEST_ACTIONS and self.covering_feeds(mr) and not self.hides(event, now)
+                ):
+                    self.pushed[mr.id] = (mr, now)
+            # the fingerprints of the feeds changed were dropped
+            self._snapshot = (None, None)
+            return self.merge_snapshot(previous)
+
+    def covering_feeds(self, merge_request):
+        """The feeds listing the MRs of the project of `merge_request`, as far as their URLs tell."""
+        from mergerequestsmonitor.providers import get_provider
+
+        return [feed for feed in self.feeds.values() if get_provider(feed.url).covers(feed.url, merge_request)]
+
+    def hides(self, event, now):
+        """Whether the `rules` hide the MR of `event`, also knowing what the event tells and feeds don't: those rules
+        would have left it out of the feeds.
+        """
+        return self.rules is not None and self.rules.hides(event.merge_request, now, event.fields)
+
+    def expire_pushed(self):
+        """Forget about the MRs only known from webhooks once the feeds tell about them, once a feed covering them was
+        fetched again since, or after `PUSHED_TTL`. Must be called with `lock` held.
+        """
+        if not self.pushed:
+            return
+        now = self.scheduler.clock()
+        listed = {mr.id for feed in self.feeds.values() for mr in feed.merge_requests}
+        self.pushed = {
+            id: (mr, received_at)
+            for id, (mr, received_at) in self.pushed.items()
+            if id not in listed
+            and now - received_at < PUSHED_TTL
+            and not any((feed.fetched_at or 0) > received_at for feed in self.covering_feeds(mr))
+        }
@@ -0,0 +1,179 @@
+"""
+Per-feed state, so every feed succeeds or fails on its own.
+
+A feed which can't be fetched keeps serving the MRs from its last successful download while it's retried with an
+exponential backoff, and the other feeds keep updating in the meantime. When healthy feeds are fetched again is up to
+the `scheduler`.
+
+Every download also gets a `fingerprint`, so a feed which comes back identical (servers don't always answer "304 Not
+Modified") isn't parsed or merged again.
+"""
+
+import hashlib
+
+from mergerequestsmonitor.models import MergeRequest
+
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 60 * 60
+
+
+def retry_delay(failures):
+    """Seconds to wait before retrying a feed which failed `failures` times in a row."""
+    return min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+
+
+def fingerprint(*chunks):
+    """A short digest of `chunks`, bytes or strings, to tell whether a download changed without parsing it."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        digest.update(chunk if isinstance(chunk, bytes) else str(chunk).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class FingerprintReader:
+    """Wraps a binary file-like object, fingerprinting what's read from it like `fingerprint` does with a whole body."""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.blake2b(digest_size=16)
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+    def fingerprint(self):
+        digest = self.digest.copy()
+        digest.update(b"\0")
+        return digest.hexdigest()
+
+
+def entries_fingerprint(entries):
+    """The fingerprint of parsed feed entries, from what tells MRs and their versions apart."""
+    return fingerprint(
+        *(
+            f"{getattr(entry, 'id', None)}\t{getattr(entry, 'updated', None)}\t{getattr(entry, 'title', None)}"
+            for entry in entries
+        )
+    )
+
+
+class FeedState:
+    """Everything known about a feed: its last good MRs, the validators to download it again, and its errors."""
+
+    def __init__(
+        self, url, merge_requests=None, etag=None, modified=None, fetched_at=None, interval=None, fingerprint=None
+    ):
+        self.url = url
+        self.merge_requests = merge_requests if merge_requests is not None else []
+        self.etag = etag
+        self.modified = modified
+        self.fetched_at = fetched_at
+        # of the last download, see `fingerprint`
+        self.fingerprint = fingerprint
+        # seconds between fetches, and when the next one is due: `None` until a scheduler sets them
+        self.interval = interval
+        self.next_due = None
+
+        self.error = None
+        self.failures = 0
+
+    def __repr__(self):
+        return f"<FeedState: {self.url} ({len(self.merge_requests)} MRs{', failing' if self.error else ''})>"
+
+    @property
+    def failing(self):
+        return self.error is not None
+
+    @property
+    def validators(self):
+        """The `(etag, modified)` to send with the next download. There are none until the feed was downloaded."""
+        if self.fetched_at is None:
+            return None, None
+        return self.etag, self.modified
+
+    def is_due(self, now):
+        """Whether the feed should be fetched at `now`: feeds never fetched are always due."""
+        return self.next_due is None or now >= self.next_due
+
+    def is_unchanged(self, fingerprint):
+        """Whether a download with this `fingerprint` is the same as the last one, so it needn't be parsed."""
+        return fingerprint is not None and fingerprint == self.fingerprint and self.fetched_at is not None
+
+    def succeeded(self, merge_requests, now, etag=None, modified=None, fingerprint=None):
+        """Store the MRs of a successful download, returning whether they changed."""
+        changed = merge_requests != self.merge_requests
+        self.merge_requests = merge_requests
+        self.etag = etag
+        self.modified = modified
+        self.fingerprint = fingerprint
+        self.fetched_at = now
+        self.recovered()
+        return changed
+
+    def not_modified(self, now):
+        self.fetched_at = now
+        self.recovered()
+
+    def unchanged(self, now, etag=None, modified=None):
+        """Like `not_modified`, for a download identical to the last one: only its validators may be new."""
+        self.etag = etag
+        self.modified = modified
+        self.not_modified(now)
+
+    def recovered(self):
+        self.error = None
+        self.failures = 0
+
+    def apply(self, event):
+        """Update the MRs of the feed with what a webhook `event` told about one of them (see `webhooks`), returning
+        whether it's one of them at all. Until the feed is downloaded and parsed again in full, whatever its
+        validators and fingerprint, it's only as right as webhooks.
+        """
+        for i, known in enumerate(self.merge_requests):
+            if known.id == event.merge_request.id:
+                break
+        else:
+            return False
+
+        merge_requests = list(self.merge_requests)
+        if event.closed:
+            del merge_requests[i]
+        else:
+            merge_requests[i] = event.merged_with(known)
+        self.merge_requests = merge_requests
+        self.etag = self.modified = self.fingerprint = None
+        return True
+
+    def postponed(self, until):
+        """Fetch the feed again at `until`, once its host takes requests again: it didn't fail, nor was it fetched."""
+        self.next_due = until
+
+    def failed(self, error, now):
+        self.error = str(error) or type(error).__name__
+        self.failures += 1
+        self.next_due = now + retry_delay(self.failures)
+
+    def asdict(self):
+        """The state worth keeping between runs: errors are forgotten so feeds are retried right after a restart."""
+        return {
+            "etag": self.etag,
+            "modified": self.modified,
+            "fetched_at": self.fetched_at,
+            "interval": self.interval,
+            "fingerprint": self.fingerprint,
+            "merge_requests": [merge_request.astuple() for merge_request in self.merge_requests],
+        }
+
+    @classmethod
+    def fromdict(cls, url, data):
+        return cls(
+            url,
+            merge_requests=[MergeRequest(*fields) for fields in data["merge_requests"]],
+            etag=data["etag"],
+            modified=data["modified"],
+            fetched_at=data["fetched_at"],
+            interval=data.get("interval"),
+            fingerprint=data.get("fingerprint"),
+        )
@@ -0,0 +1,177 @@
+"""
+Fetches the open pull requests of GitHub repositories with GitHub's GraphQL API, many repositories at a time.
+
+Feed URLs are the pull requests pages of repositories, with a token which can read them (a fine-grained token with
+"Pull requests: read" access, or a classic one with `repo` scope for private repositories):
+
+    https://github.com/<owner>/<repo>/pulls?access_token=<token>
+
+GitHub Enterprise servers work the same, at their own host. Instead of a request per repository, all the repositories
+of a server read with the same token (see `batch_key`) are fetched with a single GraphQL query, which asks for each of
+them under its own alias, `BATCH_SIZE` repositories at most. Repositories with more than `PER_PAGE` open pull requests
+get their next pages with the next queries, along with the others which have more.
+
+Pull requests are returned as `MergeRequest`s in `atom.MergeRequestsDocument`s, one per repository, so the app
+handles them exactly like Gitlab's MRs.
+"""
+
+import json
+import re
+import time
+
+from urllib.parse import parse_qsl, urlsplit
+
+from mergerequestsmonitor import feeds
+from mergerequestsmonitor.atom import MergeRequestsDocument
+from mergerequestsmonitor.models import MergeRequest, parse_timestamp
+
+GITHUB_HOSTS = ("github.com", "www.github.com")
+GITHUB_ENDPOINT = "https://api.github.com/graphql"
+PULLS_PATH = re.compile(r"/[^/]+/[^/]+/pulls/?")
+# GitHub doesn't return more than 100 nodes per connection
+PER_PAGE = 100
+# repositories asked for by a single query, which GitHub bounds by the number of nodes it could return
+BATCH_SIZE = 50
+# stop following pages at some point: 10 pages of 100 pull requests is much more than a menu can display
+MAX_PAGES = 10
+
+
+def is_pulls_url(url):
+    """Whether `url` is the pull requests page of a GitHub repository."""
+    return PULLS_PATH.fullmatch(urlsplit(url).path) is not None
+
+
+def parse_url(url):
+    """Return the GraphQL endpoint, the token, the owner and the name of the repository of a pull requests page."""
+    parts = urlsplit(url)
+    owner, name = parts.path.strip("/").split("/")[:2]
+    token = dict(parse_qsl(parts.query)).get("access_token")
+    if parts.netloc in GITHUB_HOSTS:
+        endpoint = GITHUB_ENDPOINT
+    else:
+        endpoint = f"{parts.scheme}://{parts.netloc}/api/graphql"
+    return endpoint, token, owner, name
+
+
+def batch_key(url):
+    """The repositories whose pull requests pages have the same key are fetched together."""
+    endpoint, token, _, _ = parse_url(url)
+    return endpoint, token
+
+
+def build_query(repositories):
+    """Return the GraphQL query, and its variables, asking for a page of the open pull requests of every `(owner, name,
+    cursor)` repository: the first page without a cursor, the next one after it otherwise. Repositories are aliased
+    `r0`, `r1`... in the same order.
+    """
+    params, fields, variables = [], [], {}
+    for i, (owner, name, cursor) in enumerate(repositories):
+        params.append(f"$owner{i}: String!, $name{i}: String!, $cursor{i}: String")
+        fields.append(
+            f"r{i}: repository(owner: $owner{i}, name: $name{i}) {{ "
+            f"pullRequests(states: OPEN, first: {PER_PAGE}, after: $cursor{i}, "
+            "orderBy: {field: UPDATED_AT, direction: DESC}) { "
+            "pageInfo { hasNextPage endCursor } nodes { url title createdAt updatedAt isDraft author { login } } } }"
+        )
+        variables.update({f"owner{i}": owner, f"name{i}": name, f"cursor{i}": cursor})
+    return f"query({', '.join(params)}) {{ {' '.join(fields)} }}", variables
+
+
+def to_merge_request(node, project):
+    """Map a pull request from the GraphQL API to a `MergeRequest`."""
+    author = node.get("author") or {}
+    return MergeRequest(
+        id=node["url"],
+        title=node.get("title") or "",
+        link=node["url"],
+        author=author.get("login"),
+        project=project,
+        updated=parse_timestamp(node.get("updatedAt")),
+        is_draft=node.get("isDraft"),
+        created=parse_timestamp(node.get("createdAt")),
+    )
+
+
+def nodes_fingerprint(nodes):
+    """The fingerprint of the pull requests of a repository, from what tells them and their versions apart."""
+    return feeds.fingerprint(
+        *(f"{node.get('url')}\t{node.get('updatedAt')}\t{node.get('title')}\t{node.get('isDraft')}" for node in nodes)
+    )
+
+
+def fetch(session, urls, timings=None, fingerprints=None):
+    """Fetch the open pull requests of the repositories of `urls`, which must have the same `batch_key`, with
+    `session` and return a `MergeRequestsDocument` for each of them, in the same order.
+
+    Like `feedparser`, errors aren't raised but flagged with `bozo`: a repository which can't be read only fails its
+    own document. The bytes downloaded and the time spent parsing them are shared between the `timings` of the
+    repositories they concern, `diagnostics.FeedTiming`s. Repositories are only parsed when their `fingerprints`
+    aren't the ones given.
+    """
+    timings = timings or [None] * len(urls)
+    fingerprints = fingerprints or [None] * len(urls)
+    repositories = [parse_url(url) for url in urls]
+    endpoint, token, _, _ = repositories[0]
+    headers = {"Accept": "application/json", "Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"bearer {token}"
+
+    nodes = [[] for _ in urls]
+    pages = [0] * len(urls)
+    errors = [None] * len(urls)
+    # the cursor of the next page of every repository which has one, `None` for the first one
+    pending = dict.fromkeys(range(len(urls)))
+    try:
+        while pending:
+            batch = list(pending.items())[:BATCH_SIZE]
+            query, variables = build_query([(*repositories[i][2:], cursor) for i, cursor in batch])
+            response = session.post(endpoint, json.dumps({"query": query, "variables": variables}).encode(), headers)
+            started = time.perf_counter()
+            result = json.loads(response.body) if response.status == 200 else {}
+            for i, _ in batch:
+                if timings[i] is not None:
+                    timings[i].add_bytes(len(response.body) // len(batch))
+                    timings[i].add_parse_seconds((time.perf_counter() - started) / len(batch))
+
+            if response.status != 200 or not result.get("data"):
+                # the query as a whole failed: bad credentials, rate limits...
+                messages = [error.get("message") for error in result.get("errors") or []]
+                error = messages[0] if messages else f"HTTP Error {response.status}"
+                for i in pending:
+                    errors[i] = (error, response.status)
+                break
+
+            data = result["data"]
+            messages = {
+                error["path"][0]: error.get("message") for error in result.get("errors") or [] if error.get("path")
+            }
+            for alias, (i, _) in enumerate(batch):
+                repository = data.get(f"r{alias}")
+                del pending[i]
+                if repository is None:
+                    errors[i] = (messages.get(f"r{alias}") or "Repository not found", response.status)
+                    continue
+                pull_requests = repository["pullRequests"]
+                nodes[i].extend(pull_requests["nodes"])
+                pages[i] += 1
+                if pull_requests["pageInfo"]["hasNextPage"] and pages[i] < MAX_PAGES:
+                    pending[i] = pull_requests["pageInfo"]["endCursor"]
+
+    except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+        return [MergeRequestsDocument(bozo=True, bozo_exception=e) for _ in urls]
+
+    documents = []
+    for i, (_, _, owner, name) in enumerate(repositories):
+        if errors[i] is not None:
+            error, status = errors[i]
+            documents.append(MergeRequestsDocument(status=status, bozo=True, bozo_exception=error))
+            continue
+
+        document = MergeRequestsDocument(status=200, fingerprint=nodes_fingerprint(nodes[i]))
+        if document.fingerprint != fingerprints[i]:
+            started = time.perf_counter()
+            document.merge_requests = [to_merge_request(node, f"{owner}/{name}") for node in nodes[i]]
+            if timings[i] is not None:
+                timings[i].add_parse_seconds(time.perf_counter() - started)
+        documents.append(document)
+    return documents
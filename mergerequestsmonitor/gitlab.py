@@ -0,0 +1,125 @@
+"""
+Fetches merge requests from Gitlab's REST API instead of Atom feeds.
+
+Any `merge_requests` endpoint of the API can be used as a feed URL, for instance:
+
+- `https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me` for every MR assigned to you,
+- `https://gitlab.com/api/v4/groups/<group>/merge_requests` for every MR of a group,
+- `https://gitlab.com/api/v4/projects/<id>/merge_requests?wip=no` for the MRs of a project, without drafts.
+
+so a single URL can replace dozens of per-project feeds. The server does the filtering: `state=opened` is asked for
+unless the URL says otherwise, and `scope`, `wip` or any other filter in the URL is passed along. A `private_token`
+in the URL is sent in a header instead. Every page is followed, through the same `session.Session`.
+
+Results are returned as `atom.AtomDocument`s, so the app handles them exactly like feeds.
+"""
+
+import json
+import time
+
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit, urlunsplit
+
+from mergerequestsmonitor import feeds
+from mergerequestsmonitor.atom import AtomDocument, AtomEntry
+
+DEFAULT_FILTERS = {"state": "opened"}
+PER_PAGE = 100
+# stop following pages at some point: 100 pages of 100 MRs is much more than a menu can display
+MAX_PAGES = 100
+
+
+def is_api_url(url):
+    """Whether `url` is a `merge_requests` endpoint of Gitlab's REST API rather than a feed."""
+    path = urlsplit(url).path.rstrip("/")
+    return "/api/v4/" in path and path.endswith("/merge_requests")
+
+
+def namespace(url):
+    """The path of the group or project whose MRs the API URL `url` lists, `""` when it lists those of every project,
+    or `None` when it can't tell: groups and projects given by their numeric ids.
+    """
+    path = urlsplit(url).path.rstrip("/")
+    _, _, endpoint = path.partition("/api/v4/")
+    kind, _, rest = endpoint.partition("/")
+    if kind == "merge_requests":
+        return ""
+    # paths are URL-encoded, like `group%2Fproject`
+    encoded = rest[: -len("/merge_requests")]
+    if kind not in ("groups", "projects") or not encoded or "/" in encoded or encoded.isdigit():
+        return None
+    return unquote(encoded)
+
+
+def prepare(url):
+    """Return the URL of the first page to request for `url`, with the default filters, and the headers to send."""
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query))
+
+    headers = {"Accept": "application/json"}
+    token = params.pop("private_token", None)
+    if token:
+        headers["PRIVATE-TOKEN"] = token
+
+    params = {**DEFAULT_FILTERS, "per_page": str(PER_PAGE), **params}
+    return urlunsplit(parts._replace(query=urlencode(params))), headers
+
+
+def next_page(headers):
+    """The URL of the next page from the `Link` header of a response, or `None` on the last page."""
+    for link in (headers.get("Link") or "").split(","):
+        target, _, params = link.partition(";")
+        if 'rel="next"' in params.replace(" ", ""):
+            return target.strip().strip("<>")
+    return None
+
+
+def to_entry(merge_request):
+    """Map a merge request from the API to the same entry the feeds give."""
+    author = merge_request.get("author") or {}
+    return AtomEntry(
+        id=merge_request.get("web_url"),
+        title=merge_request.get("title") or "",
+        link=merge_request.get("web_url"),
+        updated=merge_request.get("updated_at"),
+        author=author.get("name"),
+        published=merge_request.get("created_at"),
+    )
+
+
+def fetch(session, url, timing=None, fingerprint=None):
+    """Fetch every page of the API endpoint `url` with `session` and return an `AtomDocument`.
+
+    Like `feedparser`, errors aren't raised but flagged with `bozo`. The bytes downloaded and the time spent parsing
+    them are added to `timing`, a `diagnostics.FeedTiming`, if given. Pages are only parsed when their `fingerprint`
+    isn't the one given.
+    """
+    page_url, headers = prepare(url)
+    bodies = []
+    try:
+        for _ in range(MAX_PAGES):
+            response = session.get(page_url, headers=headers)
+            if response.status != 200:
+                return AtomDocument(status=response.status, bozo=True, bozo_exception=f"HTTP Error {response.status}")
+
+            bodies.append(response.body)
+            if timing is not None:
+                timing.add_bytes(len(response.body))
+
+            page_url = next_page(response.headers)
+            if page_url is None:
+                break
+
+        document = AtomDocument(status=200, fingerprint=feeds.fingerprint(*bodies))
+        if document.fingerprint == fingerprint:
+            return document
+
+        started = time.perf_counter()
+        for body in bodies:
+            document.entries.extend(to_entry(merge_request) for merge_request in json.loads(body))
+        if timing is not None:
+            timing.add_parse_seconds(time.perf_counter() - started)
+
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        return AtomDocument(bozo=True, bozo_exception=e)
+
+    return document
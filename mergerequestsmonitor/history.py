@@ -0,0 +1,225 @@
+"""
+The history of every MR displayed so far, kept in a SQLite database to tell how long MRs have been open and which
+ones showed up since the menu was last looked at.
+
+MRs are upserted as snapshots change: a refresh only writes the MRs its `snapshot.Changes` tell about, and the removed
+ones are just stamped with when they were last displayed. Only the first write after opening the store goes through
+the whole snapshot, in case the store lags behind it. The database is in WAL mode, so writes from refreshes don't
+block the menu's reads, and MRs are indexed by id, project and update date so lookups stay fast with tens of
+thousands of them.
+
+MRs removed for longer than `retention` are deleted, and the database is compacted once enough of it is free space.
+"""
+
+import threading
+import time
+
+HISTORY_FILE = "history.sqlite3"
+SCHEMA_VERSION = 2
+DEFAULT_RETENTION_DAYS = 90
+DAY = 24 * 60 * 60
+# how often MRs past their retention are looked for
+EXPIRE_INTERVAL = 60 * 60
+# the database is compacted once this share of its pages are free, and only when it has at least this many pages
+COMPACT_FREE_RATIO = 0.25
+COMPACT_MIN_PAGES = 256
+# SQLite versions before 3.32 take up to 999 variables per statement
+MAX_VARIABLES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS merge_requests (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    link TEXT NOT NULL,
+    author TEXT,
+    project TEXT,
+    updated REAL,
+    is_draft INTEGER,
+    -- when it was first displayed, and when it was opened, or first displayed when its feeds don't tell
+    first_seen REAL NOT NULL,
+    opened_at REAL NOT NULL,
+    -- when it was last displayed, once it no longer is
+    removed_at REAL
+);
+CREATE INDEX IF NOT EXISTS merge_requests_project ON merge_requests (project);
+CREATE INDEX IF NOT EXISTS merge_requests_updated ON merge_requests (updated);
+CREATE INDEX IF NOT EXISTS merge_requests_removed_at ON merge_requests (removed_at) WHERE removed_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+UPSERT = """
+INSERT INTO merge_requests (id, title, link, author, project, updated, is_draft, first_seen, opened_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    title = excluded.title,
+    link = excluded.link,
+    author = coalesce(excluded.author, author),
+    project = coalesce(excluded.project, project),
+    updated = excluded.updated,
+    is_draft = excluded.is_draft,
+    opened_at = min(opened_at, excluded.opened_at),
+    removed_at = NULL
+"""
+
+
+def chunks(items, size=MAX_VARIABLES):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def format_age(seconds):
+    """A short age like `3d`, `2w` or `1y`."""
+    days = int(seconds // DAY)
+    if days < 14:
+        return f"{days}d"
+    if days < 365:
+        return f"{days // 7}w"
+    return f"{days // 365}y"
+
+
+class HistoryStore:
+    """The history of the MRs displayed, in the SQLite database at `path`. Thread safe."""
+
+    def __init__(self, path, retention=DEFAULT_RETENTION_DAYS * DAY, clock=time.time):
+        import sqlite3
+
+        self.retention = retention
+        self.clock = clock
+        self.lock = threading.Lock()
+        # refreshes write from their own thread, the menu reads from the main one
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        # in WAL mode, commits survive crashes without syncing every one of them, only power losses may undo them
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # every statement can run again: the schema is created, or brought up to date, as a whole
+            self.connection.executescript(SCHEMA)
+            if version == 1:
+                # those were guessed from updates: they told how long MRs had been idle rather than open
+                self.connection.execute("UPDATE merge_requests SET opened_at = first_seen")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.synced = False
+        self.expired_at = None
+
+    def __repr__(self):
+        return f"<HistoryStore: {len(self)} MRs>"
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM merge_requests").fetchone()[0]
+
+    def transaction(self):
+        self.connection.execute("BEGIN")
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            self.connection.execute("PRAGMA optimize")
+            self.connection.close()
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def record(self, merge_requests, changes=None):
+        """Record the snapshot of `merge_requests`, writing only its `changes` (see `snapshot.merge`) when given.
+
+        The first snapshot recorded since the store was opened is always written in full.
+        """
+        now = self.clock()
+        full = changes is None or not self.synced
+        upserted = merge_requests if full else changes.added + changes.changed
+        rows = [
+            (
+                mr.id,
+                mr.title,
+                mr.link,
+                mr.author,
+                mr.project,
+                mr.updated,
+                mr.is_draft,
+                now,
+                min(now, mr.created) if mr.created is not None else now,
+            )
+            for mr in upserted
+        ]
+
+        with self.lock:
+            with self.transaction():
+                self.connection.executemany(UPSERT, rows)
+                if full:
+                    self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS displayed (id TEXT PRIMARY KEY)")
+                    self.connection.execute("DELETE FROM displayed")
+                    self.connection.executemany(
+                        "INSERT OR IGNORE INTO displayed VALUES (?)", ((row[0],) for row in rows)
+                    )
+                    self.connection.execute(
+                        "UPDATE merge_requests SET removed_at = ? "
+                        "WHERE removed_at IS NULL AND id NOT IN (SELECT id FROM displayed)",
+                        (now,),
+                    )
+                    # the MRs of the first snapshot ever recorded aren't new
+                    if self.get_meta("looked_at") is None:
+                        self.set_meta("looked_at", now)
+                else:
+                    self.connection.executemany(
+                        "UPDATE merge_requests SET removed_at = ? WHERE id = ?",
+                        ((now, mr.id) for mr in changes.removed),
+                    )
+            self.synced = True
+
+        if self.expired_at is None or now - self.expired_at >= EXPIRE_INTERVAL:
+            self.expire(now)
+
+    def looked_at(self, when=None):
+        """Remember the menu was looked at `when`: the MRs displayed so far are no longer new."""
+        with self.lock:
+            with self.transaction():
+                self.set_meta("looked_at", self.clock() if when is None else when)
+
+    def markers(self, ids):
+        """Return `{id: (since, opened, new)}` for the MRs of `ids` in the history: when they were opened when that's
+        known (`opened`), or else when they were first displayed, and whether they showed up since the menu was last
+        looked at.
+        """
+        ids = list(ids)
+        markers = {}
+        with self.lock:
+            looked_at = self.get_meta("looked_at")
+            for chunk in chunks(ids):
+                rows = self.connection.execute(
+                    f"SELECT id, opened_at, first_seen FROM merge_requests WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for id, opened_at, first_seen in rows:
+                    markers[id] = (opened_at, opened_at < first_seen, looked_at is not None and first_seen > looked_at)
+        return markers
+
+    def expire(self, now=None):
+        """Delete the MRs removed for longer than `retention`, compacting the database when that freed enough of it.
+        Return how many were deleted.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            with self.transaction():
+                deleted = self.connection.execute(
+                    "DELETE FROM merge_requests WHERE removed_at < ?", (now - self.retention,)
+                ).rowcount
+            self.expired_at = now
+            if deleted:
+                self.compact()
+        return deleted
+
+    def compact(self, force=False):
+        """Give the free pages of the database back to the file system, once there are enough of them. Must be called
+        with `lock` held.
+        """
+        pages = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        free = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if force or (pages >= COMPACT_MIN_PAGES and free >= pages * COMPACT_FREE_RATIO):
+            self.connection.execute("VACUUM")
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
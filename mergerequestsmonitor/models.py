@@ -0,0 +1,96 @@
+"""
+The normalised merge request record used across the app.
+
+Feed entries carry a lot more than the app needs (summaries, author blocks, content...), so they're turned into
+`MergeRequest` records as soon as they're parsed and dropped right after.
+"""
+
+import html
+
+from datetime import datetime
+from urllib.parse import urlsplit
+
+
+def parse_timestamp(text):
+    """Return the POSIX timestamp of an ISO 8601 date like the ones in Gitlab feeds, or `None` if it can't be parsed."""
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def project_from_link(link):
+    """Return the project path ("group/subgroup/project") of a Gitlab MR link, or `None` for any other link."""
+    if not isinstance(link, str):
+        return None
+
+    path = urlsplit(link).path
+    if "/-/" not in path:
+        return None
+
+    return path.split("/-/", 1)[0].strip("/") or None
+
+
+class MergeRequest:
+    """An immutable merge request: only the fields the app displays or uses to tell MRs apart.
+
+    `title` is already unescaped, and `updated` and `created` are POSIX timestamps: `created` is `None` unless the
+    source tells when the MR was opened, which Gitlab's feeds don't. When not given, `id` defaults to `link` and
+    `is_draft` is guessed from the title.
+    """
+
+    __slots__ = ("id", "title", "link", "author", "project", "updated", "is_draft", "created")
+
+    def __init__(
+        self, id=None, title="", link=None, author=None, project=None, updated=None, is_draft=None, created=None
+    ):
+        set_field = super().__setattr__
+        set_field("id", id if id is not None else link)
+        set_field("title", title)
+        set_field("link", link)
+        set_field("author", author)
+        set_field("project", project)
+        set_field("updated", updated)
+        set_field("is_draft", "Draft: " in title if is_draft is None else is_draft)
+        set_field("created", created)
+
+    @classmethod
+    def from_entry(cls, entry):
+        """Build a record from a feed entry, either a `feedparser` entry or an `atom.AtomEntry`."""
+        link = getattr(entry, "link", None)
+        author = getattr(entry, "author", None)
+        return cls(
+            id=getattr(entry, "id", None) or link,
+            title=html.unescape(getattr(entry, "title", None) or ""),
+            link=link,
+            author=author if isinstance(author, str) else None,
+            project=project_from_link(link),
+            updated=parse_timestamp(getattr(entry, "updated", None)),
+            created=parse_timestamp(getattr(entry, "published", None)),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), self.astuple()
+
+    def __repr__(self):
+        return f"<MergeRequest: {self.title!r} ({self.link})>"
+
+    def __eq__(self, other):
+        if not isinstance(other, MergeRequest):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def astuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def asdict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
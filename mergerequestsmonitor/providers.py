@@ -0,0 +1,298 @@
+"""
+The sources MRs are fetched from, each one behind a `Provider` which knows its URLs and how to fetch them.
+
+Every provider returns documents mimicking `feedparser`'s results (see `atom.AtomDocument`): feed entries, or ready-made
+`MergeRequest`s in `atom.MergeRequestsDocument`s, with errors flagged with `bozo` rather than raised. The engine
+handles all of them the same way, whatever they come from.
+
+Providers able to fetch many feeds with a single request, like GitHub's GraphQL API, give the feeds which can go
+together the same `batch_key`, and fetch them all at once with `fetch_batch`.
+
+Like the rest of the network code, parsers are only imported when a provider first fetches something.
+"""
+
+import time
+
+from urllib.parse import urlsplit
+
+from mergerequestsmonitor import feeds as feed_states
+from mergerequestsmonitor.diagnostics import MeteredReader
+
+
+def conditional_headers(etag, modified):
+    """The headers making a GET conditional on the validators of the last download."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    return headers
+
+
+def http_error_document(status):
+    """The document of a feed which answered with `status` instead of a feed."""
+    from mergerequestsmonitor import atom
+
+    if status == 304:
+        return atom.AtomDocument(status=304)
+    return atom.AtomDocument(status=status, bozo=True, bozo_exception=f"HTTP Error {status}")
+
+
+def in_namespace(url, namespace, merge_request):
+    """Whether `merge_request` is on the server of `url`, in `namespace`, the path of a group or a project, or anywhere
+    when it's `""`.
+    """
+    project = merge_request.project
+    if namespace is None or not project or urlsplit(url).netloc != urlsplit(merge_request.link or "").netloc:
+        return False
+    return not namespace or project == namespace or project.startswith(f"{namespace}/")
+
+
+def known_fingerprint(feed):
+    """The fingerprint of the last version of `feed`, a `FeedState`, when its MRs are known."""
+    return feed.fingerprint if feed.fetched_at is not None else None
+
+
+def rules_error(engine, url):
+    """The `rules.RuleError` of the engine's rules when they can't hide what they should from `url`, if any: showing the
+    MRs they hide would be worse than failing.
+    """
+    from mergerequestsmonitor.rules import RuleError
+
+    try:
+        engine.request_url(url)
+    except RuleError as e:
+        return e
+    return None
+
+
+class Provider:
+    """Fetches the feeds whose URLs it `handles`, with the session of the `engine` given (see `engine.Engine`)."""
+
+    name = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__}>"
+
+    def handles(self, url):
+        raise NotImplementedError
+
+    def batch_key(self, url):
+        """The feeds with the same key can be fetched together by `fetch_batch`, unless it's `None`."""
+        return None
+
+    def covers(self, url, merge_request):
+        """Whether the feed `url` lists the MRs of the project of `merge_request`, as far as its URL tells: webhooks
+        only add the MRs of projects some feed covers (see `Engine.apply_event`).
+        """
+        return False
+
+    def fetch(self, engine, feed, timing=None):
+        """Fetch `feed`, a `FeedState`, and return its document. Bytes downloaded and parsing time are added to
+        `timing`, a `diagnostics.FeedTiming`, when given.
+        """
+        raise NotImplementedError
+
+    def fetch_batch(self, engine, feeds, timings):
+        """Fetch every feed of `feeds`, which share their `batch_key`, and return their documents in the same order."""
+        return [self.fetch(engine, feed, timing) for feed, timing in zip(feeds, timings)]
+
+
+class GitlabApiProvider(Provider):
+    """Gitlab's REST API, see `gitlab`."""
+
+    name = "gitlab-api"
+
+    def handles(self, url):
+        from mergerequestsmonitor import gitlab
+
+        return gitlab.is_api_url(url)
+
+    def covers(self, url, merge_request):
+        from mergerequestsmonitor import gitlab
+
+        return in_namespace(url, gitlab.namespace(url), merge_request)
+
+    def fetch(self, engine, feed, timing=None):
+        from mergerequestsmonitor import atom, gitlab
+        from mergerequestsmonitor.rules import RuleError
+
+        try:
+            request_url = engine.request_url(feed.url)
+        except RuleError as e:
+            # showing the MRs the rules hide would be worse than failing
+            return atom.AtomDocument(bozo=True, bozo_exception=e)
+        return gitlab.fetch(engine.session, request_url, timing, known_fingerprint(feed))
+
+
+class SnapshotProvider(Provider):
+    """The snapshots served by a daemon, see `server`."""
+
+    name = "snapshot"
+
+    def handles(self, url):
+        from mergerequestsmonitor import server
+
+        return server.is_snapshot_url(url)
+
+    def fetch(self, engine, feed, timing=None):
+        from mergerequestsmonitor import server
+
+        error = rules_error(engine, feed.url)
+        if error is not None:
+            return server.SnapshotDocument(bozo=True, bozo_exception=error)
+        etag, _ = feed.validators
+        return server.fetch(engine.session, feed.url, etag, timing, known_fingerprint(feed))
+
+
+class GithubProvider(Provider):
+    """The open pull requests of GitHub repositories, all the repositories read with the same token at once, see
+    `github`.
+    """
+
+    name = "github"
+
+    def handles(self, url):
+        from mergerequestsmonitor import github
+
+        return github.is_pulls_url(url)
+
+    def batch_key(self, url):
+        from mergerequestsmonitor import github
+
+        return github.batch_key(url)
+
+    def fetch(self, engine, feed, timing=None):
+        return self.fetch_batch(engine, [feed], [timing])[0]
+
+    def fetch_batch(self, engine, feeds, timings):
+        from mergerequestsmonitor import github
+        from mergerequestsmonitor.atom import MergeRequestsDocument
+
+        # the same rules fail every repository
+        error = rules_error(engine, feeds[0].url)
+        if error is not None:
+            return [MergeRequestsDocument(bozo=True, bozo_exception=error) for _ in feeds]
+        return github.fetch(
+            engine.session, [feed.url for feed in feeds], timings, [known_fingerprint(feed) for feed in feeds]
+        )
+
+
+class GitlabAtomProvider(Provider):
+    """Gitlab's merge requests Atom feeds, and any other feed `feedparser` can read.
+
+    With the engine's "streaming" `feed_parser`, feeds are parsed as they're downloaded by `atom`, and `feedparser` is
+    only used for whatever that parser can't handle. `feedparser` reads whole bodies before parsing them, so feeds it
+    parses are buffered, within the size the session allows, and aren't parsed at all when they're identical to the last
+    download. Either way, the MRs of unchanged feeds aren't built again.
+    """
+
+    name = "gitlab-atom"
+
+    def handles(self, url):
+        return True
+
+    def covers(self, url, merge_request):
+        # the feeds of a project, of a group (under `/groups/`), or of the dashboard, which lists any project
+        path = urlsplit(url).path
+        if path.endswith("/dashboard/merge_requests.atom"):
+            namespace = ""
+        elif path.endswith("/-/merge_requests.atom"):
+            namespace = path[1 : -len("/-/merge_requests.atom")].removeprefix("groups/")
+        else:
+            namespace = None
+        return in_namespace(url, namespace, merge_request)
+
+    def fetch(self, engine, feed, timing=None):
+        """Download and parse `feed`, making it a conditional GET when it was downloaded before. Bodies `feedparser`
+        would parse are fingerprinted first, and not parsed at all when they're the last version of the feed.
+        """
+        from mergerequestsmonitor import atom
+        from mergerequestsmonitor.rules import RuleError
+
+        try:
+            # feeds are still known by the URL they were given as, only requests go to the filtered one
+            request_url = engine.request_url(feed.url)
+        except RuleError as e:
+            return atom.AtomDocument(bozo=True, bozo_exception=e)
+        etag, modified = feed.validators
+        if engine.feed_parser == "streaming":
+            try:
+                return self.fetch_atom_feed(
+                    engine.session, request_url, etag, modified, timing, known_fingerprint(feed)
+                )
+            except atom.UnsupportedFeed:
+                pass
+
+        import feedparser
+
+        try:
+            with engine.session.stream(request_url, headers=conditional_headers(etag, modified)) as response:
+                if not 200 <= response.status < 300:
+                    return http_error_document(response.status)
+                # feedparser reads the whole body before parsing it anyway, within the size the session allows
+                body = response.read()
+                if timing is not None:
+                    timing.add_bytes(response.bytes_read)
+        except OSError as e:
+            return atom.AtomDocument(bozo=True, bozo_exception=e)
+
+        document = atom.AtomDocument(
+            status=response.status,
+            etag=response.headers.get("ETag"),
+            modified=response.headers.get("Last-Modified"),
+            fingerprint=feed_states.fingerprint(body),
+        )
+        if document.fingerprint == known_fingerprint(feed):
+            return document
+
+        started = time.perf_counter()
+        parsed = feedparser.parse(
+            body, response_headers={name.lower(): value for name, value in response.headers.items()}
+        )
+        if timing is not None:
+            timing.add_parse_seconds(time.perf_counter() - started)
+        document.entries = getattr(parsed, "entries", [])
+        document.bozo = parsed.bozo
+        document.bozo_exception = parsed.get("bozo_exception") if parsed.bozo else None
+        return document
+
+    def fetch_atom_feed(self, session, feed_url, etag=None, modified=None, timing=None, fingerprint=None):
+        """Download `feed_url` and parse it with `atom` as it's downloaded, leaving its entries out when it's still the
+        feed whose `fingerprint` is given.
+
+        The body is never held in memory as a whole: feeds are fingerprinted while they're parsed, so unchanged feeds
+        are parsed all the same, but their MRs aren't built again (see `Engine.fetch_merge_requests`).
+        """
+        from mergerequestsmonitor import atom
+
+        try:
+            with session.stream(feed_url, headers=conditional_headers(etag, modified)) as response:
+                if not 200 <= response.status < 300:
+                    return http_error_document(response.status)
+                reader = MeteredReader(feed_states.FingerprintReader(response))
+                started = time.perf_counter()
+                document = atom.parse(reader)
+                parse_seconds = time.perf_counter() - started - reader.seconds
+                document.fingerprint = reader.f.fingerprint()
+                if document.fingerprint == fingerprint:
+                    document.entries = []
+                if timing is not None:
+                    timing.add_bytes(reader.bytes)
+                    timing.add_parse_seconds(parse_seconds)
+                document.status = response.status
+                document.etag = response.headers.get("ETag")
+                document.modified = response.headers.get("Last-Modified")
+                return document
+
+        except OSError as e:
+            return atom.AtomDocument(bozo=True, bozo_exception=e)
+
+
+# in the order they're asked whether they handle a URL: Gitlab's feeds are whatever the others don't handle
+PROVIDERS = [GitlabApiProvider(), SnapshotProvider(), GithubProvider(), GitlabAtomProvider()]
+
+
+def get_provider(url):
+    """The provider fetching `url`."""
+    return next(provider for provider in PROVIDERS if provider.handles(url))
@@ -0,0 +1,147 @@
+"""
+Keeps requests to every host within its rate limits.
+
+Every host gets a `TokenBucket`: requests take a token each, tokens come back at `rate` a second, and up to `capacity`
+of them can pile up for bursts. Servers tell about their own limits too, and buckets follow them:
+
+- `RateLimit-Remaining` caps the tokens left, and when it's down to 0 the host is blocked until `RateLimit-Reset`,
+  which Gitlab sends as a Unix time and other servers as seconds. GitHub sends them as `X-RateLimit-Remaining` and
+  `X-RateLimit-Reset`,
+- "429 Too Many Requests" responses block the host for as long as their `Retry-After` says, in seconds or as an HTTP
+  date.
+
+Requests which would have to wait longer than `MAX_WAIT` raise `Throttled` rather than holding a refresh: feeds are
+postponed until then instead of failing.
+"""
+
+import threading
+import time
+
+DEFAULT_RATE = 5
+DEFAULT_CAPACITY = 20
+# waiting up to this many seconds for a token is better than postponing a feed
+MAX_WAIT = 10
+# how long hosts answering "429 Too Many Requests" without saying for how long are left alone
+DEFAULT_RETRY_AFTER = 60
+# `RateLimit-Reset` values larger than this are Unix times rather than seconds
+EPOCH_THRESHOLD = 10**9
+
+
+class Throttled(OSError):
+    """Raised instead of sending a request a host can't take before `delay` seconds. It's an `OSError`, so it's
+    handled like failed downloads until it reaches the engine, which postpones the feed instead.
+    """
+
+    def __init__(self, host, delay):
+        super().__init__(f"Rate limited by {host} for {delay:.0f}s")
+        self.host = host
+        self.delay = delay
+
+
+def parse_rate(value):
+    """The requests a second of a `rate_limit` setting, or `DEFAULT_RATE` when it's missing or not a positive number."""
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RATE
+    # buckets can't refill at a rate of 0, or less
+    return rate if rate > 0 else DEFAULT_RATE
+
+
+def parse_retry_after(value, now=None):
+    """The seconds a `Retry-After` header asks to wait, or `None` when it's missing or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    from email.utils import parsedate_to_datetime
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(date.timestamp() - now, 0.0)
+
+
+def parse_reset(value, now=None):
+    """The seconds until a `RateLimit-Reset` header says limits are reset, or `None` when it's missing or invalid."""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > EPOCH_THRESHOLD:
+        now = time.time() if now is None else now
+        return max(reset - now, 0.0)
+    return max(reset, 0.0)
+
+
+class TokenBucket:
+    """Lets `rate` requests a second to `host` through on average, in bursts of up to `capacity`. Thread safe."""
+
+    def __init__(self, host, rate=DEFAULT_RATE, capacity=DEFAULT_CAPACITY, clock=time.monotonic):
+        self.host = host
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = None
+
+    def __repr__(self):
+        return f"<TokenBucket: {self.host} {self.tokens:.1f}/{self.capacity} tokens, {self.rate}/s>"
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def blocked_for(self, now=None):
+        """Seconds until the host takes requests again after telling to back off, or 0."""
+        now = self.clock() if now is None else now
+        if self.blocked_until is None or now >= self.blocked_until:
+            return 0
+        return self.blocked_until - now
+
+    def reserve(self, max_wait=MAX_WAIT):
+        """Take a token, returning how many seconds to wait before it can be used. Raises `Throttled`, without taking
+        any, when that's more than `max_wait`.
+        """
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            # tokens may go negative: those requests wait for the tokens they took to come back
+            wait = max(self.blocked_for(now), -(self.tokens - 1) / self.rate if self.tokens < 1 else 0)
+            if wait > max_wait:
+                raise Throttled(self.host, wait)
+            self.tokens -= 1
+            return wait
+
+    def block(self, seconds):
+        """Let no request through for `seconds`."""
+        with self.lock:
+            now = self.clock()
+            self.refill(now)
+            self.tokens = min(self.tokens, 0)
+            self.blocked_until = max(self.blocked_until or now, now + seconds)
+
+    def update(self, status, headers):
+        """Follow the limits the server told about in the `status` and `headers` of a response."""
+        if status == 429:
+            retry_after = parse_retry_after(headers.get("Retry-After"))
+            self.block(retry_after if retry_after is not None else DEFAULT_RETRY_AFTER)
+
+        prefix = "" if headers.get("RateLimit-Remaining") is not None else "X-"
+        try:
+            remaining = int(headers.get(f"{prefix}RateLimit-Remaining"))
+        except (TypeError, ValueError):
+            return
+        if remaining <= 0:
+            reset = parse_reset(headers.get(f"{prefix}RateLimit-Reset"))
+            self.block(reset if reset is not None else DEFAULT_RETRY_AFTER)
+            return
+        with self.lock:
+            self.refill(self.clock())
+            self.tokens = min(self.tokens, remaining)
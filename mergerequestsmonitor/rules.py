@@ -0,0 +1,295 @@
+"""
+Declarative rules hiding merge requests and sorting them into the sections of the menu, set in `config.ini`:
+
+    [Gitlab]
+    hide = author:*bot*
+           draft project:group/sandbox
+           age>30d
+    sections = Ready: !draft
+               Drafts: draft
+
+A rule is a list of conditions separated by spaces, which must all hold. `hide` has one rule per line, and MRs matching
+any of them aren't displayed. `sections` has a `<title>: <rule>` line per section of the menu: every MR goes in the
+first section it matches, and a section without a rule takes any MR left. Conditions are negated by a leading `!`:
+
+- `draft`: the MR is a draft,
+- `author:<pattern>`, `project:<pattern>`, `title:<pattern>`: the author's name, the project's path or the title match
+  a shell-style pattern, ignoring case,
+- `age>N`, `age<N`: the MR was last updated more, or less, than `N` ago: `30m`, `12h`, `7d` or `4w`,
+- `username:<username>`, `label:<label>`, `state:<state>`: the author's username, one of the labels or the state of the
+  MR. Feeds don't tell those: only Gitlab can evaluate them (see below), and webhooks' events (see `Classifier.hides`),
+  so they're only valid as `hide` rules of their own.
+
+Rules are compiled once into a `Classifier`, which sorts MRs into sections in a single pass.
+
+`hide` rules made of a single condition which Gitlab can evaluate itself (drafts, usernames, labels, states and ages)
+are also added to the query of Gitlab's merge requests feeds and REST API URLs by `Classifier.push_down`, so the MRs
+they hide aren't even downloaded. Parameters already in a URL are left as they are, and rules Gitlab can't be asked
+for together are invalid: two `!state:` rules, for instance, or two `username:` rules for the REST API, which only
+leaves out one author. They can't hide anything from other feeds either: GitHub's and daemons' feeds fail instead.
+"""
+
+import fnmatch
+import re
+import time
+
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_SECTIONS = "Merge Requests: !draft\nDraft Merge Requests: draft"
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+CONDITION = re.compile(r"(?P<negated>!?)(?P<field>[a-z]+)(?:(?P<op>[:<>])(?P<value>.+))?")
+PATTERN_FIELDS = ("author", "project", "title")
+# fields feeds don't have, which only Gitlab can evaluate
+REMOTE_FIELDS = ("username", "label", "state")
+# ages pushed down are rounded down to the hour, so that the URLs requested don't change at every refresh
+AGE_PRECISION = 3600
+
+
+class RuleError(ValueError):
+    pass
+
+
+def parse_duration(text):
+    """Return the seconds of a duration like `30m`, `12h`, `7d` or `4w`."""
+    number, unit = text[:-1], text[-1:]
+    if not number.isdigit() or unit not in DURATION_UNITS:
+        raise RuleError(f"Invalid duration: {text!r}, expected a number of m, h, d or w")
+    return int(number) * DURATION_UNITS[unit]
+
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Condition:
+    """A condition of a rule. `test(merge_request, now)` tells whether it holds, or `None` when MRs don't tell. Those on
+    fields MRs don't have tell with `test_fields(fields, now)` instead, from a dict of what's known of them.
+    """
+
+    def __init__(self, text):
+        match = CONDITION.fullmatch(text)
+        if match is None:
+            raise RuleError(f"Invalid condition: {text!r}")
+        self.text = text
+        self.negated = bool(match["negated"])
+        self.field, self.op, self.value = match["field"], match["op"], match["value"]
+        self.test_fields = None
+
+        if self.field == "draft" and self.op is None:
+            self.test = self.compile(lambda mr, now: bool(mr.is_draft))
+        elif self.field in PATTERN_FIELDS and self.op == ":":
+            self.test = self.compile(self.pattern_test(self.field, self.value.lower()))
+        elif self.field == "age" and self.op in "<>":
+            self.seconds = parse_duration(self.value)
+            self.test = self.compile(self.age_test(self.op, self.seconds))
+        elif self.field in REMOTE_FIELDS and self.op == ":":
+            self.test = lambda mr, now: None
+            self.test_fields = self.compile(self.field_test(self.field, self.value))
+        else:
+            raise RuleError(f"Unknown condition: {text!r}")
+
+    def __repr__(self):
+        return f"<Condition: {self.text}>"
+
+    @staticmethod
+    def pattern_test(field, pattern):
+        def test(mr, now):
+            return fnmatch.fnmatchcase((getattr(mr, field) or "").lower(), pattern)
+
+        return test
+
+    @staticmethod
+    def field_test(field, value):
+        def test(fields, now):
+            known = fields.get(field)
+            if known is None:
+                return None
+            # MRs have several labels, but a single author and state
+            return value in known if field == "label" else known == value
+
+        return test
+
+    @staticmethod
+    def age_test(op, seconds):
+        def test(mr, now):
+            if mr.updated is None:
+                return None
+            age = now - mr.updated
+            return age > seconds if op == ">" else age < seconds
+
+        return test
+
+    def compile(self, test):
+        if not self.negated:
+            return test
+
+        def negated_test(mr, now):
+            result = test(mr, now)
+            return None if result is None else not result
+
+        return negated_test
+
+    def params(self, api, now):
+        """The query parameters making Gitlab leave out the MRs this condition holds for, or `{}` when it can't."""
+        if self.field == "draft":
+            return {"wip": "yes" if self.negated else "no"}
+
+        if self.field == "username":
+            if self.negated:
+                return {"author_username": self.value}
+            # feeds take several usernames to leave out, the REST API only one
+            return {"not[author_username]" if api else "not[author_username][]": self.value}
+
+        if self.field == "label":
+            if api:
+                return {"labels" if self.negated else "not[labels]": self.value}
+            return {"label_name[]" if self.negated else "not[label_name][]": self.value}
+
+        if self.field == "state" and self.negated:
+            return {"state": self.value}
+
+        if self.field == "age":
+            since = (now - self.seconds) // AGE_PRECISION * AGE_PRECISION
+            # hiding old MRs keeps those updated since then, hiding recent ones keeps those updated before
+            keep_recent = (self.op == ">") != self.negated
+            return {"updated_after" if keep_recent else "updated_before": format_timestamp(since)}
+
+        return {}
+
+
+class Rule:
+    """Conditions which must all hold, separated by spaces in `text`."""
+
+    def __init__(self, text):
+        self.text = text
+        self.conditions = [Condition(condition) for condition in text.split()]
+        if not self.conditions:
+            raise RuleError("Empty rule")
+        self.tests = [condition.test for condition in self.conditions]
+
+    def __repr__(self):
+        return f"<Rule: {self.text}>"
+
+    def matches(self, merge_request, now, fields=None):
+        """Whether every condition holds: conditions MRs don't tell about never do, unless `fields` tells (see
+        `Condition`).
+        """
+        if fields is None:
+            return all(test(merge_request, now) is True for test in self.tests)
+        return all(
+            (
+                condition.test(merge_request, now)
+                if condition.test_fields is None
+                else condition.test_fields(fields, now)
+            )
+            is True
+            for condition in self.conditions
+        )
+
+
+class Classifier:
+    """Hides the MRs matching any of the `hide` rules and sorts the others into `sections`, a list of `(title, rule)`
+    where rules may be `None` to take every MR left.
+    """
+
+    def __init__(self, hide=(), sections=()):
+        self.hide = list(hide)
+        self.sections = list(sections)
+
+    @classmethod
+    def from_config(cls, hide="", sections=DEFAULT_SECTIONS):
+        """Compile the `hide` and `sections` settings of `config.ini`. Raises `RuleError` when they're invalid."""
+        hide_rules = [Rule(line) for line in hide.splitlines() if line.strip()]
+
+        section_rules = []
+        for line in (sections or DEFAULT_SECTIONS).splitlines():
+            if not line.strip():
+                continue
+            title, _, rule = line.partition(":")
+            if not title.strip():
+                raise RuleError(f"Section without a title: {line!r}")
+            section_rules.append((title.strip(), Rule(rule) if rule.strip() else None))
+
+        # hiding MRs matching several conditions, or sorting them, takes what only Gitlab knows
+        local_rules = [rule for rule in hide_rules if len(rule.conditions) > 1]
+        local_rules += [rule for _, rule in section_rules if rule is not None]
+        for rule in local_rules:
+            for condition in rule.conditions:
+                if condition.field in REMOTE_FIELDS:
+                    raise RuleError(f"Only Gitlab can evaluate {condition.text!r}: it must be a `hide` rule of its own")
+
+        classifier = cls(hide_rules, section_rules)
+        # rules which feeds can't take together are turned down right away, those only the REST API can't take fail its
+        # feeds (see `push_down`)
+        classifier.pushed_params(api=False, now=0)
+        return classifier
+
+    def classify(self, merge_requests, now=None):
+        """Return `(title, merge_requests)` for every section, in order, leaving out the MRs hidden."""
+        now = time.time() if now is None else now
+        hide = [rule.matches for rule in self.hide]
+        sections = [(rule.matches if rule is not None else None, []) for _, rule in self.sections]
+
+        for mr in merge_requests:
+            if any(matches(mr, now) for matches in hide):
+                continue
+            for matches, section in sections:
+                if matches is None or matches(mr, now):
+                    section.append(mr)
+                    break
+
+        return [(title, section) for (title, _), (_, section) in zip(self.sections, sections)]
+
+    def hides(self, merge_request, now=None, fields=None):
+        """Whether a `hide` rule hides `merge_request`, also knowing its `fields` (see `Condition`), when given."""
+        now = time.time() if now is None else now
+        return any(rule.matches(merge_request, now, fields) for rule in self.hide)
+
+    def push_down(self, url, now=None):
+        """Add the query parameters making Gitlab leave out what `hide` rules would hide to `url`, when it's a merge
+        requests feed or a URL of the REST API. Other URLs are returned as they are.
+
+        Raises `RuleError` when Gitlab can't be asked to leave out all of it with that URL, or when rules only Gitlab
+        can evaluate would hide MRs of another URL.
+        """
+        from mergerequestsmonitor.gitlab import is_api_url
+
+        parts = urlsplit(url)
+        api = is_api_url(url)
+        if not api and not parts.path.endswith("merge_requests.atom"):
+            for rule in self.hide:
+                if rule.conditions[0].field in REMOTE_FIELDS:
+                    raise RuleError(f"Only Gitlab's merge requests can be hidden by {rule.text!r}, not {url}'s")
+            return url
+
+        now = time.time() if now is None else now
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        given = {name for name, _ in query}
+        query.extend((name, value) for name, value in self.pushed_params(api, now) if name not in given)
+        return urlunsplit(parts._replace(query=urlencode(query)))
+
+    def pushed_params(self, api, now):
+        """The query parameters asking Gitlab to leave out what single-condition `hide` rules would hide, for the REST
+        API or for feeds. Raises `RuleError` when Gitlab can't be asked for all of them at once.
+        """
+        params, added = [], {}
+        for rule in self.hide:
+            if len(rule.conditions) != 1:
+                # Gitlab can't be asked to leave out MRs matching several conditions at once
+                continue
+            condition = rule.conditions[0]
+            for name, value in condition.params(api, now).items():
+                if name.endswith("[]"):
+                    params.append((name, value))
+                elif name in ("labels", "not[labels]") and name in added:
+                    # MRs must have every label listed, and those with any of the labels left out are
+                    added[name] = f"{added[name]},{value}"
+                elif name not in added:
+                    added[name] = value
+                elif added[name] != value and condition.field in REMOTE_FIELDS:
+                    # only Gitlab can evaluate those: dropping one would show what it hides
+                    raise RuleError(f"Gitlab can't be asked for both {name}={added[name]} and {name}={value}")
+                # otherwise drafts and ages are still evaluated locally: the first one is enough
+
+        return params + list(added.items())
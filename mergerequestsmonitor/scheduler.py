@@ -0,0 +1,77 @@
+"""
+Decides when every feed is fetched again.
+
+Each feed gets its own polling interval: it doubles every time the feed comes back unchanged, up to the refresh
+interval chosen by the user, and it's halved every time the feed changes. Busy feeds are therefore polled more often
+while dormant ones settle at the user's interval, never costing more requests than a fixed timer would. Shorter delays
+get a random jitter so feeds which were added together don't keep firing together.
+
+The clock and the random source can be swapped, so schedules can be tested without waiting.
+"""
+
+import random
+import time
+
+MIN_INTERVAL = 60
+JITTER = 0.1
+# the refresh intervals users can choose from, in seconds
+INTERVALS = {
+    "60s": 60,
+    "5m": 60 * 5,
+    "10m": 60 * 10,
+    "30m": 60 * 30,
+    "1h": 60 * 60,
+    "3h": 60 * 60 * 3,
+    "6h": 60 * 60 * 6,
+}
+
+
+class Scheduler:
+    """Schedules `FeedState`s between `min_interval` and `max_interval` seconds, see the module docstring."""
+
+    def __init__(self, max_interval, min_interval=MIN_INTERVAL, jitter=JITTER, clock=time.time, random=random.random):
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self.clock = clock
+        self.random = random
+
+    def __repr__(self):
+        return f"<Scheduler: every {self.lower_bound}s to {self.max_interval}s>"
+
+    @property
+    def lower_bound(self):
+        # the user's interval wins over the minimum: "60s" means every minute, changes or not
+        return min(self.min_interval, self.max_interval)
+
+    def next_interval(self, interval, changed):
+        """The interval following `interval` (`None` for feeds never scheduled) after a fetch."""
+        if interval is None:
+            return self.lower_bound
+        return max(self.lower_bound, min(interval / 2 if changed else interval * 2, self.max_interval))
+
+    def delay(self, interval):
+        """`interval` shortened by up to `jitter` of itself, unless feeds are polled at the user's interval already."""
+        if interval >= self.max_interval:
+            return interval
+        return interval * (1 - self.jitter * self.random())
+
+    def schedule(self, feed, changed):
+        """Set when `feed` is fetched again after a successful fetch, which `changed` its MRs or not."""
+        feed.interval = self.next_interval(feed.interval, changed)
+        feed.next_due = self.clock() + self.delay(feed.interval)
+
+    def set_max_interval(self, max_interval, feeds):
+        """Change the user's interval, bringing forward feeds that would be fetched later than it allows."""
+        self.max_interval = max_interval
+        latest = self.clock() + max_interval
+        for feed in feeds:
+            if feed.interval is not None and feed.interval > max_interval:
+                feed.interval = max_interval
+            if feed.next_due is not None and feed.next_due > latest:
+                feed.next_due = latest
+
+    def due(self, feeds):
+        """The feeds in `feeds` which should be fetched now."""
+        now = self.clock()
+        return [feed for feed in feeds if feed.is_due(now)]
@@ -0,0 +1,146 @@
+"""
+Serving snapshots over HTTP, and fetching them as if they were feeds.
+
+A `SnapshotServer` publishes the snapshots of a `daemon` at `SNAPSHOT_PATH`, in the format of `snapshot.dump`. Responses
+have an `ETag`, so clients sending `If-None-Match` get "304 Not Modified" until the MRs change. Adding `?wait=<seconds>`
+to such a request makes it a long-poll: the answer only comes once the MRs changed, or after that many seconds.
+
+Apps can add the URL of a daemon's snapshot to their feeds: `fetch` gets it like the other feeds, so a whole team can
+share a single poller instead of each of them polling Gitlab. Their URLs can long-poll too, with any `wait` up to
+`MAX_WAIT`: `fetch` waits that much longer than the session's `read_timeout` for the answer.
+"""
+
+import hashlib
+import io
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from mergerequestsmonitor import feeds, snapshot
+from mergerequestsmonitor.atom import MergeRequestsDocument
+
+SNAPSHOT_PATH = "/merge_requests.json"
+MAX_WAIT = 300
+
+
+def is_snapshot_url(url):
+    """Whether `url` is where a daemon serves its snapshot rather than a feed."""
+    return urlsplit(url).path.endswith(SNAPSHOT_PATH)
+
+
+def parse_wait(query):
+    """The seconds a long-poll waits, from the `wait` parameter of its `query`, up to `MAX_WAIT`. Raises `ValueError`
+    when it's not a number.
+    """
+    return max(0.0, min(float(parse_qs(query).get("wait", ["0"])[0]), MAX_WAIT))
+
+
+class SnapshotDocument(MergeRequestsDocument):
+    """A snapshot fetched from a daemon: it comes with ready-made `merge_requests` instead of feed entries."""
+
+
+def fetch(session, url, etag=None, timing=None, fingerprint=None):
+    """Fetch the snapshot at `url` with `session`, unless it's still `etag`. Errors are flagged with `bozo`.
+
+    The snapshot is only parsed when its `fingerprint` isn't the one given. Long-polls are given their `wait` on top of
+    the session's `read_timeout`, so they don't time out before the daemon answers.
+    """
+    headers = {"Accept": "application/json"}
+    if etag:
+        headers["If-None-Match"] = etag
+
+    try:
+        read_timeout = session.read_timeout + parse_wait(urlsplit(url).query)
+        response = session.get(url, headers=headers, read_timeout=read_timeout)
+        if response.status == 304:
+            return SnapshotDocument(status=304)
+        if response.status != 200:
+            return SnapshotDocument(status=response.status, bozo=True, bozo_exception=f"HTTP Error {response.status}")
+
+        if timing is not None:
+            timing.add_bytes(len(response.body))
+        document = SnapshotDocument(
+            status=200, etag=response.headers.get("ETag"), fingerprint=feeds.fingerprint(response.body)
+        )
+        if document.fingerprint != fingerprint:
+            document.merge_requests, _ = snapshot.load(io.StringIO(response.body.decode("utf-8")))
+
+    except (OSError, ValueError) as e:
+        return SnapshotDocument(bozo=True, bozo_exception=e)
+
+    return document
+
+
+class SnapshotStore:
+    """The snapshot being served, and a way to wait for the next one. Thread safe."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.body = None
+        self.etag = None
+
+    def update(self, merge_requests, fetched_at):
+        """Publish `merge_requests`. Nothing happens when they're the ones published already."""
+        digest = hashlib.sha1(repr([mr.astuple() for mr in merge_requests]).encode()).hexdigest()
+        etag = f'"{digest[:20]}"'
+        if etag == self.etag:
+            return
+
+        f = io.StringIO()
+        snapshot.dump(merge_requests, fetched_at, f)
+        with self.condition:
+            self.body, self.etag = f.getvalue().encode("utf-8"), etag
+            self.condition.notify_all()
+
+    def get(self, etag=None, wait=0):
+        """Return the `(body, etag)` published, waiting up to `wait` seconds for a new one if it's still `etag`."""
+        with self.condition:
+            if wait > 0:
+                self.condition.wait_for(lambda: self.etag is not None and self.etag != etag, timeout=wait)
+            return self.body, self.etag
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != SNAPSHOT_PATH:
+            return self.respond(404)
+
+        etag = self.headers.get("If-None-Match")
+        try:
+            wait = parse_wait(url.query)
+        except ValueError:
+            return self.respond(400)
+
+        body, current_etag = self.server.store.get(etag if etag else None, wait if etag else 0)
+        if body is None:
+            # nothing was fetched yet
+            return self.respond(503, headers={"Retry-After": "5"})
+        if etag == current_etag:
+            return self.respond(304, headers={"ETag": current_etag})
+
+        self.respond(200, body, {"Content-Type": "application/json", "ETag": current_etag, "Cache-Control": "no-cache"})
+
+    def respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SnapshotServer(ThreadingHTTPServer):
+    """Serves the snapshots published in `store` on `address`, a `(host, port)` tuple."""
+
+    daemon_threads = True
+
+    def __init__(self, address, store):
+        super().__init__(address, SnapshotHandler)
+        self.store = store
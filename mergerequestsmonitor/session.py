@@ -0,0 +1,444 @@
+"""
+A minimal HTTP session keeping connections alive between requests, for GETs and the POSTs of GraphQL APIs.
+
+`urllib` opens a new connection, with a new TLS handshake, for every request. `Session` keeps the connections it opened
+in a pool per host instead, so the pages of a paginated API, and every refresh after the first one, reuse them. It's
+thread safe: each thread takes a connection out of the pool for the duration of a request.
+
+Requests are bounded: connecting may take up to `connect_timeout` seconds, and the whole response, headers and body,
+must have arrived `read_timeout` seconds after the request was sent, so a server trickling bytes can't hold a refresh
+forever. Requests expected to take longer, like long-polls, can be given their own `read_timeout`. Bodies larger than
+`max_size` are refused. `stream` hands the body over as it arrives instead of reading it whole, and `cancel` interrupts
+every request in flight.
+
+Responses are compressed when the server is willing to: gzip and deflate are always accepted, and brotli too when the
+`brotli` package is installed. Bodies are decompressed as they're read, so parsers never see the compressed bytes.
+`connections_opened` and `bytes_received` count the handshakes and the (compressed) body bytes which went over the
+wire, for refreshes to report them.
+
+Requests to every host go through a `ratelimit.TokenBucket`, which also follows the rate limits servers tell about.
+Requests which would have to wait too long for it raise `ratelimit.Throttled`, and so do "429 Too Many Requests"
+responses, unless the server asks to wait so little that the request is just sent again.
+"""
+
+import http.client
+import socket
+import threading
+import time
+import zlib
+
+from urllib.parse import urljoin, urlsplit
+
+from mergerequestsmonitor.ratelimit import DEFAULT_RATE, MAX_WAIT, Throttled, TokenBucket
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+CHUNK_SIZE = 64 * 1024
+SUPPORTED_ENCODINGS = ("gzip", "x-gzip", "deflate", "br")
+
+# decoded bodies are read in chunks of at most this size from decompressors, so that they can be bounded as well
+DECODED_CHUNK_SIZE = 256 * 1024
+
+# errors telling that a connection that was kept alive has been closed by the server in the meantime
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class ResponseTooLarge(OSError):
+    pass
+
+
+class Cancelled(Exception):
+    """Raised by the requests of a session which was cancelled. It isn't an `OSError`: nothing failed."""
+
+
+def accept_encoding():
+    """The `Accept-Encoding` header to send: brotli is only accepted when it can be decompressed."""
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return "gzip, deflate"
+    return "gzip, deflate, br"
+
+
+class Decoder:
+    """Decompresses a body encoded with `encoding`, `gzip`, `deflate` or `br`, as it arrives."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        # compressed data left over when the output was bounded, decompressed by the next calls
+        self.tail = b""
+        self.started = False
+        self.errors = (zlib.error,)
+        if encoding == "br":
+            try:
+                import brotli
+            except ImportError:
+                # it wasn't accepted: reading the body fails like for any other invalid body
+                self.decompressor = None
+            else:
+                self.decompressor = brotli.Decompressor()
+                self.errors = (brotli.error,)
+        elif encoding in ("gzip", "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+
+    def pending(self):
+        return bool(self.tail)
+
+    def decompress(self, data, size):
+        """Return up to `size` bytes out of `data`, and out of what previous calls left over, decompressed. Raises
+        `OSError` for corrupted bodies.
+        """
+        if self.decompressor is None:
+            raise OSError(f"Can't decompress {self.encoding} bodies, install brotli")
+        try:
+            if self.encoding == "br":
+                # brotli can't bound its output
+                output = self.decompressor.process(data)
+            else:
+                output = self.decompressor.decompress(self.tail + data, size)
+                self.tail = self.decompressor.unconsumed_tail
+        except self.errors as e:
+            if self.encoding == "deflate" and not self.started:
+                # some servers send raw deflate streams, without the zlib header the standard asks for
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                self.started = True
+                return self.decompress(data, size)
+            raise OSError(f"Invalid {self.encoding} body: {e}") from e
+        self.started = True
+        return output
+
+    def flush(self):
+        return b"" if self.encoding == "br" else self.decompressor.flush()
+
+
+class Response:
+    """A response whose body was read entirely."""
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def __repr__(self):
+        return f"<Response: {self.status} ({self.url})>"
+
+
+class StreamedResponse:
+    """A response whose body is read as it arrives, like a binary file, and decompressed. Use it as a context manager:
+    its connection goes back to the pool once the body was read entirely, and is closed otherwise.
+
+    `bytes_read` counts the bytes of the body once decompressed, `bytes_received` those which went over the wire.
+    """
+
+    def __init__(self, session, key, connection, sock, response, url, deadline, read_timeout):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.sock = sock
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self.deadline = deadline
+        self.read_timeout = read_timeout
+        self.bytes_read = 0
+        self.bytes_received = 0
+        encoding = (self.headers.get("Content-Encoding") or "identity").strip().lower()
+        self.decoder = Decoder(encoding) if encoding in SUPPORTED_ENCODINGS else None
+
+    def __repr__(self):
+        return f"<StreamedResponse: {self.status} ({self.url})>"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the body, or all of it. Raises `TimeoutError` once the response took longer than
+        the session's `read_timeout`, and `ResponseTooLarge` once it's larger than its `max_size`, compressed or not.
+        """
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(CHUNK_SIZE if self.decoder is None else DECODED_CHUNK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+
+        if self.decoder is None:
+            data = self.receive(size)
+        else:
+            data = self.decode(size)
+
+        self.bytes_read += len(data)
+        if self.bytes_read > self.session.max_size:
+            raise ResponseTooLarge(f"Response larger than {self.session.max_size} bytes")
+        return data
+
+    def decode(self, size):
+        """Decompress up to `size` bytes of the body, receiving more of it until there's something to return."""
+        # one byte more than allowed tells bodies which are too large, and bounds what a tiny one can inflate to
+        size = min(size, self.session.max_size - self.bytes_read + 1)
+        while True:
+            if self.decoder.pending():
+                data = self.decoder.decompress(b"", size)
+            else:
+                received = self.receive(CHUNK_SIZE)
+                if not received:
+                    return self.decoder.flush()
+                data = self.decoder.decompress(received, size)
+            if data:
+                return data
+
+    def receive(self, size):
+        """Read up to `size` bytes of the body as it went over the wire."""
+        if self.at_end():
+            return b""
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Response took longer than {self.read_timeout}s")
+        self.sock.settimeout(remaining)
+
+        try:
+            # `read1` returns whatever arrived instead of waiting for `size` bytes, so the deadline is checked again
+            # before waiting for more. One byte more than allowed tells responses which are too large.
+            data = self.response.read1(min(size, self.session.max_size - self.bytes_received + 1))
+        except (OSError, http.client.HTTPException) as e:
+            self.session.check_cancelled()
+            if isinstance(e, OSError):
+                raise
+            raise OSError(f"{type(e).__name__}: {e}") from e
+        self.session.check_cancelled()
+        if not data and size and self.response.length:
+            raise OSError(f"Connection closed {self.response.length} bytes before the end of the response")
+
+        self.bytes_received += len(data)
+        if self.bytes_received > self.session.max_size:
+            raise ResponseTooLarge(f"Response larger than {self.session.max_size} bytes")
+        return data
+
+    def at_end(self):
+        """Whether the whole body was read: `read1` doesn't close responses once it's done, like `read` does."""
+        return self.response.isclosed() or self.response.length == 0
+
+    def close(self):
+        self.session.finished(self.sock, self.bytes_received)
+        reusable = self.at_end() and not self.response.will_close
+        self.response.close()
+        if reusable:
+            self.session.release(self.key, self.connection)
+        else:
+            # the rest of the body would have to be read before sending another request
+            self.connection.close()
+
+
+class Session:
+    """Sends requests through a pool of keep-alive connections, one pool per scheme, host and port."""
+
+    def __init__(
+        self,
+        headers=None,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        max_size=DEFAULT_MAX_SIZE,
+        rate_limit=DEFAULT_RATE,
+    ):
+        self.headers = {"Accept-Encoding": accept_encoding(), **(headers or {})}
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_size = max_size
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.pools = {}
+        # a token bucket per host, see `ratelimit`
+        self.buckets = {}
+        # sockets of the requests in flight, for `cancel` to interrupt them
+        self.active = set()
+        self.cancelled = threading.Event()
+        self.connections_opened = 0
+        self.bytes_received = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self, scheme, netloc):
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(netloc, timeout=self.connect_timeout)
+        connection.connect()
+        with self.lock:
+            self.connections_opened += 1
+        return connection
+
+    def acquire(self, key):
+        """Take an idle connection to `key` out of the pool, or open a new one. Returns it and whether it's new."""
+        with self.lock:
+            idle = self.pools.get(key)
+            if idle:
+                return idle.pop(), False
+        return self.connect(*key), True
+
+    def release(self, key, connection):
+        with self.lock:
+            self.pools.setdefault(key, []).append(connection)
+
+    def started(self, sock):
+        with self.lock:
+            self.active.add(sock)
+
+    def finished(self, sock, bytes_received=0):
+        with self.lock:
+            self.active.discard(sock)
+            self.bytes_received += bytes_received
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(host, rate=self.rate_limit)
+            return bucket
+
+    def throttle(self, bucket):
+        """Wait for a token of `bucket` before sending a request, unless the session is cancelled in the meantime."""
+        wait = bucket.reserve()
+        if wait > 0 and self.cancelled.wait(wait):
+            raise Cancelled()
+
+    def throttled(self):
+        """The hosts which asked to back off, with the seconds until they take requests again."""
+        with self.lock:
+            buckets = list(self.buckets.values())
+        return {bucket.host: bucket.blocked_for() for bucket in buckets if bucket.blocked_for() > 0}
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+    def cancel(self):
+        """Interrupt the requests in flight and make new ones raise `Cancelled`, until `resume` is called."""
+        self.cancelled.set()
+        with self.lock:
+            active = list(self.active)
+        for sock in active:
+            try:
+                # wakes up the threads waiting for data on it
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def resume(self):
+        self.cancelled.clear()
+
+    def open(self, url, headers, method="GET", body=None, read_timeout=None):
+        """Send a `method` request for `url` and return its `StreamedResponse`, without following redirects."""
+        read_timeout = self.read_timeout if read_timeout is None else read_timeout
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        while True:
+            self.check_cancelled()
+            connection, is_new = self.acquire(key)
+            sock = connection.sock
+            self.started(sock)
+            try:
+                self.check_cancelled()
+                sock.settimeout(self.connect_timeout)
+                connection.request(method, path, body=body, headers=headers)
+                deadline = time.monotonic() + read_timeout
+                sock.settimeout(read_timeout)
+                response = connection.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                self.finished(sock)
+                connection.close()
+                self.check_cancelled()
+                if is_new:
+                    raise
+                # the server dropped an idle connection, try again with another one
+                continue
+            except (OSError, http.client.HTTPException) as e:
+                self.finished(sock)
+                connection.close()
+                self.check_cancelled()
+                if isinstance(e, OSError):
+                    raise
+                raise OSError(f"{type(e).__name__}: {e}") from e
+            except Cancelled:
+                self.finished(sock)
+                connection.close()
+                raise
+
+            return StreamedResponse(self, key, connection, sock, response, url, deadline, read_timeout)
+
+    def stream(self, url, headers=None, method="GET", body=None, read_timeout=None):
+        """GET `url`, or send it another `method` with `body`, following redirects, and return its `StreamedResponse`.
+        Connection errors are raised as `OSError`s, like `urllib` does, requests the host can't take yet raise
+        `ratelimit.Throttled`, and cancelled requests raise `Cancelled`. `read_timeout` overrides the session's.
+        """
+        headers = {**self.headers, **(headers or {})}
+        redirects = 0
+        retried = False
+        while True:
+            bucket = self.bucket(url)
+            self.throttle(bucket)
+            response = self.open(url, headers, method, body, read_timeout)
+            bucket.update(response.status, response.headers)
+
+            if response.status == 429:
+                with response:
+                    response.read()
+                delay = bucket.blocked_for()
+                if retried or delay > MAX_WAIT:
+                    raise Throttled(bucket.host, delay)
+                # `throttle` waits until the host takes requests again
+                retried = True
+                continue
+
+            location = response.headers.get("Location")
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            with response:
+                # the body of a redirect is small: read it so that the connection can be reused
+                response.read()
+
+            if redirects == MAX_REDIRECTS:
+                raise OSError(f"Too many redirects, the last one to {location}")
+            redirects += 1
+            redirect_url = urljoin(url, location)
+            if urlsplit(redirect_url).netloc != urlsplit(url).netloc:
+                # tokens and validators are meant for the host they were sent to
+                headers = dict(self.headers)
+            url = redirect_url
+            if response.status not in (307, 308):
+                # like browsers do, only those keep the method and body of the request
+                method, body = "GET", None
+
+    def get(self, url, headers=None, read_timeout=None):
+        """GET `url` and return its `Response`, with the whole body (see `stream`)."""
+        with self.stream(url, headers, read_timeout=read_timeout) as response:
+            return Response(response.url, response.status, response.headers, response.read())
+
+    def post(self, url, body, headers=None):
+        """POST `body`, bytes, to `url` and return its `Response`, with the whole body (see `stream`)."""
+        with self.stream(url, headers, method="POST", body=body) as response:
+            return Response(response.url, response.status, response.headers, response.read())
+
+    def close(self):
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for connections in pools.values():
+            for connection in connections:
+                connection.close()
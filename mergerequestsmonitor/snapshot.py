@@ -0,0 +1,84 @@
+"""
+Snapshots: the MRs displayed after a refresh.
+
+`merge` builds a snapshot out of the MRs of every feed, dropping the MRs listed by several of them, and tells what
+changed since the previous one.
+
+Snapshots are also persisted after a successful refresh, so the app can show something useful as soon as it starts.
+They're compact JSON documents: MRs are stored as arrays of their fields rather than objects.
+"""
+
+import json
+
+from collections import namedtuple
+
+from mergerequestsmonitor.models import MergeRequest
+
+SNAPSHOT_VERSION = 1
+
+
+class Changes(namedtuple("Changes", ["added", "removed", "changed"])):
+    """The MRs `added`, `removed` or `changed` between two snapshots. It's false when nothing changed."""
+
+    __slots__ = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def _is_newer(merge_request, other):
+    if other.updated is None:
+        return merge_request.updated is not None
+    return merge_request.updated is not None and merge_request.updated > other.updated
+
+
+def merge(merge_request_lists, previous=()):
+    """Merge the MRs of every list in `merge_request_lists` into a snapshot and return it with its `Changes`.
+
+    MRs are deduplicated by id, keeping the most recently updated version of each, in the order they first appear.
+    Changes are computed against the `previous` snapshot. Everything runs in linear time.
+    """
+    merged = {}
+    for merge_requests in merge_request_lists:
+        for merge_request in merge_requests:
+            other = merged.get(merge_request.id)
+            if other is None or _is_newer(merge_request, other):
+                merged[merge_request.id] = merge_request
+
+    previous = {merge_request.id: merge_request for merge_request in previous}
+    added, changed = [], []
+    for id, merge_request in merged.items():
+        other = previous.pop(id, None)
+        if other is None:
+            added.append(merge_request)
+        elif other != merge_request:
+            changed.append(merge_request)
+
+    return list(merged.values()), Changes(added, list(previous.values()), changed)
+
+
+def dump(merge_requests, fetched_at, f):
+    """Write `merge_requests`, fetched at the `fetched_at` POSIX timestamp, to the text file `f`."""
+    json.dump(
+        {
+            "version": SNAPSHOT_VERSION,
+            "fetched_at": fetched_at,
+            "merge_requests": [merge_request.astuple() for merge_request in merge_requests],
+        },
+        f,
+        separators=(",", ":"),
+    )
+
+
+def load(f):
+    """Read a snapshot written by `dump` from the text file `f` and return `(merge_requests, fetched_at)`.
+
+    Raises `ValueError` when `f` isn't a snapshot this version of the app can read.
+    """
+    data = json.load(f)
+    try:
+        if data["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version: {data['version']}")
+        return [MergeRequest(*fields) for fields in data["merge_requests"]], data["fetched_at"]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid snapshot: {e}") from e
@@ -0,0 +1,168 @@
+"""
+Receives Gitlab's merge request webhooks, so MRs show up as soon as they're opened, updated, merged or closed.
+
+Set `webhook_listen` in `config.ini` to an address like `127.0.0.1:8766`, and point a Gitlab webhook with "Merge
+request events" at `http://<address>/gitlab`, directly or through a relay forwarding them. When `webhook_secret` is
+set, only requests with that "Secret token" are accepted.
+
+Events only patch what's known, and add the MRs just opened which the feeds would list (see `Engine.apply_event`):
+polling carries on, less urgently, to catch anything a webhook didn't tell about.
+"""
+
+import hmac
+import json
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mergerequestsmonitor.models import MergeRequest, parse_timestamp
+
+WEBHOOK_PATH = "/gitlab"
+MERGE_REQUEST_HOOK = "Merge Request Hook"
+# Gitlab's payloads are a few KB, larger ones aren't read
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def parse_address(address):
+    """Return the `(host, port)` to listen on for an address like `127.0.0.1:8766`, or `8766` for localhost."""
+    host, _, port = address.strip().rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def parse_date(text):
+    """Return the POSIX timestamp of a webhook's date, ISO 8601 or like `2024-05-02 10:00:00 UTC` for older Gitlabs."""
+    timestamp = parse_timestamp(text)
+    if timestamp is None and isinstance(text, str):
+        try:
+            date = datetime.strptime(text, "%Y-%m-%d %H:%M:%S %Z")
+        except ValueError:
+            return None
+        timestamp = date.replace(tzinfo=timezone.utc).timestamp()
+    return timestamp
+
+
+class MergeRequestEvent:
+    """What a webhook told about an MR: its new version, whether it's `closed` (merged or closed), and the `fields`
+    feeds don't tell which rules may look at (see `rules.Condition`).
+    """
+
+    __slots__ = ("action", "merge_request", "closed", "fields")
+
+    def __init__(self, action, merge_request, closed, fields=None):
+        self.action = action
+        self.merge_request = merge_request
+        self.closed = closed
+        self.fields = fields if fields is not None else {}
+
+    def __repr__(self):
+        return f"<MergeRequestEvent: {self.action} {self.merge_request!r}>"
+
+    def merged_with(self, known):
+        """The MR of the event, with the fields webhooks don't tell about taken from the `known` version of it."""
+        mr = self.merge_request
+        return MergeRequest(
+            id=mr.id,
+            title=mr.title,
+            link=mr.link,
+            author=mr.author or known.author,
+            project=mr.project or known.project,
+            updated=mr.updated,
+            is_draft=mr.is_draft,
+            created=mr.created or known.created,
+        )
+
+
+def parse_event(payload):
+    """Return the `MergeRequestEvent` of a webhook's JSON `payload`, or `None` when it's not about a merge request.
+    Raises `ValueError` when it is, but can't be understood.
+    """
+    if not isinstance(payload, dict) or payload.get("object_kind") != "merge_request":
+        return None
+
+    try:
+        attributes = payload["object_attributes"]
+        link = attributes["url"]
+        action = attributes.get("action")
+        # `user` is who triggered the event: when it's opening the MR, that's its author
+        user = payload.get("user", {}) if action == "open" else {}
+        author = user.get("name")
+        is_draft = attributes.get("draft", attributes.get("work_in_progress"))
+        merge_request = MergeRequest(
+            id=link,
+            title=attributes["title"],
+            link=link,
+            author=author,
+            project=payload.get("project", {}).get("path_with_namespace"),
+            updated=parse_date(attributes.get("updated_at")),
+            is_draft=bool(is_draft) if is_draft is not None else None,
+            created=parse_date(attributes.get("created_at")),
+        )
+        fields = {
+            "username": user.get("username"),
+            # in both places, depending on Gitlab's version
+            "label": [label["title"] for label in payload.get("labels") or attributes.get("labels") or []],
+            "state": attributes["state"],
+        }
+        return MergeRequestEvent(action, merge_request, closed=attributes["state"] != "opened", fields=fields)
+    except (AttributeError, KeyError, TypeError) as e:
+        raise ValueError(f"invalid merge request event: {e!r}") from e
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        # replies sent before the body is read close the connection: what's left of it isn't a request
+        if self.path.split("?", 1)[0] != WEBHOOK_PATH:
+            return self.respond(404, close=True)
+
+        secret = self.server.secret
+        # compared as bytes: `compare_digest` refuses strings which aren't ASCII
+        if secret and not hmac.compare_digest(self.headers.get("X-Gitlab-Token", "").encode(), secret.encode()):
+            return self.respond(401, close=True)
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self.respond(411, close=True)
+        if length < 0:
+            return self.respond(400, close=True)
+        if length > MAX_BODY_SIZE:
+            return self.respond(413, close=True)
+        body = self.rfile.read(length)
+
+        if self.headers.get("X-Gitlab-Event") != MERGE_REQUEST_HOOK:
+            # other events are welcome, just of no use
+            return self.respond(204)
+
+        try:
+            event = parse_event(json.loads(body))
+        except ValueError:
+            return self.respond(400)
+        if event is not None:
+            self.server.on_event(event)
+        self.respond(202)
+
+    def respond(self, status, close=False):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        if close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Listens for Gitlab's webhooks on `address`, a `(host, port)` tuple, and calls `on_event` with the
+    `MergeRequestEvent` of each. `on_event` is called from the server's threads.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, on_event, secret=None):
+        super().__init__(address, WebhookHandler)
+        self.on_event = on_event
+        self.secret = secret
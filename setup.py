@@ -12,7 +12,7 @@ OPTIONS = {
         "LSUIElement": True,
     },
     "iconfile": "media/icon.png",
-    "packages": ["rumps"],
+    "packages": ["rumps", "mergerequestsmonitor"],
 }
 
 REQ_LIST = [
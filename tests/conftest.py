@@ -0,0 +1,98 @@
+import io
+import threading
+
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from mergerequestsmonitor.session import Session
+
+# a merge requests feed as Gitlab serves them, with more than the app reads
+ATOM_FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:media="http://search.yahoo.com/mrss/">
+  <title>group/project merge requests</title>
+  <link href="https://gitlab.com/group/project/-/merge_requests.atom" rel="self" type="application/atom+xml"/>
+  <id>https://gitlab.com/group/project/-/merge_requests</id>
+  <updated>2024-05-02T10:00:00Z</updated>
+  <entry>
+    <id>https://gitlab.com/group/project/-/merge_requests/2</id>
+    <link href="https://gitlab.com/group/project/-/merge_requests/2"/>
+    <title>Draft: Fix &amp;quot;bug&amp;quot;</title>
+    <published>2024-05-01T10:00:00Z</published>
+    <updated>2024-05-02T10:00:00Z</updated>
+    <media:thumbnail width="40" height="40" url="https://gitlab.com/avatar.png"/>
+    <author>
+      <name>Jane Doe</name>
+      <email>jane@example.com</email>
+    </author>
+    <summary type="html">&lt;p&gt;Fixes the bug&lt;/p&gt;</summary>
+    <labels>
+      <label>bug</label>
+    </labels>
+  </entry>
+  <entry>
+    <id>https://gitlab.com/group/project/-/merge_requests/1</id>
+    <link rel="alternate" href="https://gitlab.com/group/project/-/merge_requests/1"/>
+    <title>Add feature</title>
+    <updated>2024-05-01T09:30:00Z</updated>
+  </entry>
+</feed>
+"""
+
+
+class FakeResponse(io.BytesIO):
+    """Stands in for the responses returned by `Session.stream`"""
+
+    def __init__(self, body=b"", status=200, headers=None, url=None):
+        super().__init__(body)
+        self.status = status
+        self.headers = headers or {}
+        self.url = url
+
+    @property
+    def bytes_read(self):
+        return self.tell()
+
+
+class FakeClock:
+    """A clock which only moves when told to"""
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def serve():
+    """Starts serving in a thread: `serve(Handler, **attributes)` a local server answering with `Handler`, or
+    `serve(server, **attributes)` a server already listening, with `attributes` set on it. Servers stop with the test.
+    """
+    servers = []
+
+    def serve(server, **attributes):
+        if isinstance(server, type):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), server)
+        server.daemon_threads = True
+        for name, value in attributes.items():
+            setattr(server, name, value)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def session():
+    with Session() as session:
+        yield session
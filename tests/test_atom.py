@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from mergerequestsmonitor import atom
+from tests.conftest import ATOM_FEED
+
+
+class TestAtomParser:
+    """Test suite for the streaming Atom parser"""
+
+    def test_parse(self):
+        """Test entries are parsed with the fields the app uses"""
+        document = atom.parse(ATOM_FEED)
+
+        assert not document.bozo
+        assert len(document.entries) == 2
+
+        entry = document.entries[0]
+        assert entry.id == "https://gitlab.com/group/project/-/merge_requests/2"
+        assert entry.link == "https://gitlab.com/group/project/-/merge_requests/2"
+        assert entry.title == "Draft: Fix &quot;bug&quot;"
+        assert entry.updated == "2024-05-02T10:00:00Z"
+        assert entry.author == "Jane Doe"
+        assert entry.published == "2024-05-01T10:00:00Z"
+        assert document.entries[1].author is None
+
+    def test_parse_from_stream(self):
+        """Test entries are parsed from file-like objects too"""
+        entries = list(atom.iter_entries(io.BufferedReader(io.BytesIO(ATOM_FEED), buffer_size=64)))
+
+        assert [entry.title for entry in entries] == ["Draft: Fix &quot;bug&quot;", "Add feature"]
+
+    def test_get(self):
+        """Test fields can be read like feedparser's entries"""
+        entry = atom.parse(ATOM_FEED).entries[1]
+
+        assert entry.get("title") == "Add feature"
+        assert entry.get("summary", "") == ""
+
+    def test_parse_empty_feed(self):
+        """Test feeds without entries are parsed fine"""
+        document = atom.parse(b'<feed xmlns="http://www.w3.org/2005/Atom"><title>Empty</title></feed>')
+
+        assert document.entries == []
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            b"",
+            b"<html><body>Sign in</body></html>",
+            b'<rss version="2.0"><channel></channel></rss>',
+            ATOM_FEED[:-20],
+        ],
+    )
+    def test_unsupported_feeds(self, body):
+        """Test documents other than well-formed Atom feeds are left to feedparser"""
+        with pytest.raises(atom.UnsupportedFeed):
+            atom.parse(body)
@@ -0,0 +1,137 @@
+import itertools
+import threading
+import time
+
+from unittest.mock import Mock, patch
+
+import feedparser
+import pytest
+
+from mergerequestsmonitor import server
+from mergerequestsmonitor.daemon import Daemon, read_config
+from mergerequestsmonitor.engine import Engine
+from mergerequestsmonitor.scheduler import Scheduler
+from tests.conftest import FakeResponse
+
+
+def feed(*numbers):
+    return feedparser.FeedParserDict(
+        bozo=False,
+        entries=[
+            Mock(
+                id=f"https://gitlab.com/group/project/-/merge_requests/{number}",
+                title=f"MR {number}",
+                link=f"https://gitlab.com/group/project/-/merge_requests/{number}",
+                author="Jane Doe",
+                updated="2024-05-02T10:00:00Z",
+            )
+            for number in numbers
+        ],
+    )
+
+
+def new_engine(state_dir):
+    def open_file(name, mode="r"):
+        return open(state_dir / name, mode)
+
+    # the pages `mock_stream` answers are for `feedparser.parse` mocks
+    return Engine(open_file, Scheduler(max_interval=300), feed_parser="feedparser")
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    (tmp_path / "daemon").mkdir()
+    daemon = Daemon(new_engine(tmp_path / "daemon"), ["https://gitlab.com/feed.atom"], server.SnapshotStore())
+    yield daemon
+    daemon.engine.close()
+
+
+@pytest.fixture
+def mock_stream(daemon):
+    """Answer the daemon's downloads instead of Gitlab, with a page of their own for `feedparser.parse` mocks"""
+    pages = itertools.count()
+    with patch.object(daemon.engine.session, "stream") as mock_stream:
+        mock_stream.side_effect = lambda url, headers=None: FakeResponse(b"page %d" % next(pages))
+        yield mock_stream
+
+
+@pytest.fixture
+def snapshot_url(daemon):
+    snapshot_server = server.SnapshotServer(("127.0.0.1", 0), daemon.store)
+    threading.Thread(target=snapshot_server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{snapshot_server.server_port}{server.SNAPSHOT_PATH}"
+    snapshot_server.shutdown()
+    snapshot_server.server_close()
+
+
+def test_read_config(tmp_path):
+    """Test the daemon reads the same config file as the app"""
+    (tmp_path / "config.ini").write_text("[Gitlab]\nfeeds = https://gitlab.com/a.atom,https://gitlab.com/b.atom\n")
+    assert read_config(tmp_path / "config.ini")["feeds"] == "https://gitlab.com/a.atom,https://gitlab.com/b.atom"
+
+
+@patch("feedparser.parse")
+def test_poll_publishes_snapshot(mock_parse, daemon, mock_stream):
+    """Test polling publishes the MRs, and only changes the snapshot when they changed"""
+    mock_parse.return_value = feed(1, 2)
+    changes = daemon.poll(due_only=False)
+    assert [mr.title for mr in changes.added] == ["MR 1", "MR 2"]
+    body, etag = daemon.store.get()
+    assert b"MR 1" in body
+
+    mock_stream.side_effect = lambda url, headers=None: FakeResponse(status=304)
+    assert not daemon.poll(due_only=False)
+    assert daemon.store.get() == (body, etag)
+
+    # nothing is due yet
+    assert not daemon.engine.has_due_feeds(daemon.feed_urls)
+    assert not daemon.poll()
+    assert mock_stream.call_count == 2
+    assert mock_parse.call_count == 1
+
+
+def test_stop_interrupts_poll(daemon):
+    """Test stopping the daemon cancels the downloads in progress instead of waiting for them"""
+    started = threading.Event()
+
+    def stream(url, headers=None):
+        started.set()
+        while True:
+            daemon.engine.session.check_cancelled()
+            time.sleep(0.01)
+
+    with patch.object(daemon.engine.session, "stream", side_effect=stream):
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        started.wait(1)
+        daemon.stop()
+        thread.join(1)
+
+    assert not thread.is_alive()
+    assert daemon.store.get() == (None, None)
+
+
+@patch("feedparser.parse")
+def test_app_engine_fetches_from_daemon(mock_parse, daemon, mock_stream, snapshot_url, tmp_path):
+    """Test another engine can use a daemon's snapshot as a feed, with conditional requests"""
+    mock_parse.return_value = feed(1, 2)
+    daemon.poll(due_only=False)
+
+    (tmp_path / "app").mkdir()
+    engine = new_engine(tmp_path / "app")
+    merge_requests, changes = engine.fetch_merge_requests([snapshot_url])
+    assert merge_requests == daemon.merge_requests
+    assert len(changes.added) == 2
+    assert engine.fetch_stats == {"downloaded": 1, "not_modified": 0}
+
+    merge_requests, changes = engine.fetch_merge_requests([snapshot_url], previous=merge_requests)
+    assert merge_requests == daemon.merge_requests
+    assert not changes
+    assert engine.fetch_stats == {"downloaded": 1, "not_modified": 1}
+
+    mock_parse.return_value = feed(2, 3)
+    daemon.poll(due_only=False)
+    merge_requests, changes = engine.fetch_merge_requests([snapshot_url], previous=merge_requests)
+    assert [mr.title for mr in merge_requests] == ["MR 2", "MR 3"]
+    assert [mr.title for mr in changes.removed] == ["MR 1"]
+    engine.close()
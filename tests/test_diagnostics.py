@@ -0,0 +1,61 @@
+import io
+import json
+
+from mergerequestsmonitor.diagnostics import Diagnostics, FeedTiming, MeteredReader, RefreshTiming, feed_label
+
+
+def test_feed_timing():
+    """Test feed timings hide tokens and summarise what's known"""
+    timing = FeedTiming("https://gitlab.com/group/project/-/merge_requests.atom?feed_token=secret", status=200)
+    timing.fetch_seconds = 0.25
+    timing.add_bytes(2048)
+    timing.add_parse_seconds(0.0125)
+    timing.entries = 12
+
+    assert "secret" not in json.dumps(timing.asdict())
+    assert timing.summary() == "200, 2KB, 250ms + 12ms parsing, 12 MRs"
+
+    timing = FeedTiming("https://gitlab.com/feed.atom", fetch_seconds=1.5, error="Connection refused")
+    assert timing.summary() == "failed after 1.50s: Connection refused"
+
+
+def test_feed_label():
+    """Test feeds are named after their project when they have one"""
+    assert feed_label("https://gitlab.com/group/project/-/merge_requests.atom?feed_token=secret") == "group/project"
+    assert feed_label("https://gitlab.com/api/v4/merge_requests?private_token=secret") == "api/v4/merge_requests"
+
+
+def test_diagnostics_history_is_bounded(tmp_path):
+    """Test only the last refreshes are kept in memory, and all of them are logged"""
+    log_path = tmp_path / "refreshes.jsonl"
+    diagnostics = Diagnostics(size=2, log_path=str(log_path))
+
+    for seconds in (1.0, 2.0, 4.0):
+        timing = RefreshTiming(started_at=0)
+        timing.seconds = seconds
+        diagnostics.record(timing)
+
+    assert [timing.seconds for timing in diagnostics] == [2.0, 4.0]
+    assert diagnostics.mean_seconds() == 3.0
+    assert [json.loads(line)["seconds"] for line in log_path.read_text().splitlines()] == [1.0, 2.0, 4.0]
+
+
+def test_diagnostics_unwritable_log(tmp_path):
+    """Test a log which can't be written stops being used instead of breaking refreshes"""
+    diagnostics = Diagnostics(log_path=str(tmp_path / "missing" / "refreshes.jsonl"))
+
+    diagnostics.record(RefreshTiming())
+
+    assert diagnostics.log_path is None
+    assert len(diagnostics) == 1
+
+
+def test_metered_reader():
+    """Test bytes read through the reader are counted"""
+    reader = MeteredReader(io.BytesIO(b"x" * 100))
+
+    reader.read(60)
+    reader.read()
+
+    assert reader.bytes == 100
+    assert reader.seconds >= 0
@@ -0,0 +1,94 @@
+import io
+
+from unittest.mock import Mock
+
+from mergerequestsmonitor.feeds import (
+    MAX_RETRY_DELAY,
+    RETRY_DELAY,
+    FeedState,
+    FingerprintReader,
+    entries_fingerprint,
+    fingerprint,
+    retry_delay,
+)
+from mergerequestsmonitor.models import MergeRequest
+
+
+class TestFeedState:
+    """Test suite for the per-feed state"""
+
+    def test_retry_delay(self):
+        """Test retries back off exponentially up to a maximum"""
+        assert retry_delay(1) == RETRY_DELAY
+        assert retry_delay(2) == RETRY_DELAY * 2
+        assert retry_delay(3) == RETRY_DELAY * 4
+        assert retry_delay(100) == MAX_RETRY_DELAY
+
+    def test_failed_and_recovered(self):
+        """Test failing feeds wait for their retry time and forget their errors once they work again"""
+        feed = FeedState("https://gitlab.com/feed.atom")
+        assert feed.is_due(0)
+
+        feed.failed(OSError("Connection refused"), now=100)
+        feed.failed(OSError(), now=200)
+
+        assert feed.failing
+        assert feed.error == "OSError"
+        assert feed.failures == 2
+        assert not feed.is_due(200 + RETRY_DELAY)
+        assert feed.is_due(200 + RETRY_DELAY * 2)
+
+        feed.not_modified(now=400)
+
+        assert not feed.failing
+        assert feed.failures == 0
+        assert feed.is_due(400)
+
+    def test_validators(self):
+        """Test validators are only sent for feeds which were downloaded"""
+        feed = FeedState("https://gitlab.com/feed.atom", etag='"abc"')
+        assert feed.validators == (None, None)
+
+        assert not feed.succeeded([], now=100, etag='"def"', modified="Thu, 02 May 2024 10:00:00 GMT")
+        assert feed.validators == ('"def"', "Thu, 02 May 2024 10:00:00 GMT")
+
+    def test_asdict_fromdict(self):
+        """Test feeds survive a round trip to JSON-friendly data, without their errors"""
+        feed = FeedState("https://gitlab.com/feed.atom")
+        assert feed.succeeded([MergeRequest(id="1", title="MR", link="https://gitlab.com/mr/1")], now=100, etag='"abc"')
+        feed.interval = 120
+        feed.failed(OSError("Connection refused"), now=200)
+
+        restored = FeedState.fromdict(feed.url, feed.asdict())
+
+        assert restored.merge_requests == feed.merge_requests
+        assert restored.validators == ('"abc"', None)
+        assert restored.fetched_at == 100
+        assert restored.interval == 120
+        assert not restored.failing
+
+    def test_fingerprint(self):
+        """Test fingerprints tell downloads apart, and only unchanged downloads of fetched feeds are skipped"""
+        assert fingerprint(b"<feed/>") == fingerprint("<feed/>")
+        assert fingerprint(b"<feed/>") != fingerprint(b"<feed></feed>")
+        assert fingerprint(b"ab", b"c") != fingerprint(b"a", b"bc")
+
+        reader = FingerprintReader(io.BytesIO(b"<feed/>"))
+        assert reader.read(3) + reader.read() == b"<feed/>"
+        assert reader.fingerprint() == fingerprint(b"<feed/>")
+
+        entry = Mock(id="1", title="Fix bug", updated="2024-05-02T10:00:00Z")
+        assert entries_fingerprint([entry]) == entries_fingerprint(
+            [Mock(id="1", title="Fix bug", updated=entry.updated)]
+        )
+        assert entries_fingerprint([entry]) != entries_fingerprint([Mock(id="1", title="Fix bug", updated=None)])
+
+        feed = FeedState("https://gitlab.com/feed.atom", fingerprint=fingerprint(b"<feed/>"))
+        assert not feed.is_unchanged(fingerprint(b"<feed/>"))
+        feed.succeeded([], now=100, fingerprint=fingerprint(b"<feed/>"))
+        assert feed.is_unchanged(fingerprint(b"<feed/>"))
+        assert not feed.is_unchanged(None)
+
+        feed.unchanged(now=200, etag='"abc"')
+        assert feed.validators == ('"abc"', None)
+        assert FeedState.fromdict(feed.url, feed.asdict()).is_unchanged(fingerprint(b"<feed/>"))
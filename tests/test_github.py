@@ -0,0 +1,248 @@
+import json
+import re
+
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from mergerequestsmonitor import github
+from mergerequestsmonitor.engine import Engine
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.providers import GithubProvider, GitlabAtomProvider, get_provider
+from mergerequestsmonitor.rules import Classifier
+from mergerequestsmonitor.scheduler import Scheduler
+from mergerequestsmonitor.session import Session
+from tests.conftest import ATOM_FEED
+
+
+def pull_request(number, repository="octo/app", title="Fix bug", draft=False):
+    """A pull request as GitHub's GraphQL API returns them for `github.build_query`"""
+    return {
+        "url": f"https://github.com/{repository}/pull/{number}",
+        "title": title,
+        "createdAt": "2024-05-01T10:00:00Z",
+        "updatedAt": "2024-05-02T10:00:00Z",
+        "isDraft": draft,
+        "author": {"login": "jane"},
+    }
+
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    """Stands in for GitHub's GraphQL API: answers queries for the pull requests of `server.repositories` in pages, as
+    GitHub does, and serves `ATOM_FEED` as a Gitlab feed
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.reply(200, ATOM_FEED, "application/atom+xml")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((request["variables"], self.headers.get("Authorization")))
+        if self.headers.get("Authorization") != "bearer t0ken":
+            body = {"message": "Bad credentials", "documentation_url": "https://docs.github.com/graphql"}
+            return self.reply(401, json.dumps(body).encode())
+
+        per_page = int(re.search(r"first: (\d+)", request["query"]).group(1))
+        variables, data, errors = request["variables"], {}, []
+        for alias in sorted({name[5:] for name in variables if name.startswith("owner")}, key=int):
+            repository = f"{variables['owner' + alias]}/{variables['name' + alias]}"
+            if repository not in self.server.repositories:
+                data[f"r{alias}"] = None
+                errors.append(
+                    {
+                        "type": "NOT_FOUND",
+                        "path": [f"r{alias}"],
+                        "locations": [{"line": 1, "column": 1}],
+                        "message": f"Could not resolve to a Repository with the name '{repository}'.",
+                    }
+                )
+                continue
+            start = int(variables["cursor" + alias] or 0)
+            nodes = self.server.repositories[repository][start : start + per_page]
+            has_next_page = start + per_page < len(self.server.repositories[repository])
+            data[f"r{alias}"] = {
+                "pullRequests": {
+                    "pageInfo": {"hasNextPage": has_next_page, "endCursor": str(start + per_page)},
+                    "nodes": nodes,
+                }
+            }
+        self.reply(200, json.dumps({"data": data, **({"errors": errors} if errors else {})}).encode())
+
+    def reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    return serve(GraphQLHandler, requests=[], repositories={})
+
+
+def pulls_url(server, repository, token="t0ken"):
+    return f"http://127.0.0.1:{server.server_port}/{repository}/pulls?access_token={token}"
+
+
+def test_urls_and_providers():
+    """Test pull requests pages are fetched by GitHub's provider, together when they share an endpoint and a token"""
+    url = "https://github.com/octo/app/pulls?access_token=abc"
+    assert github.parse_url(url) == ("https://api.github.com/graphql", "abc", "octo", "app")
+    assert github.batch_key("https://github.example.com/octo/app/pulls/?access_token=abc") == (
+        "https://github.example.com/api/graphql",
+        "abc",
+    )
+    assert github.batch_key(url) == github.batch_key("https://github.com/octo/lib/pulls?access_token=abc")
+    assert github.batch_key(url) != github.batch_key("https://github.com/octo/lib/pulls?access_token=def")
+
+    assert isinstance(get_provider(url), GithubProvider)
+    assert not github.is_pulls_url("https://github.com/octo/app/pull/1")
+    assert isinstance(get_provider("https://gitlab.com/group/project/-/merge_requests.atom"), GitlabAtomProvider)
+
+
+def test_fetch_asks_for_every_repository_with_one_query(server, session):
+    """Test the pull requests of every repository are fetched with a single request, and mapped to the records the
+    menu uses
+    """
+    server.repositories = {
+        "octo/app": [pull_request(2, title="Add feature", draft=True), pull_request(1)],
+        "octo/lib": [pull_request(7, "octo/lib")],
+        "octo/empty": [],
+    }
+    urls = [pulls_url(server, repository) for repository in server.repositories]
+
+    documents = github.fetch(session, urls)
+
+    assert [document.bozo for document in documents] == [False, False, False]
+    assert documents[0].merge_requests == [
+        MergeRequest(
+            id="https://github.com/octo/app/pull/2",
+            title="Add feature",
+            link="https://github.com/octo/app/pull/2",
+            author="jane",
+            project="octo/app",
+            updated=1714644000.0,
+            is_draft=True,
+            created=1714557600.0,
+        ),
+        MergeRequest(
+            id="https://github.com/octo/app/pull/1",
+            title="Fix bug",
+            link="https://github.com/octo/app/pull/1",
+            author="jane",
+            project="octo/app",
+            updated=1714644000.0,
+            is_draft=False,
+            created=1714557600.0,
+        ),
+    ]
+    assert [mr.project for mr in documents[1].merge_requests] == ["octo/lib"]
+    assert documents[2].merge_requests == []
+    assert len(server.requests) == 1
+    assert server.requests[0][1] == "bearer t0ken"
+
+    # repositories whose pull requests didn't change aren't parsed again
+    unchanged = github.fetch(session, urls, fingerprints=[document.fingerprint for document in documents])
+    assert [document.merge_requests for document in unchanged] == [[], [], []]
+    assert [document.fingerprint for document in unchanged] == [document.fingerprint for document in documents]
+    assert session.connections_opened == 1
+
+
+def test_fetch_follows_pages_of_repositories_with_more(server, session, monkeypatch):
+    """Test only the repositories with more pull requests are asked for their next pages, and large batches are
+    split
+    """
+    monkeypatch.setattr(github, "PER_PAGE", 2)
+    monkeypatch.setattr(github, "BATCH_SIZE", 2)
+    server.repositories = {
+        "octo/app": [pull_request(i) for i in range(5, 0, -1)],
+        "octo/lib": [pull_request(1, "octo/lib")],
+        "octo/docs": [pull_request(1, "octo/docs")],
+    }
+    urls = [pulls_url(server, repository) for repository in server.repositories]
+
+    documents = github.fetch(session, urls)
+
+    assert [len(document.merge_requests) for document in documents] == [5, 1, 1]
+    assert [mr.link.rsplit("/", 1)[1] for mr in documents[0].merge_requests] == ["5", "4", "3", "2", "1"]
+    names = [
+        sorted(value for name, value in variables.items() if name.startswith("name"))
+        for variables, _ in server.requests
+    ]
+    assert names == [["app", "lib"], ["app", "docs"], ["app"]]
+
+
+def test_fetch_errors(server, session):
+    """Test a repository which can't be read only fails its own document, and bad credentials fail all of them"""
+    server.repositories = {"octo/app": [pull_request(1)]}
+
+    documents = github.fetch(session, [pulls_url(server, "octo/app"), pulls_url(server, "octo/gone")])
+    assert not documents[0].bozo
+    assert len(documents[0].merge_requests) == 1
+    assert documents[1].bozo
+    assert documents[1].bozo_exception == "Could not resolve to a Repository with the name 'octo/gone'."
+
+    documents = github.fetch(session, [pulls_url(server, "octo/app", token="wrong")])
+    assert documents[0].bozo
+    assert documents[0].status == 401
+    assert documents[0].bozo_exception == "HTTP Error 401"
+
+    server.shutdown()
+    server.server_close()
+    with Session() as new_session:
+        documents = github.fetch(new_session, [pulls_url(server, "octo/app")])
+    assert documents[0].bozo
+    assert isinstance(documents[0].bozo_exception, OSError)
+
+
+def test_engine_merges_gitlab_and_github_merge_requests(server, tmp_path):
+    """Test the engine fetches Gitlab's feeds and GitHub's repositories side by side, the repositories with a single
+    request, into the same records
+    """
+    server.repositories = {"octo/app": [pull_request(1)], "octo/lib": [pull_request(2, "octo/lib", draft=True)]}
+    feed_url = f"http://127.0.0.1:{server.server_port}/group/project/-/merge_requests.atom"
+    feed_urls = [feed_url, pulls_url(server, "octo/app"), pulls_url(server, "octo/lib")]
+    engine = Engine(lambda name, mode="r": open(tmp_path / name, mode), Scheduler(max_interval=300))
+
+    merge_requests, changes = engine.fetch_merge_requests(feed_urls)
+
+    assert {(mr.project, mr.author, mr.is_draft) for mr in merge_requests} == {
+        ("group/project", "Jane Doe", True),
+        ("group/project", None, False),
+        ("octo/app", "jane", False),
+        ("octo/lib", "jane", True),
+    }
+    assert changes.added == merge_requests
+    assert len(server.requests) == 1
+    assert engine.fetch_stats["downloaded"] == 3
+
+    # nothing changed: no MR is built again
+    engine.fetch_merge_requests(feed_urls, previous=merge_requests)
+    assert engine.skipped["unchanged"] == 3
+    engine.close()
+
+
+def test_engine_fails_github_feeds_rules_cant_filter(server, tmp_path):
+    """Test `hide` rules only Gitlab can evaluate fail GitHub's repositories rather than showing what they'd hide"""
+    server.repositories = {"octo/app": [pull_request(1)]}
+    feed_url = f"http://127.0.0.1:{server.server_port}/group/project/-/merge_requests.atom"
+    feed_urls = [feed_url, pulls_url(server, "octo/app")]
+    engine = Engine(
+        lambda name, mode="r": open(tmp_path / name, mode),
+        Scheduler(max_interval=300),
+        rules=Classifier.from_config(hide="label:wip"),
+    )
+
+    merge_requests, _ = engine.fetch_merge_requests(feed_urls)
+
+    assert {mr.project for mr in merge_requests} == {"group/project"}
+    assert server.requests == []
+    assert [feed.url for feed in engine.get_failing_feeds()] == [pulls_url(server, "octo/app")]
+    assert "label:wip" in engine.feeds[pulls_url(server, "octo/app")].error
+    engine.close()
@@ -0,0 +1,148 @@
+import json
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from mergerequestsmonitor import gitlab
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.session import Session
+
+
+def api_merge_request(iid, title="Fix bug", project="group/project"):
+    return {
+        "iid": iid,
+        "title": title,
+        "web_url": f"https://gitlab.com/{project}/-/merge_requests/{iid}",
+        "created_at": "2024-05-01T10:00:00.000Z",
+        "updated_at": "2024-05-02T10:00:00.000Z",
+        "author": {"name": "Jane Doe", "username": "jane"},
+        "draft": title.startswith("Draft: "),
+    }
+
+
+class GitlabHandler(BaseHTTPRequestHandler):
+    """Stands in for Gitlab's API: serves `server.merge_requests` in pages, keeping connections alive"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("PRIVATE-TOKEN")))
+        url = urlsplit(self.path)
+        if url.path != "/api/v4/groups/group/merge_requests":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        params = parse_qs(url.query)
+        page, per_page = int(params.get("page", ["1"])[0]), int(params["per_page"][0])
+        merge_requests = self.server.merge_requests[(page - 1) * per_page : page * per_page]
+        body = json.dumps(merge_requests).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if page * per_page < len(self.server.merge_requests):
+            query = url.query.replace(f"&page={page}", "")
+            next_url = f"http://{self.headers['Host']}{url.path}?{query}&page={page + 1}"
+            self.send_header("Link", f'<{next_url}>; rel="next", <{next_url}>; rel="last"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    return serve(GitlabHandler, requests=[], merge_requests=[])
+
+
+def test_is_api_url():
+    """Test API endpoints are told apart from feeds"""
+    assert gitlab.is_api_url("https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me")
+    assert gitlab.is_api_url("https://gitlab.example.com/gitlab/api/v4/groups/12/merge_requests/")
+    assert not gitlab.is_api_url("https://gitlab.com/group/project/-/merge_requests.atom?feed_token=abc")
+    assert not gitlab.is_api_url("https://gitlab.com/api/v4/projects/12/merge_requests/1/notes")
+
+
+def test_prepare():
+    """Test default filters are added, filters in the URL are kept and tokens are moved to a header"""
+    url, headers = gitlab.prepare("https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me&private_token=abc")
+
+    assert parse_qs(urlsplit(url).query) == {
+        "state": ["opened"],
+        "per_page": ["100"],
+        "scope": ["assigned_to_me"],
+    }
+    assert headers["PRIVATE-TOKEN"] == "abc"
+
+    url, _ = gitlab.prepare("https://gitlab.com/api/v4/merge_requests?state=merged&wip=no")
+    assert parse_qs(urlsplit(url).query)["state"] == ["merged"]
+    assert parse_qs(urlsplit(url).query)["wip"] == ["no"]
+
+
+def test_fetch_follows_pages_over_one_connection(server, session, monkeypatch):
+    """Test every page is fetched, reusing the same connection, and mapped to the records the menu uses"""
+    monkeypatch.setattr(gitlab, "PER_PAGE", 2)
+    server.merge_requests = [api_merge_request(1), api_merge_request(2, "Draft: WIP"), api_merge_request(3)]
+    url = f"http://127.0.0.1:{server.server_port}/api/v4/groups/group/merge_requests?wip=no&private_token=abc"
+
+    document = gitlab.fetch(session, url)
+
+    assert not document.bozo
+    merge_requests = [MergeRequest.from_entry(entry) for entry in document.entries]
+    assert [mr.link for mr in merge_requests] == [
+        f"https://gitlab.com/group/project/-/merge_requests/{iid}" for iid in (1, 2, 3)
+    ]
+    assert merge_requests[0].id == merge_requests[0].link
+    assert merge_requests[0].author == "Jane Doe"
+    assert merge_requests[0].project == "group/project"
+    assert merge_requests[0].updated == 1714644000.0
+    assert merge_requests[0].created == 1714557600.0
+    assert merge_requests[1].is_draft
+
+    assert len(server.requests) == 2
+    assert all(token == "abc" for _, token in server.requests)
+    assert all("wip=no" in path and "private_token" not in path for path, _ in server.requests)
+    assert session.connections_opened == 1
+
+    gitlab.fetch(session, url)
+    assert session.connections_opened == 1
+
+
+def test_fetch_skips_parsing_unchanged_pages(server, session):
+    """Test pages are only parsed when their fingerprint changed"""
+    server.merge_requests = [api_merge_request(1), api_merge_request(2)]
+    url = f"http://127.0.0.1:{server.server_port}/api/v4/groups/group/merge_requests"
+
+    document = gitlab.fetch(session, url)
+    assert len(document.entries) == 2
+
+    unchanged = gitlab.fetch(session, url, fingerprint=document.fingerprint)
+    assert not unchanged.bozo
+    assert unchanged.fingerprint == document.fingerprint
+    assert unchanged.entries == []
+
+    server.merge_requests = [api_merge_request(1)]
+    changed = gitlab.fetch(session, url, fingerprint=document.fingerprint)
+    assert changed.fingerprint != document.fingerprint
+    assert len(changed.entries) == 1
+
+
+def test_fetch_errors(server, session):
+    """Test errors are flagged like feedparser does instead of being raised"""
+    document = gitlab.fetch(session, f"http://127.0.0.1:{server.server_port}/api/v4/projects/1/merge_requests")
+    assert document.bozo
+    assert document.status == 404
+
+    server.shutdown()
+    server.server_close()
+    with Session() as new_session:
+        document = gitlab.fetch(
+            new_session, f"http://127.0.0.1:{server.server_port}/api/v4/groups/group/merge_requests"
+        )
+    assert document.bozo
+    assert isinstance(document.bozo_exception, OSError)
@@ -0,0 +1,117 @@
+import os
+import time
+
+from mergerequestsmonitor import snapshot
+from mergerequestsmonitor.history import DAY, HistoryStore, format_age
+from mergerequestsmonitor.models import MergeRequest
+
+
+def merge_request(i, title=None, updated=None, project="group/project", created=None):
+    link = f"https://gitlab.com/{project}/-/merge_requests/{i}"
+    return MergeRequest(title=title or f"MR {i}", link=link, project=project, updated=updated, created=created)
+
+
+def test_record_upserts_changes(tmp_path, clock):
+    """Test snapshots are written in full once, then only their changes, and MRs showing up since the menu was looked
+    at are new
+    """
+    history = HistoryStore(str(tmp_path / "history.sqlite3"), clock=clock)
+    first = [merge_request(1, created=clock.now - 3 * DAY), merge_request(2, updated=clock.now - 3 * DAY)]
+    history.record(first)
+    assert len(history) == 2
+    # the MRs displayed before there was any history aren't new, but those whose feed tells are known to be open for
+    # that long, the others are only known to be seen since now
+    assert history.markers([mr.id for mr in first]) == {
+        first[0].id: (clock.now - 3 * DAY, True, False),
+        first[1].id: (clock.now, False, False),
+    }
+
+    clock.now += 60
+    second, changes = snapshot.merge([[merge_request(2, title="MR 2 again"), merge_request(3)]], first)
+    history.record(second, changes)
+    markers = history.markers(mr.id for mr in first + second)
+    assert markers[second[1].id] == (clock.now, False, True)
+    assert markers[second[0].id] == (clock.now - 60, False, False)
+    removed_at = history.connection.execute("SELECT id, removed_at FROM merge_requests WHERE removed_at IS NOT NULL")
+    assert list(removed_at) == [(first[0].id, clock.now)]
+
+    history.looked_at()
+    assert not any(new for *_, new in history.markers(mr.id for mr in second).values())
+    history.close()
+
+    # a store opened again writes the next snapshot in full, whatever its changes
+    history = HistoryStore(str(tmp_path / "history.sqlite3"), clock=clock)
+    history.record([merge_request(1)], snapshot.Changes([], [], []))
+    assert history.connection.execute("SELECT id FROM merge_requests WHERE removed_at IS NULL").fetchall() == [
+        (first[0].id,)
+    ]
+    assert history.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    assert [format_age(days * DAY) for days in (1, 13, 20, 400)] == ["1d", "13d", "2w", "1y"]
+
+
+def test_opening_dates_learned_later(tmp_path, clock):
+    """Test MRs seen before their opening date was known, or when ages were guessed from updates, get it once it's
+    known
+    """
+    path = str(tmp_path / "history.sqlite3")
+    history = HistoryStore(path, clock=clock)
+    history.record([merge_request(1)])
+    clock.now += DAY
+    # a webhook, or Gitlab's REST API, tells when it was opened
+    history.record([merge_request(1, created=clock.now - 10 * DAY)])
+    assert history.markers([merge_request(1).id]) == {merge_request(1).id: (clock.now - 10 * DAY, True, False)}
+    history.record([merge_request(1)])
+    assert history.markers([merge_request(1).id]) == {merge_request(1).id: (clock.now - 10 * DAY, True, False)}
+
+    # version 1 took ages from updates, like opening dates
+    history.connection.execute("UPDATE merge_requests SET opened_at = first_seen - ?", (2 * DAY,))
+    history.connection.execute("PRAGMA user_version = 1")
+    history.close()
+    history = HistoryStore(path, clock=clock)
+    assert history.markers([merge_request(1).id]) == {merge_request(1).id: (clock.now - DAY, False, False)}
+    history.close()
+
+
+def test_retention_and_compaction(tmp_path, clock):
+    """Test MRs removed for longer than the retention are deleted, and the space they took is given back"""
+    path = str(tmp_path / "history.sqlite3")
+    history = HistoryStore(path, retention=30 * DAY, clock=clock)
+    old = [merge_request(i, title=f"MR {i} " + "x" * 200) for i in range(10_000)]
+    history.record(old)
+    clock.now += 10 * DAY
+    history.record([merge_request(-1)], snapshot.Changes([merge_request(-1)], old, []))
+    history.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = os.path.getsize(path)
+
+    clock.now += 30 * DAY
+    assert history.expire() == 0
+    clock.now += 1
+    assert history.expire() == 10_000
+    assert len(history) == 1
+    assert os.path.getsize(path) < size / 4
+
+
+def test_stays_fast_with_tens_of_thousands_of_merge_requests(tmp_path, clock):
+    """Test refreshes and menus don't get slower as the history grows: they only go through indexes"""
+    history = HistoryStore(str(tmp_path / "history.sqlite3"), clock=clock)
+    history.record([merge_request(i, project=f"group/project{i % 100}") for i in range(50_000)])
+    displayed = [merge_request(i) for i in range(50_000, 50_500)]
+    history.record(displayed)
+
+    started = time.perf_counter()
+    for i in range(10):
+        clock.now += 60
+        added = merge_request(100_000 + i)
+        displayed, changes = snapshot.merge([displayed[1:], [added]], displayed)
+        history.record(displayed, changes)
+        markers = history.markers(mr.id for mr in displayed)
+    assert time.perf_counter() - started < 0.5
+    assert len(markers) == 500
+
+    for query in (
+        "SELECT opened_at FROM merge_requests WHERE id IN (?)",
+        "DELETE FROM merge_requests WHERE removed_at < ?",
+    ):
+        plan = " ".join(row[-1] for row in history.connection.execute(f"EXPLAIN QUERY PLAN {query}", (0,)))
+        assert plan.startswith("SEARCH") and "INDEX" in plan
@@ -1,16 +1,60 @@
-from unittest.mock import Mock, patch, mock_open
-
+import http.client
+import io
+import itertools
+import json
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from datetime import datetime
+from unittest.mock import ANY, Mock, patch, mock_open
+
+import feedparser
+import pytest
 import rumps
 
-from main import MergeRequestsMonitorApp
+from main import PROFILE_ENV, TICK_INTERVAL, MergeRequestsMonitorApp
+from mergerequestsmonitor import snapshot
+from mergerequestsmonitor.feeds import FeedState
+from mergerequestsmonitor.models import MergeRequest
+from tests.conftest import FakeResponse
+
+
+def page_url(page):
+    """The URL of a page answered by the `mock_stream` fixture"""
+    return page.decode().split()[0]
 
 
 class TestMergeRequestsMonitorApp:
     """Test suite for MergeRequestsMonitorApp"""
 
+    @pytest.fixture(autouse=True)
+    def app_support(self, tmp_path):
+        """Give every test its own application support folder, for config and cache files"""
+        with patch("rumps.rumps.application_support", return_value=str(tmp_path)):
+            yield tmp_path
+
+    @pytest.fixture(autouse=True)
+    def mock_stream(self):
+        """Answer every download with a page of its own instead of reaching the network, for `feedparser.parse` mocks:
+        pages identical to the last one aren't parsed again
+        """
+        pages = itertools.count()
+        with patch("mergerequestsmonitor.session.Session.stream") as mock_stream:
+            mock_stream.side_effect = lambda url, headers=None: FakeResponse(f"{url} {next(pages)}".encode(), url=url)
+            yield mock_stream
+
+    @pytest.fixture(autouse=True)
+    def call_after_inline(self):
+        """There's no run loop in tests, so run callbacks meant for the main thread right away"""
+        with patch("main.AppHelper.callAfter", side_effect=lambda func, *args: func(*args)):
+            yield
+
     def test_init(self):
         """Test app initialization with default config"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         assert app.name == "Merge Requests Monitor"
@@ -21,7 +65,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_init_with_existing_config(self):
         """Test app initialization with existing config file"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         # Config should be loaded with defaults or existing values
@@ -31,7 +75,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_get_refresh_interval(self):
         """Test refresh interval conversion from labels to seconds"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         assert app.get_refresh_interval("60s") == 60
@@ -40,11 +84,11 @@ class TestMergeRequestsMonitorApp:
         assert app.get_refresh_interval("30m") == 1800
         assert app.get_refresh_interval("1h") == 3600
         assert app.get_refresh_interval("3h") == 10800
-        assert app.get_refresh_interval("6h") == 43200
+        assert app.get_refresh_interval("6h") == 21600
 
     def test_update_title_no_merge_requests(self):
         """Test title shows 0 when no merge requests"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = []
 
@@ -54,7 +98,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_update_title_with_merge_requests(self):
         """Test title shows count of merge requests"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [Mock(), Mock(), Mock()]
 
@@ -62,12 +106,12 @@ class TestMergeRequestsMonitorApp:
 
         assert app.title == "3"
 
-    @patch("main.feedparser.parse")
+    @patch("feedparser.parse")
     def test_refresh_successful(self, mock_parse):
         """Test successful feed refresh"""
         # Mock feed entries
-        entry1 = Mock(title="Fix bug #123", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="Draft: New feature", link="https://gitlab.com/mr/2")
+        entry1 = Mock(id="https://gitlab.com/mr/1", title="Fix bug #123", link="https://gitlab.com/mr/1")
+        entry2 = Mock(id="https://gitlab.com/mr/2", title="Draft: New feature", link="https://gitlab.com/mr/2")
         mock_document = Mock(bozo=False, entries=[entry1, entry2])
         mock_parse.return_value = mock_document
 
@@ -75,19 +119,19 @@ class TestMergeRequestsMonitorApp:
         app.feed_urls = ["https://gitlab.com/feed1.atom"]
 
         # Trigger refresh
-        app.refresh(None)
+        app.refresh(None).join()
 
         assert len(app.merge_requests) == 2
         assert app.title == "2"
         assert app.last_updated != "Never"
 
-    @patch("main.feedparser.parse")
+    @patch("feedparser.parse")
     def test_refresh_with_multiple_feeds(self, mock_parse):
         """Test refresh with multiple feed URLs"""
         # Mock entries from different feeds
-        entry1 = Mock(title="MR from feed 1", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="MR from feed 2", link="https://gitlab.com/mr/2")
-        entry3 = Mock(title="MR from feed 2 again", link="https://gitlab.com/mr/3")
+        entry1 = Mock(id="https://gitlab.com/mr/1", title="MR from feed 1", link="https://gitlab.com/mr/1")
+        entry2 = Mock(id="https://gitlab.com/mr/2", title="MR from feed 2", link="https://gitlab.com/mr/2")
+        entry3 = Mock(id="https://gitlab.com/mr/3", title="MR from feed 2 again", link="https://gitlab.com/mr/3")
 
         mock_doc1 = Mock(bozo=False, entries=[entry1])
         mock_doc2 = Mock(bozo=False, entries=[entry2, entry3])
@@ -96,12 +140,418 @@ class TestMergeRequestsMonitorApp:
         app = MergeRequestsMonitorApp()
         app.feed_urls = ["https://gitlab.com/feed1.atom", "https://gitlab.com/feed2.atom"]
 
-        app.refresh(None)
+        app.refresh(None).join()
 
         assert len(app.merge_requests) == 3
         assert mock_parse.call_count == 2
 
-    @patch("main.feedparser.parse")
+    @patch("feedparser.parse")
+    def test_refresh_fetches_feeds_concurrently_in_order(self, mock_parse):
+        """Test feeds are fetched in parallel but merged in configuration order"""
+
+        def parse(page, **kwargs):
+            url = page_url(page)
+            time.sleep(0.3 if "slow" in url else 0)
+            return Mock(bozo=False, entries=[Mock(id=url, title=url, link=url)])
+
+        mock_parse.side_effect = parse
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = [f"https://gitlab.com/{speed}{i}.atom" for i in range(3) for speed in ("slow", "fast")]
+
+        started = time.monotonic()
+        app.refresh(None).join()
+        elapsed = time.monotonic() - started
+
+        assert [mr.title for mr in app.merge_requests] == app.feed_urls
+        # close to the slowest feed rather than the sum of all of them
+        assert elapsed < 0.6
+
+    @patch("feedparser.parse")
+    def test_fetch_feeds_respects_concurrency_limit(self, mock_parse):
+        """Test no more than `fetch_concurrency` feeds are downloaded at the same time"""
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def parse(page, **kwargs):
+            with lock:
+                running.append(page_url(page))
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(page_url(page))
+            return Mock(bozo=False, entries=[])
+
+        mock_parse.side_effect = parse
+
+        app = MergeRequestsMonitorApp()
+        app.engine.fetch_concurrency = 2
+
+        app.engine.fetch_feeds([f"https://gitlab.com/feed{i}.atom" for i in range(6)])
+
+        assert max(peak) == 2
+
+    @patch("feedparser.parse")
+    def test_refresh_keeps_previous_snapshot_until_done(self, mock_parse):
+        """Test MRs are swapped in one go once the background refresh finishes"""
+        release = threading.Event()
+        entry = Mock(id="https://gitlab.com/mr/2", title="New MR", link="https://gitlab.com/mr/2")
+
+        def parse(page, **kwargs):
+            release.wait(1)
+            return Mock(bozo=False, entries=[entry])
+
+        mock_parse.side_effect = parse
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        previous = [Mock(id="https://gitlab.com/mr/1", title="Old MR", link="https://gitlab.com/mr/1")]
+        app.merge_requests = previous
+
+        thread = app.refresh(None)
+        assert app.merge_requests is previous
+
+        release.set()
+        thread.join()
+
+        assert [mr.title for mr in app.merge_requests] == ["New MR"]
+
+    @patch("feedparser.parse")
+    def test_refresh_coalesces_requests_while_running(self, mock_parse):
+        """Test a refresh requested while another one runs is queued once instead of running in parallel"""
+        release = threading.Event()
+
+        def parse(page, **kwargs):
+            release.wait(1)
+            return Mock(bozo=False, entries=[])
+
+        mock_parse.side_effect = parse
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+
+        thread = app.refresh(None)
+        assert app.refresh(None) is None
+        assert app.refresh(None) is None
+        assert app.refresh_pending
+
+        release.set()
+        thread.join()
+        rerun = app.refresh_thread
+        if rerun is not None:
+            rerun.join()
+
+        assert mock_parse.call_count == 2
+        assert app.refresh_thread is None
+        assert not app.refresh_pending
+
+    @patch("feedparser.parse")
+    def test_refresh_reuses_cached_entries_when_not_modified(self, mock_parse, mock_stream):
+        """Test validators are sent back and a 304 answer reuses the entries from the previous download"""
+        entry = feedparser.FeedParserDict(id="1", title="Fix bug", link="https://gitlab.com/mr/1", updated="")
+        mock_parse.return_value = feedparser.FeedParserDict(bozo=False, entries=[entry])
+        mock_stream.side_effect = [FakeResponse(headers={"ETag": '"abc"'}), FakeResponse(status=304)]
+
+        app = MergeRequestsMonitorApp()
+        app.engine.feed_parser = "feedparser"
+        app.feed_urls = ["https://gitlab.com/cached.atom"]
+
+        app.refresh(None).join()
+        app.refresh(None).join()
+
+        mock_stream.assert_called_with("https://gitlab.com/cached.atom", headers={"If-None-Match": '"abc"'})
+        assert mock_parse.call_count == 1
+        assert [mr.title for mr in app.merge_requests] == ["Fix bug"]
+        assert app.engine.fetch_stats == {"downloaded": 1, "not_modified": 1}
+
+    def test_load_feeds(self):
+        """Test the validators and MRs saved for every feed are read back from disk"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+
+        data = (
+            '{"https://gitlab.com/feed.atom": {"etag": "\\"abc\\"", "modified": null, "fetched_at": 1.0, '
+            '"merge_requests": [["1", "MR", "https://gitlab.com/mr/1", null, null, null, false]]}}'
+        )
+        with patch.object(app.engine, "open_file", mock_open(read_data=data)):
+            feeds = app.engine.load_feeds()
+
+        assert feeds["https://gitlab.com/feed.atom"].validators == ('"abc"', None)
+        assert feeds["https://gitlab.com/feed.atom"].merge_requests == [
+            MergeRequest(id="1", title="MR", link="https://gitlab.com/mr/1")
+        ]
+
+    @patch("feedparser.parse")
+    def test_refresh_keeps_failing_feed_merge_requests(self, mock_parse):
+        """Test a failing feed keeps its last known MRs while the others are updated"""
+        documents = {
+            "https://gitlab.com/healthy.atom": [
+                Mock(bozo=False, entries=[Mock(id="1", title="MR 1", link="https://gitlab.com/mr/1")]),
+                Mock(bozo=False, entries=[Mock(id="2", title="MR 2", link="https://gitlab.com/mr/2")]),
+            ],
+            "https://gitlab.com/flaky.atom": [
+                Mock(bozo=False, entries=[Mock(id="3", title="MR 3", link="https://gitlab.com/mr/3")]),
+                feedparser.FeedParserDict(bozo=True, bozo_exception=OSError("Connection reset by peer")),
+            ],
+        }
+        mock_parse.side_effect = lambda page, **kwargs: documents[page_url(page)].pop(0)
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/healthy.atom", "https://gitlab.com/flaky.atom"]
+
+        app.refresh(None).join()
+        app.refresh(None).join()
+
+        assert [mr.title for mr in app.merge_requests] == ["MR 2", "MR 3"]
+        assert app.title == "2 ⚠️"
+        assert app.engine.feeds["https://gitlab.com/flaky.atom"].error == "Connection reset by peer"
+        assert "feed_errors" in app.menu
+
+    @patch("feedparser.parse")
+    def test_refresh_retries_failing_feeds_with_backoff(self, mock_parse):
+        """Test failing feeds are only fetched again once their retry time has come"""
+        mock_parse.return_value = feedparser.FeedParserDict(bozo=True, bozo_exception=OSError("Connection refused"))
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/down.atom"]
+
+        app.tick(None).join()
+        assert app.tick(None) is None
+        assert mock_parse.call_count == 1
+
+        app.engine.feeds["https://gitlab.com/down.atom"].next_due = time.time() - 1
+        mock_parse.return_value = Mock(bozo=False, entries=[])
+        app.tick(None).join()
+
+        assert mock_parse.call_count == 2
+        assert not app.engine.feeds["https://gitlab.com/down.atom"].failing
+        assert app.title == "0"
+
+    @patch("feedparser.parse")
+    def test_tick_only_fetches_due_feeds(self, mock_parse, mock_stream):
+        """Test timer ticks fetch the feeds the scheduler says are due, and nothing else"""
+        clock = Mock(return_value=1000.0)
+        mock_parse.return_value = Mock(bozo=False, entries=[])
+
+        app = MergeRequestsMonitorApp()
+        app.engine.scheduler.clock = clock
+        app.engine.scheduler.random = Mock(return_value=0)
+        app.feed_urls = ["https://gitlab.com/busy.atom", "https://gitlab.com/dormant.atom"]
+
+        app.tick(None).join()
+        assert mock_parse.call_count == 2
+        assert app.tick(None) is None
+
+        app.engine.feeds["https://gitlab.com/dormant.atom"].next_due = 2000.0
+        clock.return_value = 1000.0 + app.engine.scheduler.min_interval
+        app.tick(None).join()
+
+        assert mock_parse.call_count == 3
+        assert mock_stream.call_args[0][0] == "https://gitlab.com/busy.atom"
+        # the busy feed didn't change, so it backs off
+        assert app.engine.feeds["https://gitlab.com/busy.atom"].interval == app.engine.scheduler.min_interval * 2
+
+    def test_set_refresh_interval_brings_feeds_forward(self):
+        """Test lowering the refresh interval reschedules feeds due later than it allows"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.engine.scheduler.clock = Mock(return_value=1000.0)
+        app.engine.feeds = {"https://gitlab.com/feed.atom": FeedState("https://gitlab.com/feed.atom", interval=3600)}
+        app.engine.feeds["https://gitlab.com/feed.atom"].next_due = 4600.0
+
+        sender = Mock(title="5m", state=0)
+        app.set_refresh_interval(sender)
+
+        assert app.engine.feeds["https://gitlab.com/feed.atom"].interval == 300
+        assert app.engine.feeds["https://gitlab.com/feed.atom"].next_due == 1300.0
+
+    @patch("feedparser.parse")
+    def test_refresh_dedupes_overlapping_feeds(self, mock_parse):
+        """Test MRs listed by several feeds are only displayed and counted once"""
+        old = Mock(id="1", title="Fix bug", link="https://gitlab.com/mr/1", updated="2024-05-01T10:00:00Z")
+        new = Mock(id="1", title="Fix bugs", link="https://gitlab.com/mr/1", updated="2024-05-02T10:00:00Z")
+        other = Mock(id="2", title="Add feature", link="https://gitlab.com/mr/2", updated="2024-05-01T10:00:00Z")
+        documents = {
+            "https://gitlab.com/group.atom": Mock(bozo=False, entries=[old, other]),
+            "https://gitlab.com/assigned.atom": Mock(bozo=False, entries=[new]),
+        }
+        mock_parse.side_effect = lambda page, **kwargs: documents[page_url(page)]
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = list(documents)
+        app.refresh(None).join()
+
+        assert [mr.title for mr in app.merge_requests] == ["Fix bugs", "Add feature"]
+        assert app.title == "2"
+
+    @patch("feedparser.parse")
+    def test_refresh_without_changes_skips_menu(self, mock_parse):
+        """Test refreshes which didn't change any MR don't rebuild the menu rows"""
+        entry = Mock(id="1", title="Fix bug", link="https://gitlab.com/mr/1", updated=None)
+        mock_parse.return_value = Mock(bozo=False, entries=[entry])
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        app.refresh(None).join()
+
+        with patch.object(app, "get_menu_rows", wraps=app.get_menu_rows) as mock_rows:
+            app.refresh(None).join()
+
+        mock_rows.assert_not_called()
+        assert app.last_updated_item.title == f"Last updated: {app.last_updated}"
+
+    def test_refresh_skips_identical_feeds(self, mock_stream):
+        """Test feeds downloaded identical to their last version aren't turned into MRs, merged or displayed again"""
+        body = b'<feed xmlns="http://www.w3.org/2005/Atom"><entry><id>1</id><title>Fix bug</title></entry></feed>'
+        mock_stream.side_effect = lambda url, headers=None: FakeResponse(
+            body, headers={"ETag": f'"{time.monotonic()}"'}
+        )
+
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.engine.feed_parser = "streaming"
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        app.refresh(None).join()
+        merge_requests = app.merge_requests
+        skipped_menus, skipped_titles = app.skipped["menu"], app.skipped["title"]
+        etag = app.engine.feeds["https://gitlab.com/feed.atom"].etag
+
+        with patch("mergerequestsmonitor.models.MergeRequest.from_entry") as mock_from_entry:
+            app.refresh(None).join()
+            app.refresh(None).join()
+
+        # feeds are parsed as they're downloaded, before it's known whether they changed
+        mock_from_entry.assert_not_called()
+        assert app.merge_requests is merge_requests
+        assert app.engine.skipped == {"unchanged": 2, "merge": 2}
+        assert app.skipped["menu"] == skipped_menus + 2
+        assert app.skipped["title"] == skipped_titles + 2
+        # the new validators are kept all the same
+        assert app.engine.feeds["https://gitlab.com/feed.atom"].etag != etag
+        assert any(
+            item.title.startswith("Skipped: 2 unchanged feeds, 2 merges") for item in app.diagnostics_menu.values()
+        )
+
+    def test_refresh_skips_parsing_identical_feeds(self, mock_stream):
+        """Test feeds downloaded identical to their last version aren't even parsed by feedparser"""
+        body = b'<feed xmlns="http://www.w3.org/2005/Atom"><entry><id>1</id><title>Fix bug</title></entry></feed>'
+        mock_stream.side_effect = lambda url, headers=None: FakeResponse(body)
+
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.engine.feed_parser = "feedparser"
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        with patch("feedparser.parse", wraps=feedparser.parse) as mock_parse:
+            for _ in range(3):
+                app.refresh(None).join()
+
+        assert mock_parse.call_count == 1
+        assert app.engine.skipped["unchanged"] == 2
+        assert [mr.title for mr in app.merge_requests] == ["Fix bug"]
+
+    @patch("mergerequestsmonitor.gitlab.fetch")
+    @patch("feedparser.parse")
+    def test_fetch_feed_from_gitlab_api(self, mock_parse, mock_fetch):
+        """Test URLs of Gitlab's API are fetched through the app's session instead of being parsed as feeds"""
+        entry = Mock(id="https://gitlab.com/mr/1", title="MR 1", link="https://gitlab.com/mr/1", updated=None)
+        mock_fetch.return_value = Mock(bozo=False, status=200, etag=None, modified=None, entries=[entry])
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me"]
+        app.refresh(None).join()
+
+        mock_fetch.assert_called_once_with(
+            app.engine.session, "https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me", ANY, None
+        )
+        mock_parse.assert_not_called()
+        assert [mr.title for mr in app.merge_requests] == ["MR 1"]
+
+    @patch("feedparser.parse")
+    def test_fetch_feed_with_streaming_parser(self, mock_parse, mock_stream):
+        """Test the streaming parser handles Atom feeds and leaves anything else to feedparser"""
+        pages = {
+            "https://gitlab.com/feed.atom": (
+                b'<feed xmlns="http://www.w3.org/2005/Atom"><entry><id>1</id><title>Fix bug</title></entry></feed>'
+            ),
+            "https://gitlab.com/sign_in": b"<html><body>Sign in</body></html>",
+        }
+        mock_stream.side_effect = lambda url, headers=None: FakeResponse(pages[url], headers={"ETag": '"abc"'}, url=url)
+        mock_parse.return_value = Mock(bozo=True)
+
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.engine.feed_parser = "streaming"
+        app.feed_cache = {}
+
+        document = app.engine.fetch_feed("https://gitlab.com/feed.atom")
+        assert [entry.title for entry in document.entries] == ["Fix bug"]
+        assert document.etag == '"abc"'
+        mock_parse.assert_not_called()
+
+        app.engine.fetch_feed("https://gitlab.com/sign_in")
+        mock_parse.assert_called_once()
+        assert mock_parse.call_args[0][0] == pages["https://gitlab.com/sign_in"]
+
+    def test_refresh_records_timings(self, mock_stream):
+        """Test every refresh records the timings of each feed and of the menu, and shows them in Diagnostics"""
+        body = b'<feed xmlns="http://www.w3.org/2005/Atom"><entry><id>1</id><title>Fix bug</title></entry></feed>'
+
+        def stream(url, headers=None):
+            if "down" in url:
+                raise OSError("Connection refused")
+            return FakeResponse(body, url=url)
+
+        mock_stream.side_effect = stream
+
+        app = MergeRequestsMonitorApp()
+        app.engine.feed_parser = "streaming"
+        app.feed_urls = [
+            "https://gitlab.com/group/project/-/merge_requests.atom?feed_token=secret",
+            "https://gitlab.com/group/down/-/merge_requests.atom",
+        ]
+        app.refresh(None).join()
+
+        timing = app.diagnostics.latest
+        assert timing.seconds > 0
+        assert timing.build_menu_seconds is not None
+        healthy, failing = timing.feeds
+        assert healthy.url == "https://gitlab.com/group/project/-/merge_requests.atom"
+        assert (healthy.status, healthy.bytes, healthy.entries, healthy.error) == (200, len(body), 1, None)
+        assert healthy.parse_seconds is not None
+        assert failing.error == "Connection refused"
+
+        titles = [item.title for item in app.diagnostics_menu.values()]
+        assert titles[0] == f"Last refresh: {timing.summary()}"
+        assert f"group/project: {healthy.summary()}" in titles
+        assert "group/down: failed after" in titles[-1]
+
+    def test_refresh_logs_timings(self, tmp_path):
+        """Test timings are appended to the diagnostics log as JSON lines"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+            app.diagnostics.log_path = str(tmp_path / "refreshes.jsonl")
+            app.feed_urls = ["https://gitlab.com/feed.atom"]
+            app.refresh(None).join()
+            app.refresh(None).join()
+
+        lines = (tmp_path / "refreshes.jsonl").read_text().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[0])["feeds"][0]["url"] == "https://gitlab.com/feed.atom"
+
+    @patch("feedparser.parse")
+    def test_refresh_profiling(self, mock_parse, tmp_path, monkeypatch):
+        """Test refreshes are profiled when the profiling environment variable is set"""
+        monkeypatch.setenv(PROFILE_ENV, str(tmp_path / "profiles"))
+        mock_parse.return_value = Mock(bozo=False, entries=[])
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        app.refresh(None).join()
+
+        assert sorted(path.suffix for path in (tmp_path / "profiles").iterdir()) == [".prof", ".txt"]
+
+    @patch("feedparser.parse")
     def test_refresh_with_parsing_error(self, mock_parse):
         """Test refresh handles feed parsing errors"""
         # Mock parsing error
@@ -111,11 +561,11 @@ class TestMergeRequestsMonitorApp:
         app = MergeRequestsMonitorApp()
         app.feed_urls = ["https://gitlab.com/invalid.atom"]
 
-        app.refresh(None)
+        app.refresh(None).join()
 
-        assert app.title == "⚠️"
+        assert app.title == "0 ⚠️"
 
-    @patch("main.feedparser.parse")
+    @patch("feedparser.parse")
     def test_refresh_updates_timestamp(self, mock_parse):
         """Test refresh updates last_updated timestamp"""
         mock_document = Mock(bozo=False, entries=[])
@@ -129,14 +579,133 @@ class TestMergeRequestsMonitorApp:
             mock_now.strftime.return_value = "14:30"
             mock_datetime.now.return_value = mock_now
 
-            app.refresh(None)
+            app.refresh(None).join()
 
             assert app.last_updated == "14:30"
             mock_now.strftime.assert_called_once_with("%H:%M")
 
+    @patch("feedparser.parse")
+    def test_refresh_saves_snapshot(self, mock_parse):
+        """Test a successful refresh is saved for the next startup"""
+        entry = Mock(id="https://gitlab.com/mr/1", title="Fix bug", link="https://gitlab.com/mr/1")
+        mock_parse.return_value = Mock(bozo=False, entries=[entry])
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/feed.atom"]
+        app.refresh(None).join()
+
+        with app.open("snapshot.json") as f:
+            merge_requests, fetched_at = snapshot.load(f)
+
+        assert merge_requests == app.merge_requests
+        assert fetched_at == pytest.approx(time.time(), abs=5)
+
+    def test_concurrent_snapshot_saves(self, app_support):
+        """Test refreshes and webhooks saving snapshots at the same time leave a whole one, never a mix of both"""
+        dump = snapshot.dump
+
+        def slow_dump(merge_requests, fetched_at, f):
+            text = io.StringIO()
+            dump(merge_requests, fetched_at, text)
+            half = len(text.getvalue()) // 2
+            f.write(text.getvalue()[:half])
+            f.flush()
+            time.sleep(0.05)
+            f.write(text.getvalue()[half:])
+
+        app = MergeRequestsMonitorApp()
+        saved = [
+            [MergeRequest(id=f"{project}/{i}", title=f"MR {i}", link="", project=project) for i in range(20)]
+            for project in ("group/refreshed", "group/hooked")
+        ]
+        with patch("mergerequestsmonitor.snapshot.dump", side_effect=slow_dump):
+            threads = [threading.Thread(target=app.save_snapshot, args=(merge_requests, 0)) for merge_requests in saved]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        with open(app_support / "snapshot.json") as f:
+            assert snapshot.load(f)[0] in saved
+        assert not (app_support / "snapshot.json.tmp").exists()
+
+    @patch("feedparser.parse")
+    def test_startup_from_snapshot(self, mock_parse, app_support):
+        """Test the last snapshot is displayed right away at startup, without waiting for the network"""
+        merge_requests = [
+            MergeRequest(
+                id=str(i),
+                title=f"MR {i}",
+                link=f"https://gitlab.com/group/project/-/merge_requests/{i}",
+                project="group/project",
+            )
+            for i in range(2000)
+        ]
+        with open(app_support / "snapshot.json", "w") as f:
+            snapshot.dump(merge_requests, datetime(2024, 5, 2, 14, 30).timestamp(), f)
+
+        started = time.perf_counter()
+        app = MergeRequestsMonitorApp()
+        startup_time = time.perf_counter() - started
+
+        mock_parse.assert_not_called()
+        assert app.title == "2000"
+        assert app.last_updated == "14:30 (cached)"
+        assert app.menu["project:group/project"].title == "group/project (2000)"
+        assert startup_time < 1.0, f"startup took {startup_time:.3f}s"
+
+        app.populate_group("project:group/project")
+        assert app.menu["project:group/project"]["1999"].title == "MR 1999"
+
+    def test_startup_defers_work_to_run_loop(self, app_support):
+        """Test only the title is set before the run loop starts, the menu and the timer come right after"""
+        merge_requests = [MergeRequest(title="MR 1", link="https://gitlab.com/group/project/-/merge_requests/1")]
+        with open(app_support / "snapshot.json", "w") as f:
+            snapshot.dump(merge_requests, datetime(2024, 5, 2, 14, 30).timestamp(), f)
+
+        deferred = []
+        with patch("main.AppHelper.callAfter", side_effect=lambda func, *args: deferred.append((func, args))):
+            with patch("main.rumps.Timer") as mock_timer:
+                app = MergeRequestsMonitorApp()
+
+                assert app.title == "1"
+                assert "https://gitlab.com/group/project/-/merge_requests/1" not in app.menu
+                mock_timer.assert_not_called()
+                assert app.engine._feeds is None
+
+                for func, args in deferred:
+                    func(*args)
+
+        assert app.menu["https://gitlab.com/group/project/-/merge_requests/1"].title == "MR 1"
+        mock_timer.return_value.start.assert_called_once()
+
+    def test_startup_defers_heavy_imports(self):
+        """Test parsers and network modules are only imported by the first refresh, not with the app"""
+        script = (
+            "import sys, rumps, PyObjCTools.AppHelper\n"
+            "before = set(sys.modules)\n"
+            "import main\n"
+            "print(' '.join(sorted(set(sys.modules) - before)))\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        imported = set(result.stdout.split())
+
+        assert "main" in imported
+        assert not imported & {"feedparser", "urllib.request", "http.client", "concurrent.futures", "cProfile"}
+
+    def test_startup_ignores_invalid_snapshot(self, app_support):
+        """Test an unreadable snapshot is ignored"""
+        (app_support / "snapshot.json").write_text('{"version": 0}')
+
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+
+        assert app.title == "0"
+        assert app.last_updated == "Never"
+
     def test_build_menu_no_merge_requests(self):
         """Test menu building with no merge requests"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = []
 
@@ -148,9 +717,9 @@ class TestMergeRequestsMonitorApp:
 
     def test_build_menu_with_merge_requests(self):
         """Test menu building with merge requests"""
-        entry1 = Mock(title="Fix authentication bug", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="Add new API endpoint", link="https://gitlab.com/mr/2")
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        entry1 = MergeRequest(title="Fix authentication bug", link="https://gitlab.com/mr/1")
+        entry2 = MergeRequest(title="Add new API endpoint", link="https://gitlab.com/mr/2")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [entry1, entry2]
 
@@ -162,10 +731,10 @@ class TestMergeRequestsMonitorApp:
 
     def test_build_menu_separates_draft_merge_requests(self):
         """Test menu separates draft MRs from regular MRs"""
-        entry1 = Mock(title="Fix bug", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="Draft: New feature", link="https://gitlab.com/mr/2")
-        entry3 = Mock(title="Draft: Experimental change", link="https://gitlab.com/mr/3")
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        entry1 = MergeRequest(title="Fix bug", link="https://gitlab.com/mr/1")
+        entry2 = MergeRequest(title="Draft: New feature", link="https://gitlab.com/mr/2")
+        entry3 = MergeRequest(title="Draft: Experimental change", link="https://gitlab.com/mr/3")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [entry1, entry2, entry3]
 
@@ -179,8 +748,8 @@ class TestMergeRequestsMonitorApp:
 
     def test_build_menu_with_html_entities(self):
         """Test menu correctly unescapes HTML entities in MR titles"""
-        entry = Mock(title="Fix &quot;bug&quot; &amp; improve", link="https://gitlab.com/mr/1")
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        entry = MergeRequest.from_entry(Mock(title="Fix &quot;bug&quot; &amp; improve", link="https://gitlab.com/mr/1"))
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [entry]
 
@@ -189,9 +758,295 @@ class TestMergeRequestsMonitorApp:
         menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
         assert 'Fix "bug" & improve' in menu_titles
 
+    def test_build_menu_only_updates_changed_rows(self):
+        """Test menu items are reused between refreshes and only new, removed or retitled MRs are touched"""
+        entry1 = MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1")
+        entry2 = MergeRequest(id="2", title="Add feature", link="https://gitlab.com/mr/2")
+        entry3 = MergeRequest(id="3", title="Improve docs", link="https://gitlab.com/mr/3")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        preferences = app.menu["Preferences"]
+
+        app.merge_requests = [entry1, entry2]
+        app.build_menu()
+        item1, item2 = app.menu["1"], app.menu["2"]
+
+        app.merge_requests = [entry1, MergeRequest(id="2", title="Add & test feature", link=entry2.link), entry3]
+        app.build_menu()
+
+        assert app.menu["1"] is item1
+        assert app.menu["2"] is item2
+        assert item2.title == "Add & test feature"
+        assert app.menu["Preferences"] is preferences
+
+        app.merge_requests = [entry2, entry3]
+        app.build_menu()
+
+        assert "1" not in app.menu
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[-5:] == ["Add feature", "Improve docs", "Preferences", "About", "Quit"]
+
+    def test_build_menu_skips_unchanged_snapshot(self):
+        """Test rebuilding the menu with the same MRs creates no menu items"""
+        entries = [MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1")]
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.merge_requests = entries
+        app.build_menu()
+
+        app.last_updated = "14:30"
+        with patch("main.rumps.MenuItem") as mock_menu_item:
+            app.build_menu()
+
+        mock_menu_item.assert_not_called()
+        assert app.last_updated_item.title == "Last updated: 14:30"
+
+    def test_build_menu_groups_merge_requests_by_project(self):
+        """Test menus with more MRs than `menu_max_items` list their projects instead, with their number of MRs"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.menu_max_items = 3
+        app.merge_requests = [
+            MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1", project="b/api"),
+            MergeRequest(id="2", title="Draft: New feature", link="https://gitlab.com/mr/2", project="b/api"),
+            MergeRequest(id="3", title="Fix typo", link="https://gitlab.com/mr/3", project="a/docs"),
+            MergeRequest(id="4", title="Bump", link="https://example.com/4"),
+        ]
+
+        app.build_menu()
+
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[3:6] == ["(no project) (1)", "a/docs (1)", "b/api (2)"]
+        assert "Fix bug" not in menu_titles
+        assert [item.title for item in app.menu["project:b/api"].values()] == ["Loading…"]
+
+    @patch("main.webbrowser.open_new_tab")
+    def test_populate_group(self, mock_browser):
+        """Test a project's submenu is only filled when opened, and only filled again once its MRs changed"""
+        fix_bug = MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1", project="b/api")
+        new_feature = MergeRequest(id="2", title="Draft: New feature", link="https://gitlab.com/mr/2", project="b/api")
+        fix_typo = MergeRequest(id="3", title="Fix typo", link="https://gitlab.com/mr/3", project="a/docs")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.menu_max_items = 1
+        app.merge_requests = [fix_bug, new_feature]
+        app.build_menu()
+
+        app.populate_group("project:b/api")
+
+        submenu = app.menu["project:b/api"]
+        submenu_titles = [item.title for item in submenu.values() if hasattr(item, "title")]
+        assert submenu_titles == ["Merge Requests", "Fix bug", "Draft Merge Requests", "Draft: New feature"]
+        app.open_url(submenu["2"])
+        mock_browser.assert_called_once_with("https://gitlab.com/mr/2")
+
+        # another project's MRs don't touch this submenu
+        app.menu_max_items = 2
+        app.merge_requests = [fix_bug, new_feature, fix_typo]
+        app.build_menu()
+        with patch("main.rumps.MenuItem") as mock_menu_item:
+            app.populate_group("project:b/api")
+        mock_menu_item.assert_not_called()
+
+        add_api = MergeRequest(id="4", title="Add API", link="https://gitlab.com/mr/4", project="b/api")
+        app.merge_requests = [fix_bug, fix_typo, add_api]
+        app.build_menu()
+        app.populate_group("project:b/api")
+
+        assert app.menu["project:b/api"].title == "b/api (2)"
+        assert [item.title for item in app.menu["project:b/api"].values()] == ["Merge Requests", "Fix bug", "Add API"]
+
+    def test_project_groups_are_capped(self):
+        """Test the projects which don't fit in `menu_max_items` share an "Other projects" submenu"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.menu_max_items = 2
+        app.merge_requests = [
+            MergeRequest(id=str(i), title=f"MR {i}", link=f"https://gitlab.com/mr/{i}", project=f"group/p{i % 3}")
+            for i in range(6)
+        ]
+
+        app.build_menu()
+        app.populate_group("project:*")
+
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[3:5] == ["group/p0 (2)", "Other projects (4)"]
+        submenu_titles = [item.title for item in app.menu["project:*"].values()]
+        assert submenu_titles == ["group/p1", "MR 1", "MR 4", "group/p2", "MR 2", "MR 5"]
+
+    def test_rules_hide_and_section_merge_requests(self, app_support, mock_stream):
+        """Test the `hide` and `sections` rules of the config decide what the menu shows, and filter feeds at source"""
+        feed_url = "https://gitlab.com/group/api/-/merge_requests.atom?feed_token=secret"
+        (app_support / "config.ini").write_text(
+            f"[Gitlab]\nfeeds = {feed_url}\nrefresh_interval = 5m\n"
+            "hide = author:*bot*\n\tlabel:wip\nsections = Mine: author:jane*\n\tOthers:\n"
+        )
+        entries = [
+            Mock(id="1", title="Fix bug", link="https://gitlab.com/mr/1", author="Jane Doe"),
+            Mock(id="2", title="Bump deps", link="https://gitlab.com/mr/2", author="Renovate Bot"),
+            Mock(id="3", title="Draft: Add feature", link="https://gitlab.com/mr/3", author="John Roe"),
+        ]
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=entries)):
+            app = MergeRequestsMonitorApp()
+            app.refresh(None).join()
+
+        assert mock_stream.call_args.args[0] == f"{feed_url}&not%5Blabel_name%5D%5B%5D=wip"
+        assert len(app.merge_requests) == 3
+        assert app.title == "2"
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[3:7] == ["Mine", "Fix bug", "Others", "Draft: Add feature"]
+
+        app.save_config()
+        assert "sections = Mine: author:jane*\n\tOthers:" in (app_support / "config.ini").read_text()
+
+    def test_sections_named_like_menu_items(self, app_support):
+        """Test sections titled like the app's own items, "Preferences" or "Quit", don't replace them"""
+        (app_support / "config.ini").write_text(
+            "[Gitlab]\nfeeds = https://gitlab.com/feed.atom\nrefresh_interval = 5m\n"
+            "sections = Preferences: draft\n\tQuit:\n"
+        )
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        preferences, quit = app.menu["Preferences"], app.menu["Quit"]
+        app.merge_requests = [
+            MergeRequest(id="1", title="MR 1", link="https://gitlab.com/mr/1"),
+            MergeRequest(id="2", title="Draft: MR 2", link="https://gitlab.com/mr/2", is_draft=True),
+        ]
+
+        app.build_menu()
+
+        assert app.menu["Preferences"] is preferences
+        assert app.menu["Quit"] is quit
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[3:7] == ["Preferences", "Draft: MR 2", "Quit", "MR 1"]
+        assert menu_titles[-3:] == ["Preferences", "About", "Quit"]
+
+    def test_invalid_rules_fall_back_to_defaults(self, app_support):
+        """Test invalid rules are reported in the menu and replaced with the default sections"""
+        (app_support / "config.ini").write_text(
+            "[Gitlab]\nfeeds = https://gitlab.com/feed.atom\nrefresh_interval = 5m\nhide = color:red\n"
+        )
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.merge_requests = [
+            MergeRequest(id="1", title="MR 1", link="https://gitlab.com/mr/1"),
+            MergeRequest(id="2", title="Draft: MR 2", link="https://gitlab.com/mr/2", is_draft=True),
+        ]
+
+        app.build_menu()
+
+        assert app.menu["rules_error"].title.startswith("⚠️ Invalid rules, using the default ones: Unknown condition")
+        menu_titles = [item.title for item in app.menu.values() if hasattr(item, "title")]
+        assert menu_titles[4:8] == ["Merge Requests", "MR 1", "Draft Merge Requests", "Draft: MR 2"]
+
+    def test_build_menu_shows_rate_limits(self):
+        """Test hosts which asked to back off are shown in the menu, without flagging feeds as failing"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        until = datetime(2024, 5, 10, 14, 30).timestamp()
+
+        with patch.object(app.engine, "get_throttled_hosts", return_value={"gitlab.example.com": until}):
+            app.build_menu()
+            app.update_title()
+
+        assert (
+            app.menu["throttled"].title
+            == "⏳ Rate limited by gitlab.example.com until 14:30, showing the last known MRs"
+        )
+        assert app.title == "0"
+
+    @patch("main.rumps.quit_application")
+    def test_webhooks_update_the_menu(self, mock_quit, app_support):
+        """Test MRs opened and merged are shown and removed as soon as Gitlab's webhooks tell about them"""
+        (app_support / "config.ini").write_text(
+            "[Gitlab]\nfeeds = https://gitlab.com/groups/group/-/merge_requests.atom\nrefresh_interval = 5m\n"
+            "webhook_listen = 127.0.0.1:0\nwebhook_secret = s3cret\n"
+        )
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+            # only MRs of projects the feeds cover are added
+            app.refresh(None).join()
+        port = app.webhook_server.server_port
+
+        def post(state, action):
+            link = "https://gitlab.com/group/project/-/merge_requests/1"
+            payload = {
+                "object_kind": "merge_request",
+                "user": {"name": "Jane Doe"},
+                "project": {"path_with_namespace": "group/project"},
+                "object_attributes": {"title": "Fix bug", "url": link, "state": state, "action": action},
+            }
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request(
+                "POST",
+                "/gitlab",
+                json.dumps(payload),
+                {"X-Gitlab-Event": "Merge Request Hook", "X-Gitlab-Token": "s3cret"},
+            )
+            assert connection.getresponse().status == 202
+            connection.close()
+
+        post("opened", "open")
+        assert [mr.title for mr in app.merge_requests] == ["Fix bug"]
+        assert app.title == "1"
+        assert [mr.title for mr in snapshot.load(open(app_support / "snapshot.json"))[0]] == ["Fix bug"]
+
+        post("merged", "merge")
+        assert app.merge_requests == []
+        assert app.title == "0"
+
+        app.quit_application(None)
+        with pytest.raises(OSError):
+            http.client.HTTPConnection("127.0.0.1", port, timeout=1).request("POST", "/gitlab")
+
+    @patch("feedparser.parse")
+    def test_build_menu_marks_new_and_old_merge_requests(self, mock_parse, app_support):
+        """Test MRs showing up since the menu was last closed are marked as new, and those open for days show their
+        age, from the history, or how long they've been seen when their feed doesn't tell when they were opened
+        """
+        published = datetime.fromtimestamp(time.time() - 3 * 24 * 60 * 60 - 60).astimezone().isoformat()
+        old = Mock(id="https://gitlab.com/mr/1", title="Old MR", link="https://gitlab.com/mr/1", published=published)
+        new = Mock(id="https://gitlab.com/mr/2", title="New MR", link="https://gitlab.com/mr/2")
+        mock_parse.return_value = Mock(bozo=False, entries=[old])
+        app = MergeRequestsMonitorApp()
+        app.refresh(None).join()
+        assert app.menu[old.id].title == "Old MR · 3d"
+
+        mock_parse.return_value = Mock(bozo=False, entries=[old, new])
+        app.refresh(None).join()
+        assert app.menu[new.id].title == "🆕 New MR"
+        assert (app_support / "history.sqlite3").exists()
+
+        app.menu_closed()
+        assert [app.menu[old.id].title, app.menu[new.id].title] == ["Old MR · 3d", "New MR"]
+
+        with patch("main.time.time", return_value=time.time() + 2 * 24 * 60 * 60):
+            app.update_markers()
+        app.build_menu()
+        assert [app.menu[old.id].title, app.menu[new.id].title] == ["Old MR · 5d", "New MR · seen 2d"]
+
+    @patch("feedparser.parse")
+    def test_failing_history_is_disabled_on_the_main_thread(self, mock_parse):
+        """Test a history which can't be written stops being kept, by the main thread which reads it"""
+        link = "https://gitlab.com/mr/1"
+        mock_parse.return_value = Mock(bozo=False, entries=[Mock(id=link, title="MR 1", link=link, updated=None)])
+        app = MergeRequestsMonitorApp()
+
+        deferred = []
+        with patch.object(app.history, "record", side_effect=sqlite3.OperationalError("disk I/O error")):
+            with patch("main.AppHelper.callAfter", side_effect=lambda func, *args: deferred.append((func, args))):
+                app.refresh(None).join()
+
+        assert app.history is not None
+        for func, args in deferred:
+            func(*args)
+        assert app.history is None
+        assert str(app.history_error) == "disk I/O error"
+        assert app.menu[link].title == "MR 1"
+
     def test_build_menu_includes_refresh_interval_options(self):
         """Test menu includes all refresh interval options"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         app.build_menu()
@@ -211,7 +1066,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_save_config(self):
         """Test saving configuration to file"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.feed_urls = ["https://gitlab.com/feed1.atom", "https://gitlab.com/feed2.atom"]
         app.refresh_interval_label = "10m"
@@ -230,7 +1085,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_get_or_create_config_existing_file(self):
         """Test loading existing config file"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         # Config should be loaded successfully
@@ -239,7 +1094,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_get_or_create_config_creates_default(self):
         """Test creating default config when file doesn't exist"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         # Config should be loaded (either default or existing)
@@ -249,38 +1104,64 @@ class TestMergeRequestsMonitorApp:
     @patch("main.webbrowser.open_new_tab")
     def test_open_url(self, mock_browser):
         """Test opening MR URL in browser"""
-        entry1 = Mock(title="Fix bug", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="Add feature", link="https://gitlab.com/mr/2")
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        entry1 = MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1")
+        entry2 = MergeRequest(id="2", title="Add feature", link="https://gitlab.com/mr/2")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [entry1, entry2]
+        app.build_menu()
 
-        # Create a mock menu item
-        sender = Mock()
-        sender.title = "Fix bug"
-
-        app.open_url(sender)
+        app.open_url(app.menu["1"])
 
         mock_browser.assert_called_once_with("https://gitlab.com/mr/1")
 
     @patch("main.webbrowser.open_new_tab")
     def test_open_url_with_html_entities(self, mock_browser):
         """Test opening MR URL with HTML entities in title"""
-        entry = Mock(title="Fix &quot;bug&quot;", link="https://gitlab.com/mr/1")
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        entry = MergeRequest.from_entry(Mock(id="1", title="Fix &quot;bug&quot;", link="https://gitlab.com/mr/1"))
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         app.merge_requests = [entry]
+        app.build_menu()
 
-        sender = Mock()
-        sender.title = 'Fix "bug"'  # Unescaped version
+        sender = app.menu["1"]
+        assert sender.title == 'Fix "bug"'  # Unescaped version
 
         app.open_url(sender)
 
         mock_browser.assert_called_once_with("https://gitlab.com/mr/1")
 
+    @patch("main.webbrowser.open_new_tab")
+    def test_open_url_with_duplicated_titles(self, mock_browser):
+        """Test MRs sharing a title open only their own URL"""
+        entry1 = MergeRequest(id="1", title="Bump dependencies", link="https://gitlab.com/mr/1")
+        entry2 = MergeRequest(id="2", title="Bump dependencies", link="https://gitlab.com/mr/2")
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.merge_requests = [entry1, entry2]
+        app.build_menu()
+
+        app.open_url(app.menu["2"])
+
+        mock_browser.assert_called_once_with("https://gitlab.com/mr/2")
+
+    @patch("main.webbrowser.open_new_tab")
+    def test_open_url_after_title_change(self, mock_browser):
+        """Test an MR retitled by a refresh still opens its URL"""
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+        app.merge_requests = [MergeRequest(id="1", title="Draft: Fix bug", link="https://gitlab.com/mr/1")]
+        app.build_menu()
+        app.merge_requests = [MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1")]
+        app.build_menu()
+
+        app.open_url(app.menu["1"])
+
+        mock_browser.assert_called_once_with("https://gitlab.com/mr/1")
+
     def test_set_refresh_interval(self):
         """Test changing refresh interval"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         initial_interval = app.refresh_interval_label
 
@@ -302,7 +1183,7 @@ class TestMergeRequestsMonitorApp:
 
     def test_set_preferences(self):
         """Test setting preferences via dialog"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         # Mock the preferences dialog
@@ -316,9 +1197,46 @@ class TestMergeRequestsMonitorApp:
 
             assert app.feed_urls == ["https://gitlab.com/feed1.atom", "https://gitlab.com/feed2.atom"]
 
+    @patch("feedparser.parse")
+    def test_set_preferences_cancels_refresh_in_progress(self, mock_parse, mock_stream):
+        """Test saving preferences interrupts the refresh of the previous feeds and refreshes the new ones instead"""
+        started = threading.Event()
+
+        def stream(url, headers=None):
+            if url == "https://gitlab.com/hung.atom":
+                started.set()
+                while True:
+                    app.engine.session.check_cancelled()
+                    time.sleep(0.01)
+            return FakeResponse(url=url)
+
+        mock_stream.side_effect = stream
+        entry = Mock(id="https://gitlab.com/mr/1", title="Fix bug", link="https://gitlab.com/mr/1")
+        mock_parse.return_value = Mock(bozo=False, entries=[entry])
+
+        app = MergeRequestsMonitorApp()
+        app.feed_urls = ["https://gitlab.com/hung.atom"]
+        thread = app.refresh(None)
+        started.wait(1)
+
+        with patch("rumps.Window") as mock_window:
+            mock_window.return_value.run.return_value = Mock(clicked=True, text="https://gitlab.com/feed.atom")
+            app.set_preferences(None)
+        thread.join(1)
+        rerun = app.refresh_thread
+        if rerun is not None:
+            rerun.join()
+
+        assert not thread.is_alive()
+        assert [mr.title for mr in app.merge_requests] == ["Fix bug"]
+        assert app.title == "1"
+        # the cancelled refresh isn't recorded as a failure
+        assert "https://gitlab.com/hung.atom" not in app.engine.feeds
+        assert [feed.url for feed in app.diagnostics.latest.feeds] == ["https://gitlab.com/feed.atom"]
+
     def test_set_preferences_cancel(self):
         """Test canceling preferences dialog"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
         original_feeds = app.feed_urls.copy()
 
@@ -338,7 +1256,17 @@ class TestMergeRequestsMonitorApp:
     @patch("main.rumps.quit_application")
     def test_quit_application(self, mock_quit):
         """Test quitting the application"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+            app = MergeRequestsMonitorApp()
+
+        app.quit_application(None)
+
+        mock_quit.assert_called_once_with(None)
+
+    @patch("main.rumps.quit_application")
+    def test_quit_before_startup_finished(self, mock_quit):
+        """Test quitting before the run loop started, and with it the timer"""
+        with patch("main.AppHelper.callAfter"):
             app = MergeRequestsMonitorApp()
 
         app.quit_application(None)
@@ -348,7 +1276,7 @@ class TestMergeRequestsMonitorApp:
     @patch("main.rumps.alert")
     def test_about_dialog(self, mock_alert):
         """Test about dialog"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         app.about(None)
@@ -360,24 +1288,24 @@ class TestMergeRequestsMonitorApp:
 
     def test_timer_starts_automatically(self):
         """Test timer starts automatically on initialization"""
-        with patch("main.feedparser.parse", return_value=Mock(bozo=False, entries=[])):
+        with patch("feedparser.parse", return_value=Mock(bozo=False, entries=[])):
             app = MergeRequestsMonitorApp()
 
         assert hasattr(app, "timer")
         assert isinstance(app.timer, rumps.Timer)
-        # Timer interval should match the configured refresh interval
-        expected_interval = app.get_refresh_interval(app.refresh_interval_label)
-        assert app.timer.interval == expected_interval
+        # the timer just ticks, the scheduler decides when feeds are fetched
+        assert app.timer.interval == TICK_INTERVAL
+        assert app.engine.scheduler.max_interval == app.get_refresh_interval(app.refresh_interval_label)
 
-    @patch("main.feedparser.parse")
+    @patch("feedparser.parse")
     def test_refresh_clears_previous_merge_requests(self, mock_parse):
         """Test refresh clears previous MRs before fetching new ones"""
         # First call returns 2 entries
-        entry1 = Mock(title="MR 1", link="https://gitlab.com/mr/1")
-        entry2 = Mock(title="MR 2", link="https://gitlab.com/mr/2")
+        entry1 = Mock(id="https://gitlab.com/mr/1", title="MR 1", link="https://gitlab.com/mr/1")
+        entry2 = Mock(id="https://gitlab.com/mr/2", title="MR 2", link="https://gitlab.com/mr/2")
         mock_doc1 = Mock(bozo=False, entries=[entry1, entry2])
         # Second call returns only 1 entry
-        entry3 = Mock(title="MR 3", link="https://gitlab.com/mr/3")
+        entry3 = Mock(id="https://gitlab.com/mr/3", title="MR 3", link="https://gitlab.com/mr/3")
         mock_doc2 = Mock(bozo=False, entries=[entry3])
 
         mock_parse.side_effect = [mock_doc1, mock_doc2]
@@ -386,10 +1314,10 @@ class TestMergeRequestsMonitorApp:
         app.feed_urls = ["https://gitlab.com/feed.atom"]
 
         # First refresh
-        app.refresh(None)
+        app.refresh(None).join()
         assert len(app.merge_requests) == 2
 
         # Second refresh should clear and reload
-        app.refresh(None)
+        app.refresh(None).join()
         assert len(app.merge_requests) == 1
         assert app.merge_requests[0].title == "MR 3"
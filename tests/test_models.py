@@ -0,0 +1,75 @@
+import pickle
+
+import feedparser
+import pytest
+
+from mergerequestsmonitor.atom import AtomEntry
+from mergerequestsmonitor.models import MergeRequest, parse_timestamp, project_from_link
+
+
+class TestMergeRequest:
+    """Test suite for the MergeRequest record"""
+
+    def test_from_feedparser_entry(self):
+        """Test records built from feedparser entries are normalised"""
+        entry = feedparser.FeedParserDict(
+            id="https://gitlab.com/group/project/-/merge_requests/2",
+            title="Draft: Fix &quot;bug&quot;",
+            link="https://gitlab.com/group/project/-/merge_requests/2",
+            author="Jane Doe",
+            published="2024-05-01T10:00:00Z",
+            updated="2024-05-02T10:00:00Z",
+            summary="<p>A long description nobody reads in a menu</p>",
+        )
+
+        merge_request = MergeRequest.from_entry(entry)
+
+        assert merge_request.id == "https://gitlab.com/group/project/-/merge_requests/2"
+        assert merge_request.title == 'Draft: Fix "bug"'
+        assert merge_request.author == "Jane Doe"
+        assert merge_request.project == "group/project"
+        assert merge_request.updated == 1714644000.0
+        assert merge_request.created == 1714557600.0
+        assert merge_request.is_draft
+
+    def test_from_atom_entry(self):
+        """Test records built from the streaming parser's entries"""
+        entry = AtomEntry(title="Add feature", link="https://gitlab.com/a/b/c/-/merge_requests/1")
+
+        merge_request = MergeRequest.from_entry(entry)
+
+        assert merge_request.id == "https://gitlab.com/a/b/c/-/merge_requests/1"
+        assert merge_request.project == "a/b/c"
+        assert merge_request.updated is None
+        assert not merge_request.is_draft
+
+    def test_immutable(self):
+        """Test records can't be modified nor grow new attributes"""
+        merge_request = MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1")
+
+        with pytest.raises(AttributeError):
+            merge_request.title = "Another title"
+        with pytest.raises(AttributeError):
+            merge_request.summary = "Not kept"
+
+    def test_equality_and_pickling(self):
+        """Test records compare by value and survive a pickle round trip"""
+        merge_request = MergeRequest(id="1", title="Fix bug", link="https://gitlab.com/mr/1", updated=1.0)
+
+        assert merge_request == MergeRequest(*merge_request.astuple())
+        assert pickle.loads(pickle.dumps(merge_request)) == merge_request
+        assert len({merge_request, MergeRequest(**merge_request.asdict())}) == 1
+
+    @pytest.mark.parametrize(
+        "text, expected",
+        [("2024-05-02T10:00:00Z", 1714644000.0), ("2024-05-02T12:00:00.000+02:00", 1714644000.0), ("soon", None)],
+    )
+    def test_parse_timestamp(self, text, expected):
+        """Test Atom and API dates are turned into timestamps"""
+        assert parse_timestamp(text) == expected
+
+    def test_project_from_link(self):
+        """Test project paths are taken from MR links"""
+        assert project_from_link("https://gitlab.com/group/project/-/merge_requests/1") == "group/project"
+        assert project_from_link("https://example.com/mr/1") is None
+        assert project_from_link(None) is None
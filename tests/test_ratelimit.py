@@ -0,0 +1,128 @@
+import time
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from mergerequestsmonitor.engine import Engine
+from mergerequestsmonitor.ratelimit import (
+    DEFAULT_RATE,
+    Throttled,
+    TokenBucket,
+    parse_rate,
+    parse_reset,
+    parse_retry_after,
+)
+from mergerequestsmonitor.scheduler import Scheduler
+from mergerequestsmonitor.session import Session
+from tests.conftest import ATOM_FEED
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    """Stands in for a rate limited Gitlab: answers "429 Too Many Requests" while `server.limited` says so, asking to
+    retry after `server.retry_after` seconds, and serves a feed otherwise
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.limited:
+            self.server.limited -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", self.server.retry_after)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(ATOM_FEED)))
+        self.send_header("RateLimit-Remaining", "100")
+        self.end_headers()
+        self.wfile.write(ATOM_FEED)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    server = serve(LimitedHandler, requests=0, limited=0, retry_after="120")
+    server.url = f"http://127.0.0.1:{server.server_port}/group/project/-/merge_requests.atom"
+    return server
+
+
+def test_token_bucket_paces_bursts(clock):
+    """Test requests beyond the burst capacity wait for tokens, and are refused when they'd wait too long"""
+    bucket = TokenBucket("gitlab.com", rate=1, capacity=2, clock=clock)
+
+    assert [bucket.reserve(max_wait=2.5) for _ in range(4)] == [0, 0, 1, 2]
+    with pytest.raises(Throttled) as exc_info:
+        bucket.reserve(max_wait=2.5)
+    assert exc_info.value.delay == 3
+
+    clock.now += 10
+    assert bucket.reserve() == 0
+
+
+def test_rate_limits_must_be_positive(clock):
+    """Test `rate_limit` settings buckets couldn't refill at are replaced with the default rate"""
+    assert [parse_rate(value) for value in ("2.5", "0", "-1", "nan", "fast", None)] == [2.5] + [DEFAULT_RATE] * 5
+
+    bucket = TokenBucket("gitlab.com", rate=parse_rate("0"), capacity=1, clock=clock)
+    assert [bucket.reserve() for _ in range(2)] == [0, 1 / DEFAULT_RATE]
+
+
+def test_token_bucket_follows_server_limits(clock):
+    """Test `RateLimit-*` headers and 429s' `Retry-After` make hosts back off"""
+    bucket = TokenBucket("gitlab.com", rate=1, capacity=10, clock=clock)
+
+    bucket.update(200, {"RateLimit-Remaining": "1"})
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 1
+
+    bucket.update(200, {"RateLimit-Remaining": "0", "RateLimit-Reset": "30"})
+    assert bucket.blocked_for() == 30
+    bucket.update(429, {"Retry-After": "120"})
+    assert bucket.blocked_for() == 120
+    clock.now += 120
+    assert bucket.blocked_for() == 0
+
+    assert parse_retry_after(formatdate(1_000_060, usegmt=True), now=1_000_000) == 60
+    assert parse_retry_after("soon") is None
+    assert parse_reset("1700000030", now=1_700_000_000) == 30
+
+
+def test_short_retry_after_is_waited_for(server):
+    """Test a 429 asking to retry within a few seconds is sent again once, after that long"""
+    server.limited, server.retry_after = 1, "1"
+    with Session() as session:
+        started = time.monotonic()
+        assert session.get(server.url).status == 200
+        assert time.monotonic() - started >= 1
+    assert server.requests == 2
+
+
+def test_throttled_feeds_are_postponed(server, tmp_path):
+    """Test feeds rate limited for long are postponed rather than failing, without another request until then"""
+    engine = Engine(lambda name, mode="r": open(tmp_path / name, mode), Scheduler(max_interval=300))
+    merge_requests, _ = engine.fetch_merge_requests([server.url])
+    assert len(merge_requests) == 2
+
+    server.limited = 1
+    engine.scheduler.clock = lambda: time.time() + 300
+    merge_requests, _ = engine.fetch_merge_requests([server.url], previous=merge_requests)
+    feed = engine.feeds[server.url]
+    assert len(merge_requests) == 2
+    assert not feed.failing
+    assert feed.next_due == pytest.approx(time.time() + 300 + 120, abs=5)
+    assert engine.fetch_stats["throttled"] == 1
+    assert list(engine.get_throttled_hosts()) == [f"127.0.0.1:{server.server_port}"]
+
+    requests = server.requests
+    engine.fetch_merge_requests([server.url], previous=merge_requests)
+    assert server.requests == requests
+    assert engine.fetch_stats["throttled"] == 2
+    engine.close()
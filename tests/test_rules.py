@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.rules import Classifier, RuleError
+
+NOW = datetime(2024, 5, 10, 12, 30, tzinfo=timezone.utc).timestamp()
+DAY = 86400
+
+
+def merge_request(id, title="Fix bug", author="Jane Doe", project="group/api", age_days=1, is_draft=False):
+    return MergeRequest(
+        id=id,
+        title=title,
+        link=f"https://gitlab.com/{project}/-/merge_requests/{id}",
+        author=author,
+        project=project,
+        updated=NOW - age_days * DAY,
+        is_draft=is_draft,
+    )
+
+
+def query(url):
+    return parse_qsl(urlsplit(url).query)
+
+
+def test_classify_hides_and_sorts_in_a_single_pass():
+    """Test MRs matching a `hide` rule are left out, and the others go in the first section they match"""
+    classifier = Classifier.from_config(
+        hide="author:*bot*\ndraft project:group/sandbox\nage>30d",
+        sections="Mine: author:jane*\nDrafts: draft\nOthers:",
+    )
+    merge_requests = [
+        merge_request("1"),
+        merge_request("2", author="Renovate Bot"),
+        merge_request("3", author="John Roe", is_draft=True),
+        merge_request("4", author="John Roe", is_draft=True, project="group/sandbox"),
+        merge_request("5", author="John Roe", project="group/sandbox"),
+        merge_request("6", author="John Roe", age_days=40),
+        merge_request("7", is_draft=True),
+    ]
+
+    sections = classifier.classify(merge_requests, now=NOW)
+
+    assert [(title, [mr.id for mr in mrs]) for title, mrs in sections] == [
+        ("Mine", ["1", "7"]),
+        ("Drafts", ["3"]),
+        ("Others", ["5"]),
+    ]
+
+
+def test_default_sections_split_drafts():
+    """Test the default sections list MRs then drafts, and that MRs matching no section aren't displayed"""
+    sections = Classifier.from_config().classify([merge_request("1", is_draft=True), merge_request("2")], now=NOW)
+    assert [(title, [mr.id for mr in mrs]) for title, mrs in sections] == [
+        ("Merge Requests", ["2"]),
+        ("Draft Merge Requests", ["1"]),
+    ]
+
+    sections = Classifier.from_config(sections="Drafts: draft").classify([merge_request("1")], now=NOW)
+    assert sections == [("Drafts", [])]
+
+
+def test_conditions_feeds_dont_tell_never_hold():
+    """Test rules on usernames, labels or states hide nothing locally, negated or not"""
+    classifier = Classifier.from_config(hide="label:wip\n!username:jane\nstate:merged")
+    sections = classifier.classify([merge_request("1")], now=NOW)
+    assert [mr.id for _, mrs in sections for mr in mrs] == ["1"]
+
+    # unless they're told, like webhooks do
+    assert not classifier.hides(merge_request("1"), now=NOW, fields={"label": ["backend"]})
+    assert classifier.hides(merge_request("1"), now=NOW, fields={"label": ["backend", "wip"]})
+    assert classifier.hides(merge_request("1"), now=NOW, fields={"username": "joe"})
+
+
+@pytest.mark.parametrize(
+    "hide,sections",
+    [
+        ("color:red", ""),
+        ("age>3y", ""),
+        ("author", ""),
+        ("", ": draft"),
+        ("", "Drafts: draft:yes"),
+        ("label:wip draft", ""),
+        ("", "Mine: username:jane"),
+    ],
+)
+def test_invalid_rules_raise(hide, sections):
+    """Test unknown fields, durations, sections without a title and conditions only Gitlab can evaluate which it can't
+    be asked for are refused
+    """
+    with pytest.raises(RuleError):
+        Classifier.from_config(hide=hide, sections=sections)
+
+
+def test_push_down_to_feeds():
+    """Test single-condition `hide` rules become filters of merge requests feeds, without overriding the URL's"""
+    classifier = Classifier.from_config(
+        hide="draft\nusername:renovate-bot\nlabel:wip\nlabel:blocked\nage>30d\n!state:opened\nauthor:*bot* draft"
+    )
+    url = "https://gitlab.com/group/api/-/merge_requests.atom?feed_token=secret&state=all"
+
+    assert query(classifier.push_down(url, now=NOW)) == [
+        ("feed_token", "secret"),
+        ("state", "all"),
+        ("not[author_username][]", "renovate-bot"),
+        ("not[label_name][]", "wip"),
+        ("not[label_name][]", "blocked"),
+        ("wip", "no"),
+        ("updated_after", "2024-04-10T12:00:00Z"),
+    ]
+
+
+def test_push_down_every_rule_on_the_same_field():
+    """Test several `hide` rules on the same field are all handed to Gitlab, or refused when Gitlab can't take them"""
+    classifier = Classifier.from_config(hide="username:bot1\nusername:bot2\nlabel:wip\nlabel:blocked")
+    feed_url = "https://gitlab.com/group/api/-/merge_requests.atom"
+    assert query(classifier.push_down(feed_url, now=NOW)) == [
+        ("not[author_username][]", "bot1"),
+        ("not[author_username][]", "bot2"),
+        ("not[label_name][]", "wip"),
+        ("not[label_name][]", "blocked"),
+    ]
+
+    classifier = Classifier.from_config(hide="label:wip\nlabel:blocked\nusername:bot1\nusername:bot1")
+    assert query(classifier.push_down("https://gitlab.com/api/v4/merge_requests", now=NOW)) == [
+        ("not[labels]", "wip,blocked"),
+        ("not[author_username]", "bot1"),
+    ]
+
+    # the REST API only leaves out one author
+    classifier = Classifier.from_config(hide="username:bot1\nusername:bot2")
+    with pytest.raises(RuleError):
+        classifier.push_down("https://gitlab.com/api/v4/merge_requests", now=NOW)
+    # and Gitlab only keeps one state or author
+    for hide in ("!state:opened\n!state:merged", "!username:jane\n!username:joe"):
+        with pytest.raises(RuleError):
+            Classifier.from_config(hide=hide)
+
+
+def test_push_down_to_the_api():
+    """Test `hide` rules become filters of the REST API, and that other URLs are left alone"""
+    classifier = Classifier.from_config(hide="!draft\n!label:backend\n!label:api\nage<2h\n!username:jane")
+    url = "https://gitlab.com/api/v4/groups/group/merge_requests"
+
+    assert query(classifier.push_down(url, now=NOW)) == [
+        ("wip", "yes"),
+        ("labels", "backend,api"),
+        ("updated_before", "2024-05-10T10:00:00Z"),
+        ("author_username", "jane"),
+    ]
+    snapshot_url = "http://127.0.0.1:8765/merge_requests.json"
+    assert Classifier.from_config(hide="draft").push_down(snapshot_url, now=NOW) == snapshot_url
+    # which can't hide anything only Gitlab knows
+    with pytest.raises(RuleError):
+        classifier.push_down(snapshot_url, now=NOW)
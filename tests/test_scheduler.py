@@ -0,0 +1,78 @@
+from mergerequestsmonitor.feeds import FeedState
+from mergerequestsmonitor.scheduler import Scheduler
+
+
+class TestScheduler:
+    """Test suite for the per-feed refresh scheduler"""
+
+    def test_next_interval(self):
+        """Test intervals double while feeds don't change, up to the user's interval, and are halved on changes"""
+        scheduler = Scheduler(max_interval=300, min_interval=60)
+
+        assert scheduler.next_interval(None, changed=False) == 60
+        assert scheduler.next_interval(60, changed=False) == 120
+        assert scheduler.next_interval(240, changed=False) == 300
+        assert scheduler.next_interval(300, changed=False) == 300
+        assert scheduler.next_interval(300, changed=True) == 150
+        assert scheduler.next_interval(100, changed=True) == 60
+
+    def test_user_interval_below_minimum(self):
+        """Test a refresh interval lower than the minimum one is honoured"""
+        scheduler = Scheduler(max_interval=30, min_interval=60)
+
+        assert scheduler.next_interval(None, changed=True) == 30
+        assert scheduler.next_interval(30, changed=False) == 30
+
+    def test_jitter(self):
+        """Test delays are shortened by up to `jitter`, except for the user's interval"""
+        scheduler = Scheduler(max_interval=300, jitter=0.1, random=lambda: 1.0)
+        assert scheduler.delay(100) == 90
+        assert scheduler.delay(300) == 300
+
+        scheduler.random = lambda: 0.0
+        assert scheduler.delay(100) == 100
+
+    def test_schedule_and_due(self, clock):
+        """Test feeds become due once their delay went by"""
+        clock.now = 1000.0
+        scheduler = Scheduler(max_interval=300, min_interval=60, clock=clock, random=lambda: 0.5)
+        busy, dormant = FeedState("https://gitlab.com/busy.atom"), FeedState("https://gitlab.com/dormant.atom")
+
+        assert scheduler.due([busy, dormant]) == [busy, dormant]
+
+        scheduler.schedule(busy, changed=True)
+        scheduler.schedule(dormant, changed=False)
+        scheduler.schedule(dormant, changed=False)
+
+        assert busy.next_due == 1000.0 + 57
+        assert dormant.next_due == 1000.0 + 114
+        clock.now = 1060.0
+        assert scheduler.due([busy, dormant]) == [busy]
+
+    def test_compared_to_fixed_interval(self, clock):
+        """Test a day of polling: the dormant feed costs no more than with a fixed 5m timer, bursts are caught sooner"""
+        clock.now = 0.0
+        scheduler = Scheduler(max_interval=300, min_interval=60, clock=clock, random=lambda: 0.5)
+        busy, dormant = feeds = [
+            FeedState("https://gitlab.com/busy.atom"),
+            FeedState("https://gitlab.com/dormant.atom"),
+        ]
+
+        requests = {feed.url: 0 for feed in feeds}
+        changed_at, delays = None, []
+        while clock.now < 24 * 60 * 60:
+            # the busy feed changes every 2 minutes for an hour (someone's reviewing), the dormant one never does
+            if clock.now % 120 == 0 and 3600 <= clock.now < 7200:
+                changed_at = changed_at if changed_at is not None else clock.now
+            for feed in scheduler.due(feeds):
+                requests[feed.url] += 1
+                changed = feed is busy and changed_at is not None
+                if changed:
+                    delays.append(clock.now - changed_at)
+                    changed_at = None
+                scheduler.schedule(feed, changed=changed)
+            clock.now += 15
+
+        assert requests[dormant.url] <= 24 * 60 * 60 / 300 + 2
+        # a fixed 5m timer notices changes 150s after they happen on average
+        assert sum(delays) / len(delays) < 60
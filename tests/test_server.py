@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from mergerequestsmonitor import server
+from mergerequestsmonitor.diagnostics import FeedTiming
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.session import Session
+
+MERGE_REQUESTS = [
+    MergeRequest(title="Fix bug", link="https://gitlab.com/group/project/-/merge_requests/1", updated=1.0),
+    MergeRequest(title="Draft: Add feature", link="https://gitlab.com/group/project/-/merge_requests/2"),
+]
+
+
+@pytest.fixture
+def store():
+    return server.SnapshotStore()
+
+
+@pytest.fixture
+def snapshot_url(store, serve):
+    snapshot_server = serve(server.SnapshotServer(("127.0.0.1", 0), store))
+    return f"http://127.0.0.1:{snapshot_server.server_port}{server.SNAPSHOT_PATH}"
+
+
+def test_fetch_long_poll_outlasts_read_timeout(store, snapshot_url):
+    """Test long-polls fetched as feeds wait for the daemon's answer longer than other requests do"""
+    store.update(MERGE_REQUESTS, 1000.0)
+    _, etag = store.get()
+
+    with Session(read_timeout=0.2) as session:
+        document = server.fetch(session, f"{snapshot_url}?wait=0.5", etag=etag)
+        assert not document.bozo
+        assert document.status == 304
+
+        with pytest.raises(TimeoutError):
+            session.get(f"{snapshot_url}?wait=0.5", headers={"If-None-Match": etag})
+
+
+def test_is_snapshot_url():
+    """Test snapshots served by a daemon are told apart from feeds"""
+    assert server.is_snapshot_url("http://127.0.0.1:8765/merge_requests.json")
+    assert server.is_snapshot_url("https://monitor.example.com/team/merge_requests.json")
+    assert not server.is_snapshot_url("https://gitlab.com/group/project/-/merge_requests.atom")
+    assert not server.is_snapshot_url("https://gitlab.com/api/v4/merge_requests")
+
+
+def test_store_etag(store):
+    """Test the ETag only changes with the MRs, not with the time they were fetched at"""
+    assert store.get() == (None, None)
+
+    store.update(MERGE_REQUESTS, 1000.0)
+    body, etag = store.get()
+    store.update(MERGE_REQUESTS, 2000.0)
+    assert store.get() == (body, etag)
+
+    store.update(MERGE_REQUESTS[:1], 3000.0)
+    assert store.get()[1] != etag
+
+
+def test_serves_snapshot(store, snapshot_url, session):
+    """Test the snapshot is served with an ETag and conditional requests get "304 Not Modified" """
+    assert session.get(snapshot_url).status == 503
+
+    store.update(MERGE_REQUESTS, 1000.0)
+    timing = FeedTiming(snapshot_url)
+    document = server.fetch(session, snapshot_url, timing=timing)
+    assert not document.bozo
+    assert document.status == 200
+    assert document.merge_requests == MERGE_REQUESTS
+    assert document.etag == store.get()[1]
+    assert timing.bytes == len(store.get()[0])
+
+    assert server.fetch(session, snapshot_url, etag=document.etag).status == 304
+    assert session.get(snapshot_url.replace(server.SNAPSHOT_PATH, "/other")).status == 404
+
+
+def test_fetch_errors(session):
+    """Test errors are flagged with bozo instead of raised"""
+    document = server.fetch(session, "http://127.0.0.1:1/merge_requests.json")
+    assert document.bozo
+    assert document.merge_requests == []
+
+
+def test_long_poll(store, snapshot_url, session):
+    """Test long-polls wait for the MRs to change, or time out with "304 Not Modified" """
+    store.update(MERGE_REQUESTS, 1000.0)
+    _, etag = store.get()
+
+    started = time.perf_counter()
+    response = session.get(f"{snapshot_url}?wait=0.2", headers={"If-None-Match": etag})
+    assert response.status == 304
+    assert time.perf_counter() - started >= 0.2
+
+    timer = threading.Timer(0.2, store.update, args=(MERGE_REQUESTS[:1], 2000.0))
+    timer.start()
+    started = time.perf_counter()
+    response = session.get(f"{snapshot_url}?wait=30", headers={"If-None-Match": etag})
+    timer.join()
+
+    assert response.status == 200
+    assert response.headers["ETag"] == store.get()[1]
+    assert time.perf_counter() - started < 10
@@ -0,0 +1,174 @@
+import gzip
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from mergerequestsmonitor.diagnostics import RefreshTiming
+from mergerequestsmonitor.engine import Engine
+from mergerequestsmonitor.scheduler import Scheduler
+from mergerequestsmonitor.session import Cancelled, ResponseTooLarge, Session
+from tests.conftest import ATOM_FEED
+
+BODY = b"<feed>" + b"x" * 100_000 + b"</feed>"
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Serves `BODY` at /feed.atom, a redirect to it at /moved, and the same body one byte every 50ms at /slow.
+
+    /gzip and /deflate serve it compressed, and merge requests feeds serve `ATOM_FEED` gzipped, when it's accepted.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.accept_encodings.append(self.headers.get("Accept-Encoding"))
+        if self.path in ("/gzip", "/deflate") or self.path.endswith("/merge_requests.atom"):
+            body = ATOM_FEED if self.path.endswith(".atom") else BODY
+            encoding = "deflate" if self.path == "/deflate" else "gzip"
+            body = raw_deflate(body) if encoding == "deflate" else gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/atom+xml")
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path == "/moved":
+            self.send_response(301)
+            self.send_header("Location", "/feed.atom")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        if self.path != "/slow":
+            self.wfile.write(BODY)
+            return
+
+        for i in range(len(BODY)):
+            self.wfile.write(BODY[i : i + 1])
+            self.wfile.flush()
+            time.sleep(0.05)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(serve):
+    server = serve(FeedHandler, accept_encodings=[])
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    return server
+
+
+@pytest.fixture
+def server(http_server):
+    return http_server.url
+
+
+def test_stream_reads_body_as_it_arrives(server):
+    """Test streamed bodies are read in chunks over a connection kept alive, following redirects"""
+    with Session() as session:
+        with session.stream(f"{server}/moved") as response:
+            assert response.status == 200
+            assert response.url == f"{server}/feed.atom"
+            first = response.read(10)
+            body = first + response.read()
+
+        assert first == b"<feed>xxxx"
+        assert body == BODY
+        assert response.bytes_read == len(BODY)
+        assert session.get(f"{server}/feed.atom").body == BODY
+        assert session.connections_opened == 1
+
+
+def test_responses_are_bounded(server):
+    """Test responses larger than `max_size` or slower than `read_timeout` are given up on"""
+    with Session(max_size=1000) as session:
+        with pytest.raises(ResponseTooLarge):
+            session.get(f"{server}/feed.atom")
+
+    with Session(read_timeout=0.3) as session:
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            session.get(f"{server}/slow")
+        assert time.monotonic() - started < 1
+
+
+def test_cancel_interrupts_requests_in_flight(server):
+    """Test cancelling a session interrupts its downloads, and refuses new ones until it's resumed"""
+    with Session() as session:
+        errors = []
+
+        def download():
+            try:
+                session.get(f"{server}/slow")
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=download)
+        thread.start()
+        time.sleep(0.2)
+        session.cancel()
+        thread.join(1)
+
+        assert not thread.is_alive()
+        assert [type(e) for e in errors] == [Cancelled]
+        with pytest.raises(Cancelled):
+            session.get(f"{server}/feed.atom")
+
+        session.resume()
+        assert session.get(f"{server}/feed.atom").body == BODY
+
+
+def test_compressed_responses_are_decoded_as_they_arrive(http_server):
+    """Test gzip and deflate are accepted, decompressed as they're read and still bounded once decompressed"""
+    with Session() as session:
+        for path in ("gzip", "deflate"):
+            with session.stream(f"{http_server.url}/{path}") as response:
+                first = response.read(10)
+                body = first + response.read()
+
+            assert first == b"<feed>xxxx"
+            assert body == BODY
+            assert response.bytes_read == len(BODY)
+            assert response.bytes_received < len(BODY) / 50
+
+        assert session.bytes_received < len(BODY) / 25
+        assert session.connections_opened == 1
+        assert all("gzip, deflate" in accepted for accepted in http_server.accept_encodings)
+
+    with Session(max_size=10_000) as session:
+        with pytest.raises(ResponseTooLarge):
+            session.get(f"{http_server.url}/gzip")
+
+
+def test_refreshes_report_connections_and_bytes_received(http_server, tmp_path):
+    """Test every feed of a host shares the connections of the engine's session, from a refresh to the next"""
+    feed_urls = [f"{http_server.url}/group/project{i}/-/merge_requests.atom" for i in range(4)]
+    engine = Engine(
+        lambda name, mode="r": open(tmp_path / name, mode), Scheduler(max_interval=300), fetch_concurrency=1
+    )
+
+    timings = [RefreshTiming(), RefreshTiming()]
+    for timing in timings:
+        merge_requests, _ = engine.fetch_merge_requests(feed_urls, timing=timing)
+    engine.close()
+
+    assert len(merge_requests) == 2
+    assert [timing.connections_opened for timing in timings] == [1, 0]
+    # gzipped, headers and all
+    assert timings[0].bytes_received == timings[1].bytes_received < len(feed_urls) * len(ATOM_FEED)
+    assert "0 connections opened" in timings[1].summary()
@@ -0,0 +1,39 @@
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.snapshot import Changes, merge
+
+
+def mr(id, title="MR", updated=None):
+    return MergeRequest(
+        id=id, title=title, link=f"https://gitlab.com/group/project/-/merge_requests/{id}", updated=updated
+    )
+
+
+class TestMerge:
+    """Test suite for merging the MRs of several feeds into a snapshot"""
+
+    def test_dedupes_keeping_most_recent(self):
+        """Test MRs listed by several feeds appear once, in their most recently updated version"""
+        group_feed = [mr("1", "Old title", updated=100.0), mr("2"), mr("3", updated=100.0)]
+        project_feed = [mr("3", "Older title", updated=50.0), mr("1", "New title", updated=200.0), mr("4")]
+
+        merge_requests, _ = merge([group_feed, project_feed])
+
+        assert [(m.id, m.title) for m in merge_requests] == [("1", "New title"), ("2", "MR"), ("3", "MR"), ("4", "MR")]
+
+    def test_changes(self):
+        """Test added, removed and changed MRs are told apart from the previous snapshot"""
+        previous = [mr("1"), mr("2"), mr("3")]
+
+        merge_requests, changes = merge([[mr("1"), mr("3", "Retitled", updated=100.0), mr("4")]], previous=previous)
+
+        assert changes == Changes(added=[mr("4")], removed=[mr("2")], changed=[mr("3", "Retitled", updated=100.0)])
+        assert changes
+
+    def test_no_changes(self):
+        """Test snapshots without any change are falsy"""
+        previous = [mr("1"), mr("2")]
+
+        merge_requests, changes = merge([[mr("2")], [mr("1"), mr("2")]], previous=previous)
+
+        assert merge_requests == [mr("2"), mr("1")]
+        assert not changes
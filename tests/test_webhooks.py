@@ -0,0 +1,230 @@
+import http.client
+import json
+import socket
+
+import pytest
+
+from mergerequestsmonitor.engine import PUSHED_TTL, Engine
+from mergerequestsmonitor.feeds import FeedState
+from mergerequestsmonitor.models import MergeRequest
+from mergerequestsmonitor.providers import get_provider
+from mergerequestsmonitor.rules import Classifier
+from mergerequestsmonitor.scheduler import Scheduler
+from mergerequestsmonitor.webhooks import MERGE_REQUEST_HOOK, WEBHOOK_PATH, WebhookServer, parse_address, parse_event
+
+MR_URL = "https://gitlab.com/group/project/-/merge_requests/1"
+
+
+def merge_request_hook(action="update", state="opened", title="Fix bug", updated_at="2024-05-02T10:00:00Z", **extra):
+    """A merge request event as Gitlab sends them, with only the fields that matter here and a few that don't"""
+    return {
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "user": {"id": 1, "name": "Jane Doe", "username": "jane"},
+        "project": {"id": 15, "name": "project", "path_with_namespace": "group/project"},
+        "object_attributes": {
+            "id": 99,
+            "iid": 1,
+            "title": title,
+            "state": state,
+            "action": action,
+            "url": MR_URL,
+            "created_at": "2024-05-01T10:00:00Z",
+            "updated_at": updated_at,
+            "draft": False,
+            "work_in_progress": False,
+            **extra,
+        },
+        "labels": [],
+        "changes": {},
+    }
+
+
+@pytest.fixture
+def server(serve):
+    events = []
+    return serve(WebhookServer(("127.0.0.1", 0), on_event=events.append, secret="s3cret"), events=events)
+
+
+def post(server, payload, path=WEBHOOK_PATH, event=MERGE_REQUEST_HOOK, token="s3cret"):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=5)
+    connection.request(
+        "POST", path, body, {"Content-Type": "application/json", "X-Gitlab-Event": event, "X-Gitlab-Token": token}
+    )
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+def test_parse_event():
+    """Test opened, updated, merged and closed MRs are read from Gitlab's payloads, whatever their dates look like"""
+    event = parse_event(merge_request_hook(action="open", title="Draft: Fix bug", draft=True))
+    assert not event.closed
+    assert event.merge_request == MergeRequest(
+        id=MR_URL,
+        title="Draft: Fix bug",
+        link=MR_URL,
+        author="Jane Doe",
+        project="group/project",
+        updated=1714644000.0,
+        is_draft=True,
+        created=1714557600.0,
+    )
+    assert event.fields == {"username": "jane", "label": [], "state": "opened"}
+
+    # who updates an MR isn't necessarily its author
+    event = parse_event(merge_request_hook(updated_at="2024-05-02 10:00:00 UTC", labels=[{"title": "wip"}]))
+    assert event.merge_request.author is None
+    assert event.fields == {"username": None, "label": ["wip"], "state": "opened"}
+    assert event.merge_request.updated == 1714644000.0
+    assert event.merged_with(MergeRequest(id=MR_URL, title="Old", link=MR_URL, author="John Roe")).author == "John Roe"
+
+    assert parse_event(merge_request_hook(action="merge", state="merged")).closed
+    assert parse_event(merge_request_hook(action="close", state="closed")).closed
+    assert parse_event({"object_kind": "push"}) is None
+    with pytest.raises(ValueError):
+        parse_event({"object_kind": "merge_request", "object_attributes": {"url": MR_URL}})
+
+    assert parse_address("127.0.0.1:8766") == ("127.0.0.1", 8766)
+    assert parse_address("8766") == ("127.0.0.1", 8766)
+
+
+def test_server_accepts_merge_request_events(server):
+    """Test merge request events POSTed with the secret token are handed over, and anything else is turned down"""
+    assert post(server, merge_request_hook()) == 202
+    assert [event.merge_request.id for event in server.events] == [MR_URL]
+
+    assert post(server, merge_request_hook(), token="wrong") == 401
+    assert post(server, merge_request_hook(), path="/github") == 404
+    assert post(server, {"object_kind": "push"}, event="Push Hook") == 204
+    assert post(server, b"{not json") == 400
+    assert len(server.events) == 1
+
+
+def test_requests_turned_down_close_the_connection(server):
+    """Test a request turned down before its body was read doesn't spoil the next one on the same connection"""
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=5)
+    body = json.dumps(merge_request_hook()).encode()
+    headers = {"Content-Type": "application/json", "X-Gitlab-Event": MERGE_REQUEST_HOOK}
+    for token, status in (("wrong", 401), ("s3cret", 202)):
+        connection.request("POST", WEBHOOK_PATH, body, {**headers, "X-Gitlab-Token": token})
+        response = connection.getresponse()
+        response.read()
+        assert response.status == status
+    connection.close()
+    assert len(server.events) == 1
+
+
+def test_non_ascii_tokens_are_turned_down(server):
+    """Test tokens which aren't ASCII are compared like any other"""
+    assert post(server, merge_request_hook(), token="sécret") == 401
+    assert server.events == []
+
+
+def test_negative_content_length_is_turned_down(server):
+    """Test a negative `Content-Length` is answered right away instead of waiting for the client to disconnect"""
+    with socket.create_connection(("127.0.0.1", server.server_port), timeout=5) as client:
+        client.sendall(
+            f"POST {WEBHOOK_PATH} HTTP/1.1\r\nHost: localhost\r\nX-Gitlab-Token: s3cret\r\n"
+            f"X-Gitlab-Event: {MERGE_REQUEST_HOOK}\r\nContent-Length: -1\r\n\r\n".encode()
+        )
+        assert client.recv(1024).startswith(b"HTTP/1.1 400 ")
+
+
+FEED_URL = "https://gitlab.com/group/project/-/merge_requests.atom"
+
+
+def new_engine(tmp_path, clock, rules=None):
+    return Engine(
+        lambda name, mode="r": open(tmp_path / name, mode), Scheduler(max_interval=300, clock=clock), rules=rules
+    )
+
+
+def test_engine_applies_events(tmp_path, clock):
+    """Test events update the MRs of the feeds listing them right away, and new MRs are kept until polling catches up"""
+    engine = new_engine(tmp_path, clock)
+    known = MergeRequest(id=MR_URL, title="Fix bug", link=MR_URL, author="John Roe", updated=1714600000.0)
+    engine.feeds = {FEED_URL: FeedState(FEED_URL, [known], etag='"1"', fetched_at=clock(), fingerprint="abc")}
+    feed = engine.feeds[FEED_URL]
+
+    merge_requests, changes = engine.apply_event(parse_event(merge_request_hook(title="Fix bugs")), previous=[known])
+    assert [(mr.title, mr.author) for mr in merge_requests] == [("Fix bugs", "John Roe")]
+    assert changes.changed == merge_requests
+    # the feed is downloaded in full next time: only polling can tell what webhooks missed
+    assert feed.etag is None and feed.fingerprint is None
+
+    new_url = "https://gitlab.com/group/project/-/merge_requests/2"
+    clock.now += 60
+    event = parse_event(merge_request_hook(action="open", url=new_url))
+    merge_requests, changes = engine.apply_event(event, previous=merge_requests)
+    assert [mr.id for mr in merge_requests] == [MR_URL, new_url]
+    assert changes.added == [merge_requests[1]]
+    event = parse_event(merge_request_hook(action="update", url=new_url, title="Add feature"))
+    merge_requests, changes = engine.apply_event(event, previous=merge_requests)
+    assert [mr.title for mr in merge_requests] == ["Fix bugs", "Add feature"]
+
+    event = parse_event(merge_request_hook(action="merge", state="merged"))
+    merge_requests, changes = engine.apply_event(event, previous=merge_requests)
+    assert [mr.id for mr in merge_requests] == [new_url]
+    assert feed.merge_requests == []
+
+    # the feed was fetched before the new MR was opened: it's kept until it's fetched again
+    engine.expire_pushed()
+    assert list(engine.pushed) == [new_url]
+    feed.fetched_at = clock.now + 30
+    engine.expire_pushed()
+    assert engine.pushed == {}
+
+
+def test_engine_only_adds_merge_requests_feeds_would_list(tmp_path, clock):
+    """Test only MRs just opened in a project a feed covers, and which rules don't hide, are added by events, and
+    for a while at most
+    """
+    engine = new_engine(tmp_path, clock, rules=Classifier.from_config(hide="label:wip"))
+    never_fetched = "https://gitlab.com/groups/group/-/merge_requests.atom"
+    engine.feeds = {never_fetched: FeedState(never_fetched)}
+
+    def pushed(project="group/project", **hook):
+        payload = merge_request_hook(**hook)
+        payload["project"]["path_with_namespace"] = project
+        engine.apply_event(parse_event(payload))
+        return list(engine.pushed)
+
+    assert pushed(action="update") == []
+    assert pushed(action="open", project="other/project") == []
+    assert pushed(action="open", url="https://gitlab.example.com/group/project/-/merge_requests/1") == []
+    assert pushed(action="open", labels=[{"title": "wip"}]) == []
+    assert pushed(action="reopen") == [MR_URL]
+    # labels added later hide it all the same
+    assert pushed(action="update", labels=[{"title": "wip"}]) == []
+
+    # a feed which never succeeds doesn't keep it forever
+    assert pushed(action="open") == [MR_URL]
+    clock.now += PUSHED_TTL - 1
+    engine.expire_pushed()
+    assert list(engine.pushed) == [MR_URL]
+    clock.now += 1
+    engine.expire_pushed()
+    assert engine.pushed == {}
+
+
+def test_feeds_covering_merge_requests():
+    """Test which feeds list the MRs of a project, from their URLs"""
+    mr = MergeRequest(id=MR_URL, link=MR_URL, project="group/project")
+    covering = [
+        "https://gitlab.com/group/project/-/merge_requests.atom?feed_token=abc",
+        "https://gitlab.com/groups/group/-/merge_requests.atom",
+        "https://gitlab.com/dashboard/merge_requests.atom?assignee_username=jane",
+        "https://gitlab.com/api/v4/merge_requests?scope=assigned_to_me",
+        "https://gitlab.com/api/v4/groups/group/merge_requests",
+        "https://gitlab.com/api/v4/projects/group%2Fproject/merge_requests",
+    ]
+    others = [
+        "https://gitlab.com/group/project2/-/merge_requests.atom",
+        "https://gitlab.example.com/group/project/-/merge_requests.atom",
+        "https://gitlab.com/api/v4/projects/12/merge_requests",
+        "https://github.com/group/project/pulls",
+        "http://127.0.0.1:8765/merge_requests.json",
+    ]
+    assert [url for url in covering + others if get_provider(url).covers(url, mr)] == covering